@@ -1,7 +1,4 @@
-import os
-import platform
 import subprocess
-import sys
 import shutil
 from qgis.PyQt.QtWidgets import QProgressBar, QMessageBox
 from qgis.PyQt.QtCore import QCoreApplication, QTimer
@@ -28,21 +25,9 @@ class DuckDBInstallerTask(QgsTask):
         # logger.log("Task run method started")
         try:
             logger.log("Starting DuckDB installation...")
-            if platform.system() == "Windows":
-                py_path = os.path.join(os.path.dirname(sys.executable), "python.exe")
-            elif platform.system() == "Darwin":
-                qgis_bin = os.path.dirname(sys.executable)
-                possible_paths = [
-                    os.path.join(qgis_bin, "python3"),
-                    os.path.join(qgis_bin, "bin", "python3"),
-                    os.path.join(qgis_bin, "Resources", "python", "bin", "python3"),
-                ]
-                py_path = next(
-                    (path for path in possible_paths if os.path.exists(path)),
-                    sys.executable,
-                )
-            else:
-                py_path = sys.executable
+            from .subprocess_runner import python_executable
+
+            py_path = python_executable()
 
             # logger.log(f"Using Python path: {py_path}")
             # logger.log(f"Running pip install command...")
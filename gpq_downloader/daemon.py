@@ -0,0 +1,539 @@
+"""
+Shared local download service.
+
+On multi-user workstations and terminal servers every QGIS session would
+otherwise keep its own cold DuckDB connections and caches and fetch the same
+data. The download daemon is a single process that all QGIS sessions of a user
+on the host submit jobs to over a loopback socket. It keeps warm DuckDB
+databases whose loaded extensions and Parquet metadata caches carry over from
+job to job, one plan cache, remote I/O tuning and byte range cache, and a
+result cache that copies the output of an identical earlier job instead of
+downloading it again. Its job scheduler runs a limited number of jobs at once,
+so the sessions share one bandwidth budget.
+
+There is one daemon per user rather than one per host: the daemon writes
+outputs with the permissions of the user running it, so a daemon shared with
+other users would let them write, and through the result cache read, that
+user's files. Its folder and state file must therefore be private to the user,
+which ensure_daemon checks before trusting them.
+
+Messages are JSON lines, as with run_in_subprocess. A client sends a "submit"
+request carrying the job and the token from the daemon's state file, then
+reads progress messages until the result or error arrives. Sending "cancel"
+or closing the connection cancels the job. The daemon is started on demand by
+the first client and exits after being idle for a while.
+
+Like the engine, this module has no Qt or QGIS dependencies.
+"""
+import getpass
+import json
+import logging
+import os
+import queue
+import secrets
+import shutil
+import socket
+import socketserver
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+from .engine import DownloadEngine, DownloadResult
+from .planner import PLAN_CACHE_FILE
+from .range_cache import RANGE_CACHE_DIR
+from .remote_io import REMOTE_TUNING_FILE
+from .spill import restore_setting
+from .subprocess_runner import (
+    CANCEL_POLL_SECONDS,
+    ERROR_TYPES,
+    bootstrap_command,
+    child_environment,
+    job_from_json,
+    job_to_json,
+    result_from_json,
+    result_to_json,
+)
+
+log = logging.getLogger(__name__)
+
+DAEMON_HOST = "127.0.0.1"
+# Folder of the state file, log and shared caches in the system temp folder,
+# followed by the user name
+DAEMON_DIR = "gpq_downloader_daemon"
+DAEMON_STATE_FILE = "daemon.json"
+DAEMON_LOG_FILE = "daemon.log"
+# Jobs downloading at the same time, for all sessions together
+DAEMON_MAX_JOBS = 2
+# Exit after this long without jobs or connections
+DAEMON_IDLE_SECONDS = 1800
+DAEMON_START_TIMEOUT = 30
+# Outputs of finished jobs remembered for identical later jobs
+RESULT_CACHE_SIZE = 100
+
+
+def default_daemon_directory():
+    """Folder of the current user's daemon; each user gets their own daemon"""
+    return os.path.join(tempfile.gettempdir(), f"{DAEMON_DIR}_{getpass.getuser()}")
+
+
+def result_key(job):
+    """Identify jobs that produce the same output apart from its location"""
+    data = job_to_json(job)
+    # The format comes from the output's extension
+    data["output_file"] = os.path.splitext(data["output_file"])[1].lower()
+    return json.dumps(data, sort_keys=True)
+
+
+def reusable_output(job):
+    """
+    Whether a job's output is a single file that identical jobs can copy
+
+    DuckDB output is a table added to a workspace that holds other tables too,
+    and per-AOI output is one file per area.
+    """
+    if job.output_file.lower().endswith(".duckdb"):
+        return False
+    return not (job.aois and job.aoi_output == "files")
+
+
+def file_signature(path):
+    """Size and modification time, to notice outputs changed since they were written"""
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime)
+
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.download_daemon.handle_connection(self.rfile, self.wfile)
+        # Wake the thread watching the client for a cancel request
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class DownloadDaemon:
+    """
+    The daemon process's state: the warm database, shared caches and scheduler
+
+    Args:
+        directory (str): Folder of the state file, log and shared caches
+        max_jobs (int): Jobs downloading at the same time
+        idle_seconds (float): Exit after this long without jobs or connections
+    """
+
+    def __init__(self, directory, max_jobs=DAEMON_MAX_JOBS, idle_seconds=DAEMON_IDLE_SECONDS):
+        self.directory = directory
+        self.idle_seconds = idle_seconds
+        self.token = secrets.token_hex(16)
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs)
+        self.lock = threading.Lock()
+        # (database, settings when opened) of warm databases no job is using
+        self.idle_databases = []
+        # (output, file signature, result) by result_key, least recently used first
+        self.results = OrderedDict()
+        self.connections = 0
+        self.last_activity = time.monotonic()
+        self.server = None
+
+    def shared_job(self, job):
+        """Point a job at the daemon's caches instead of the session's"""
+        return replace(
+            job,
+            plan_cache=os.path.join(self.directory, PLAN_CACHE_FILE),
+            remote_tuning=os.path.join(self.directory, REMOTE_TUNING_FILE),
+            range_cache=os.path.join(self.directory, RANGE_CACHE_DIR) if job.range_cache else None,
+        )
+
+    def checkout_database(self):
+        """
+        A warm DuckDB database for one job, opened when all are in use
+
+        Returns:
+            tuple: (database, its settings when opened) for checkin_database
+        """
+        with self.lock:
+            if self.idle_databases:
+                return self.idle_databases.pop()
+        import duckdb
+
+        database = duckdb.connect()
+        return database, database_settings(database)
+
+    def checkin_database(self, database, settings):
+        """Undo the settings a job changed and keep the database for the next one"""
+        try:
+            restore_database_settings(database, settings)
+        except Exception as e:
+            log.warning(f"Closing a database whose settings can't be restored: {e}")
+            database.close()
+            return
+        with self.lock:
+            self.idle_databases.append((database, settings))
+
+    def cached_result(self, job):
+        """Copy the output of an identical earlier job, or return None"""
+        if not reusable_output(job):
+            return None
+        key = result_key(job)
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is not None:
+                self.results.move_to_end(key)
+        if entry is None:
+            return None
+        output, signature, result = entry
+        try:
+            if file_signature(output) != signature:
+                return None
+            if os.path.abspath(output) != os.path.abspath(job.output_file):
+                shutil.copyfile(output, job.output_file)
+        except OSError:
+            return None
+        log.info(f"Reusing the output of an identical download: {output}")
+        return replace(result, output=job.output_file)
+
+    def remember_result(self, job, result):
+        if not reusable_output(job):
+            return
+        if result.status != "written" or not os.path.isfile(result.output or ""):
+            return
+        with self.lock:
+            self.results[result_key(job)] = (result.output, file_signature(result.output), result)
+            while len(self.results) > RESULT_CACHE_SIZE:
+                self.results.popitem(last=False)
+
+    def run_job(self, job, send, cancel_event):
+        """Run a job on the warm database, or from the result cache"""
+        if cancel_event.is_set():
+            return DownloadResult(status="cancelled")
+        result = self.cached_result(job)
+        if result is not None:
+            return result
+        if job.output_file.lower().endswith(".duckdb"):
+            database, settings = None, None
+        else:
+            # Settings such as threads and memory_limit apply to a whole
+            # database, so each running job has one of its own
+            database, settings = self.checkout_database()
+        try:
+            result = DownloadEngine(
+                self.shared_job(job),
+                progress=lambda message: send({"type": "progress", "message": message}),
+                cancel_event=cancel_event,
+                database=database,
+            ).run()
+        finally:
+            if database is not None:
+                self.checkin_database(database, settings)
+        self.remember_result(job, result)
+        return result
+
+    def handle_connection(self, rfile, wfile):
+        with self.lock:
+            self.connections += 1
+        try:
+            request = json.loads(rfile.readline() or "null")
+            if not isinstance(request, dict) or request.get("token") != self.token:
+                self.write(wfile, {"type": "error", "error_type": "PermissionError", "message": "Invalid token"})
+            elif request.get("type") == "ping":
+                self.write(wfile, {"type": "pong", "pid": os.getpid()})
+            elif request.get("type") == "submit":
+                self.handle_submit(request, rfile, wfile)
+        except (OSError, ValueError) as e:
+            log.info(f"Connection ended: {e}")
+        finally:
+            with self.lock:
+                self.connections -= 1
+                self.last_activity = time.monotonic()
+
+    def handle_submit(self, request, rfile, wfile):
+        job = job_from_json(request["job"])
+        cancel_event = threading.Event()
+        messages = queue.Queue()
+
+        def watch_client():
+            # A cancel request or the client going away cancels the job
+            try:
+                for line in rfile:
+                    if json.loads(line).get("type") == "cancel":
+                        break
+            except (OSError, ValueError):
+                pass
+            cancel_event.set()
+
+        threading.Thread(target=watch_client, daemon=True).start()
+        log.info(f"Downloading {job.dataset_url} to {job.output_file}")
+        future = self.executor.submit(self.run_job, job, messages.put, cancel_event)
+        if not future.running():
+            messages.put({"type": "progress", "message": "Waiting for other downloads on this computer..."})
+
+        try:
+            while not (future.done() and messages.empty()):
+                try:
+                    self.write(wfile, messages.get(timeout=CANCEL_POLL_SECONDS))
+                except queue.Empty:
+                    pass
+            try:
+                result = future.result()
+            except Exception as e:
+                log.warning(f"Download of {job.dataset_url} failed: {e}")
+                self.write(wfile, {"type": "error", "error_type": type(e).__name__, "message": str(e)})
+            else:
+                self.write(wfile, {"type": "result", "result": result_to_json(result)})
+        except OSError:
+            # The client went away, stop its job
+            cancel_event.set()
+
+    def write(self, wfile, message):
+        wfile.write((json.dumps(message, default=str) + "\n").encode("utf-8"))
+        wfile.flush()
+
+    def watch_idle(self):
+        while True:
+            time.sleep(min(60, self.idle_seconds))
+            with self.lock:
+                idle = (
+                    self.connections == 0
+                    and time.monotonic() - self.last_activity > self.idle_seconds
+                )
+            if idle:
+                log.info("Idle, shutting down")
+                self.server.shutdown()
+                return
+
+    def serve(self):
+        """Listen for jobs until stop() is called or the daemon is idle"""
+        private_directory(self.directory)
+        self.server = DaemonServer((DAEMON_HOST, 0), DaemonRequestHandler)
+        self.server.download_daemon = self
+        state = {"port": self.server.server_address[1], "token": self.token, "pid": os.getpid()}
+        state_file = os.path.join(self.directory, DAEMON_STATE_FILE)
+        temp_file = f"{state_file}.{os.getpid()}.tmp"
+        # Only the user running the daemon may read its token
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(state, f)
+        os.replace(temp_file, state_file)
+        log.info(f"Listening on {DAEMON_HOST}:{state['port']}")
+
+        threading.Thread(target=self.watch_idle, daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if read_state(self.directory) == state:
+                os.remove(state_file)
+            self.executor.shutdown(wait=False)
+            with self.lock:
+                for database, _ in self.idle_databases:
+                    database.close()
+                self.idle_databases = []
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+def daemon_main():
+    """Entry point of the daemon process, started by ensure_daemon"""
+    directory = sys.argv[1] if len(sys.argv) > 1 else default_daemon_directory()
+    private_directory(directory)
+    logging.basicConfig(
+        filename=os.path.join(directory, DAEMON_LOG_FILE),
+        level=logging.INFO,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+    )
+    DownloadDaemon(directory).serve()
+
+
+def database_settings(conn):
+    """Current values of all settings of a DuckDB database, by name"""
+    return dict(conn.execute("SELECT name, value FROM duckdb_settings()").fetchall())
+
+
+def restore_database_settings(conn, settings):
+    """
+    Put a database's settings back to values read with database_settings
+
+    Settings of extensions loaded since, such as httpfs', are reset to their
+    defaults. Some settings are aliases of others and come back with them.
+    """
+    for name, value in database_settings(conn).items():
+        if name not in settings:
+            conn.execute(f"RESET {name};")
+        elif value != settings[name]:
+            restore_setting(conn, name, settings[name])
+
+
+def check_private(path, is_directory):
+    """
+    Check that a path belongs to the current user and only they can access it
+
+    Raises:
+        PermissionError: If the path is a symlink, of the wrong type, owned by
+            another user or open to other users
+    """
+    info = os.lstat(path)
+    kind = stat.S_ISDIR(info.st_mode) if is_directory else stat.S_ISREG(info.st_mode)
+    if not kind:
+        raise PermissionError(f"{path} is not a {'folder' if is_directory else 'file'}")
+    if not hasattr(os, "getuid"):
+        # Windows temp folders are already private to the user
+        return
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"{path} belongs to another user")
+    if info.st_mode & 0o077:
+        raise PermissionError(f"{path} can be accessed by other users")
+
+
+def private_directory(directory):
+    """
+    Create the daemon's folder, or check that an existing one is private
+
+    The default folder is in the shared temp folder, where another user could
+    create it first to plant a state file pointing to their own service.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    check_private(directory, is_directory=True)
+
+
+def read_state(directory):
+    """Port, token and pid of the daemon using a folder, or None"""
+    state_file = os.path.join(directory, DAEMON_STATE_FILE)
+    try:
+        check_private(state_file, is_directory=False)
+        with open(state_file) as f:
+            return json.load(f)
+    except PermissionError as e:
+        log.warning(f"Ignoring the download service state: {e}")
+        return None
+    except (OSError, ValueError):
+        return None
+
+
+def ping(state):
+    """Check whether the daemon of a state file is listening"""
+    try:
+        with socket.create_connection((DAEMON_HOST, state["port"]), timeout=2) as sock:
+            sock.sendall((json.dumps({"type": "ping", "token": state["token"]}) + "\n").encode("utf-8"))
+            reply = json.loads(sock.makefile("r", encoding="utf-8").readline() or "null")
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+    return isinstance(reply, dict) and reply.get("type") == "pong"
+
+
+def ensure_daemon(directory=None, python=None):
+    """
+    Find the daemon of a folder, starting it if none is running
+
+    Returns:
+        dict: The daemon's state, with its port and token
+
+    Raises:
+        PermissionError: If the folder isn't private to the current user
+        RuntimeError: If the daemon doesn't start
+    """
+    directory = directory or default_daemon_directory()
+    private_directory(directory)
+    state = read_state(directory)
+    if state is not None and ping(state):
+        return state
+
+    if sys.platform == "win32":
+        flags = {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        flags = {"start_new_session": True}
+    subprocess.Popen(
+        bootstrap_command("daemon", "daemon_main", python) + [directory],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=child_environment(),
+        **flags,
+    )
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        state = read_state(directory)
+        if state is not None and ping(state):
+            return state
+        time.sleep(CANCEL_POLL_SECONDS)
+    raise RuntimeError(
+        f"The download service didn't start, see {os.path.join(directory, DAEMON_LOG_FILE)}"
+    )
+
+
+def run_in_daemon(job, progress=None, cancel_event=None, directory=None):
+    """
+    Run a download on the shared daemon, blocking until it ends
+
+    Row consumers can't be used across processes, so results are always
+    written to the job's output, by the user the daemon runs as.
+
+    Args:
+        job (DownloadJob): What to download
+        progress (callable): Called with a status message as the job advances
+        cancel_event (threading.Event): Set to cancel the job
+        directory (str): Folder of the daemon, the shared default when None
+
+    Returns:
+        DownloadResult: The outcome of the download
+
+    Raises:
+        RemoteReadError: If remote reads kept failing
+        MemoryError: If the download ran out of memory
+        RuntimeError: For other errors, and if the daemon went away
+    """
+    state = ensure_daemon(directory)
+    result = None
+    error = None
+    done = threading.Event()
+    with socket.create_connection((DAEMON_HOST, state["port"])) as sock:
+
+        def watch_cancel():
+            while not done.is_set():
+                if cancel_event.wait(CANCEL_POLL_SECONDS):
+                    try:
+                        sock.sendall(b'{"type": "cancel"}\n')
+                    except OSError:
+                        pass
+                    return
+
+        request = {"type": "submit", "token": state["token"], "job": job_to_json(job)}
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        if cancel_event is not None:
+            threading.Thread(target=watch_cancel, daemon=True).start()
+        try:
+            for line in sock.makefile("r", encoding="utf-8"):
+                message = json.loads(line)
+                if message["type"] == "progress":
+                    if progress is not None:
+                        progress(message["message"])
+                elif message["type"] == "result":
+                    result = result_from_json(message["result"])
+                    break
+                elif message["type"] == "error":
+                    error = message
+                    break
+        finally:
+            done.set()
+
+    if error is not None:
+        raise ERROR_TYPES.get(error["error_type"], RuntimeError)(
+            error["message"] or error["error_type"]
+        )
+    if result is None:
+        if cancel_event is not None and cancel_event.is_set():
+            return DownloadResult(status="cancelled")
+        raise RuntimeError("The download service closed the connection unexpectedly")
+    return result
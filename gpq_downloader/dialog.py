@@ -1,5 +1,3 @@
-import json
-
 from qgis.PyQt.QtWidgets import (
     QMessageBox,
     QDialog,
@@ -14,11 +12,15 @@ from qgis.PyQt.QtWidgets import (
     QStackedWidget,
     QWidget,
     QCheckBox,
+    QDoubleSpinBox,
+    QGroupBox,
+    QSpinBox,
 )
 from qgis.PyQt.QtCore import pyqtSignal, Qt, QThread
 from qgis.core import QgsSettings
-import os
-from .utils import ValidationWorker
+
+from .range_cache import DEFAULT_RANGE_CACHE_MB
+from .registry import get_formats, get_presets
 
 
 class DataSourceDialog(QDialog):
@@ -35,10 +37,7 @@ class DataSourceDialog(QDialog):
         self.setMinimumWidth(500)
         
 
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        presets_path = os.path.join(base_path, "data", "presets.json")
-        with open(presets_path, "r") as f:
-            self.PRESET_DATASETS = json.load(f)
+        self.PRESET_DATASETS = get_presets()
 
         # Create main layout
         layout = QVBoxLayout()
@@ -200,6 +199,195 @@ class DataSourceDialog(QDialog):
 
         layout.addWidget(self.stack)
 
+        # Output options shared by all sources
+        options_group = QGroupBox("Output options")
+        options_layout = QVBoxLayout()
+
+        area_layout = QHBoxLayout()
+        area_layout.addWidget(QLabel("Download area:"))
+        self.area_combo = QComboBox()
+        self.area_combo.addItem("Current map view", "extent")
+        self.area_combo.addItem("Selected polygons of the active layer", "selection")
+        self.area_combo.setToolTip(
+            "Selected polygons download only the features that intersect them, "
+            "which is much less data than their bounding rectangle for long or "
+            "irregular areas."
+        )
+        area_layout.addWidget(self.area_combo)
+        options_layout.addLayout(area_layout)
+
+        clip_layout = QHBoxLayout()
+        self.clip_checkbox = QCheckBox("Clip features to the download area")
+        self.clip_checkbox.setToolTip(
+            "Features crossing the edge of the download area are cut at the edge, "
+            "so long roads or large boundaries don't bloat the output."
+        )
+        self.clip_keep_id_checkbox = QCheckBox("Keep source feature id")
+        self.clip_keep_id_checkbox.setToolTip(
+            "For datasets without an id column, clipped features get a "
+            "source_feature_id identifying the feature they were cut from."
+        )
+        self.clip_keep_id_checkbox.setEnabled(False)
+        self.clip_checkbox.toggled.connect(self.clip_keep_id_checkbox.setEnabled)
+        clip_layout.addWidget(self.clip_checkbox)
+        clip_layout.addWidget(self.clip_keep_id_checkbox)
+        options_layout.addLayout(clip_layout)
+
+        simplify_layout = QHBoxLayout()
+        simplify_layout.addWidget(QLabel("Simplify geometries:"))
+        self.simplify_combo = QComboBox()
+        self.simplify_combo.addItem("No", "none")
+        self.simplify_combo.addItem("To the current map scale", "scale")
+        self.simplify_combo.addItem("With a tolerance of", "custom")
+        self.simplify_combo.setToolTip(
+            "Simplified geometries keep their topology but drop vertices that "
+            "aren't visible at overview scales, giving smaller and faster outputs."
+        )
+        self.simplify_tolerance_spin = QDoubleSpinBox()
+        self.simplify_tolerance_spin.setRange(0.01, 100000)
+        self.simplify_tolerance_spin.setSuffix(" m")
+        self.simplify_tolerance_spin.setEnabled(False)
+        self.simplify_combo.currentIndexChanged.connect(
+            lambda: self.simplify_tolerance_spin.setEnabled(
+                self.simplify_combo.currentData() == "custom"
+            )
+        )
+        simplify_layout.addWidget(self.simplify_combo)
+        simplify_layout.addWidget(self.simplify_tolerance_spin)
+        options_layout.addLayout(simplify_layout)
+
+        quantize_layout = QHBoxLayout()
+        self.quantize_checkbox = QCheckBox("Round coordinates to")
+        self.quantize_decimals_spin = QSpinBox()
+        self.quantize_decimals_spin.setRange(0, 15)
+        self.quantize_decimals_spin.setSuffix(" decimal places")
+        self.quantize_decimals_spin.setEnabled(False)
+        self.quantize_checkbox.toggled.connect(self.quantize_decimals_spin.setEnabled)
+        quantize_layout.addWidget(self.quantize_checkbox)
+        quantize_layout.addWidget(self.quantize_decimals_spin)
+        options_layout.addLayout(quantize_layout)
+
+        self.reproject_checkbox = QCheckBox("Reproject to the project CRS")
+        self.reproject_checkbox.setToolTip(
+            "Writes GeoPackage, FlatGeobuf, GeoJSON, DuckDB and temporary layer output "
+            "in the map's CRS, so QGIS doesn't reproject it on every redraw. "
+            "GeoParquet output always stays in EPSG:4326."
+        )
+        options_layout.addWidget(self.reproject_checkbox)
+
+        self.direct_to_layer_checkbox = QCheckBox(
+            "Load small results straight into a temporary layer (no file written)"
+        )
+        self.direct_to_layer_checkbox.setToolTip(
+            "Features in the area are counted before downloading. Up to the configured "
+            "limit they are added to the map as a memory layer instead of being saved "
+            "to the chosen file. Turn this off to always save the file."
+        )
+        options_layout.addWidget(self.direct_to_layer_checkbox)
+
+        self.live_layer_checkbox = QCheckBox(
+            "Browse as a live layer that follows the map view (no download)"
+        )
+        self.live_layer_checkbox.setToolTip(
+            "Adds a temporary layer that reads the features in view from the remote "
+            "data whenever the map is panned or zoomed in far enough."
+        )
+        options_layout.addWidget(self.live_layer_checkbox)
+
+        compression_layout = QHBoxLayout()
+        compression_layout.addWidget(QLabel("GeoParquet compression:"))
+        self.compression_combo = QComboBox()
+        parquet_format = get_formats()["GeoParquet (*.parquet)"]
+        for name, profile in parquet_format["compression_profiles"].items():
+            self.compression_combo.addItem(profile["display_name"], name)
+        self.default_compression_profile = parquet_format["default_compression_profile"]
+        compression_layout.addWidget(self.compression_combo)
+        options_layout.addLayout(compression_layout)
+
+        partitioning_layout = QHBoxLayout()
+        partitioning_layout.addWidget(QLabel("GeoParquet layout:"))
+        self.partitioning_combo = QComboBox()
+        self.partitioning_combo.addItem("Single file", "none")
+        self.partitioning_combo.addItem("Folder partitioned by Hilbert range", "hilbert")
+        self.partitioning_combo.addItem("Folder partitioned by quadkey", "quadkey")
+        self.partitioning_combo.setToolTip(
+            "Partitioned output writes a folder of GeoParquet files plus an index "
+            "of their bounding boxes, which suits very large extracts."
+        )
+        partitioning_layout.addWidget(self.partitioning_combo)
+        options_layout.addLayout(partitioning_layout)
+
+        self.optimize_requery_checkbox = QCheckBox(
+            "Optimize GeoParquet for re-querying (bbox covering, small spatial row groups)"
+        )
+        self.optimize_requery_checkbox.setToolTip(
+            "Adds a bbox column with GeoParquet 1.1 covering metadata, sizes row groups "
+            "to compact spatial ranges and writes bloom filters, so the output can be "
+            "queried efficiently by this plugin and other tools."
+        )
+        options_layout.addWidget(self.optimize_requery_checkbox)
+
+        duckdb_layout = QHBoxLayout()
+        self.duckdb_append_checkbox = QCheckBox("Append to existing DuckDB database")
+        self.duckdb_append_checkbox.setToolTip(
+            "Each dataset gets its own table. When the table already exists, downloaded "
+            "rows are added to it and rows with the same id are replaced."
+        )
+        self.duckdb_rtree_checkbox = QCheckBox("Build R-tree index in DuckDB")
+        duckdb_layout.addWidget(self.duckdb_append_checkbox)
+        duckdb_layout.addWidget(self.duckdb_rtree_checkbox)
+        options_layout.addLayout(duckdb_layout)
+
+        range_cache_layout = QHBoxLayout()
+        self.range_cache_checkbox = QCheckBox("Cache remote data on disk, up to")
+        self.range_cache_checkbox.setToolTip(
+            "Keeps the parts of remote files that were read in the QGIS profile, so "
+            "repeated or overlapping downloads read them from disk instead of the "
+            "network. Needs DuckDB's cache_httpfs community extension."
+        )
+        self.range_cache_size_spin = QSpinBox()
+        self.range_cache_size_spin.setRange(64, 1024 * 1024)
+        self.range_cache_size_spin.setSuffix(" MB")
+        self.range_cache_size_spin.setEnabled(False)
+        self.range_cache_checkbox.toggled.connect(self.range_cache_size_spin.setEnabled)
+        range_cache_layout.addWidget(self.range_cache_checkbox)
+        range_cache_layout.addWidget(self.range_cache_size_spin)
+        options_layout.addLayout(range_cache_layout)
+
+        self.prefetch_checkbox = QCheckBox(
+            "Prefetch data around the map view in the background"
+        )
+        self.prefetch_checkbox.setToolTip(
+            "After a download, the areas next to the map view are read into the "
+            "disk cache at low priority, so downloading a neighbouring area is fast."
+        )
+        self.prefetch_checkbox.setEnabled(False)
+        self.range_cache_checkbox.toggled.connect(self.prefetch_checkbox.setEnabled)
+        options_layout.addWidget(self.prefetch_checkbox)
+
+        self.run_in_subprocess_checkbox = QCheckBox(
+            "Run downloads in a separate process"
+        )
+        self.run_in_subprocess_checkbox.setToolTip(
+            "DuckDB runs in its own Python process, so a crash can't take QGIS down, "
+            "cancelling stops it at once and its memory is freed when it ends. "
+            "Results are always written to the chosen file."
+        )
+        options_layout.addWidget(self.run_in_subprocess_checkbox)
+
+        self.use_daemon_checkbox = QCheckBox(
+            "Share one download service between all your QGIS sessions on this computer"
+        )
+        self.use_daemon_checkbox.setToolTip(
+            "Downloads run in a background service that keeps DuckDB, the metadata "
+            "and disk caches warm between jobs and reuses the output of identical "
+            "downloads. It runs at most two downloads at once for all sessions, "
+            "and results are always written to the chosen file."
+        )
+        options_layout.addWidget(self.use_daemon_checkbox)
+        options_group.setLayout(options_layout)
+        layout.addWidget(options_group)
+
         # Buttons
         button_layout = QHBoxLayout()
         self.ok_button = QPushButton("OK")
@@ -233,6 +421,9 @@ class DataSourceDialog(QDialog):
         # Ensure to call save_checkbox_states when the dialog is accepted
         self.ok_button.clicked.connect(self.save_checkbox_states)
 
+        self.load_output_options()
+        self.ok_button.clicked.connect(self.save_output_options)
+
     def save_radio_button_state(self) -> None:
         if self.custom_radio.isChecked():
             button_name = self.custom_radio.text()
@@ -281,7 +472,10 @@ class DataSourceDialog(QDialog):
                 self.progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
                 self.progress_dialog.canceled.connect(self.cancel_validation)
 
-                # Create validation worker
+                # Create validation worker, importing it here keeps the worker
+                # module out of the dialog's start up
+                from .utils import ValidationWorker
+
                 self.validation_worker = ValidationWorker(url, self.iface, self.iface.mapCanvas().extent())
                 self.validation_thread = QThread()
                 self.validation_worker.moveToThread(self.validation_thread)
@@ -486,6 +680,280 @@ class DataSourceDialog(QDialog):
         # Update base subtype widget visibility based on base checkbox state
         self.base_subtype_widget.setVisible(self.base_checkbox.isChecked())
 
+    def save_output_options(self) -> None:
+        QgsSettings().setValue(
+            "gpq_downloader/direct_to_layer",
+            self.direct_to_layer_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/download_area",
+            self.area_combo.currentData(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/clip_to_area",
+            self.clip_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/clip_keep_original_id",
+            self.clip_keep_id_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/simplify_mode",
+            self.simplify_combo.currentData(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/simplify_tolerance_m",
+            self.simplify_tolerance_spin.value(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/reproject_to_project",
+            self.reproject_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/quantize",
+            self.quantize_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/quantize_decimals",
+            self.quantize_decimals_spin.value(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/parquet_compression_profile",
+            self.compression_combo.currentData(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/parquet_partitioning",
+            self.partitioning_combo.currentData(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/optimize_for_requery",
+            self.optimize_requery_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/duckdb_append",
+            self.duckdb_append_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/duckdb_rtree",
+            self.duckdb_rtree_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/range_cache",
+            self.range_cache_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/range_cache_max_mb",
+            self.range_cache_size_spin.value(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/prefetch",
+            self.prefetch_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/live_layer",
+            self.live_layer_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/run_in_subprocess",
+            self.run_in_subprocess_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+        QgsSettings().setValue(
+            "gpq_downloader/use_daemon",
+            self.use_daemon_checkbox.isChecked(),
+            section=QgsSettings.Plugins,
+        )
+
+    def download_area(self) -> str:
+        """Return "extent" or "selection" depending on the chosen download area"""
+        return self.area_combo.currentData()
+
+    def load_output_options(self) -> None:
+        index = self.area_combo.findData(
+            QgsSettings().value(
+                "gpq_downloader/download_area",
+                "extent",
+                type=str,
+                section=QgsSettings.Plugins,
+            )
+        )
+        if index >= 0:
+            self.area_combo.setCurrentIndex(index)
+        self.clip_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/clip_to_area",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.clip_keep_id_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/clip_keep_original_id",
+                True,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        index = self.simplify_combo.findData(
+            QgsSettings().value(
+                "gpq_downloader/simplify_mode",
+                "none",
+                type=str,
+                section=QgsSettings.Plugins,
+            )
+        )
+        if index >= 0:
+            self.simplify_combo.setCurrentIndex(index)
+        self.simplify_tolerance_spin.setValue(
+            QgsSettings().value(
+                "gpq_downloader/simplify_tolerance_m",
+                10.0,
+                type=float,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.reproject_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/reproject_to_project",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.quantize_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/quantize",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.quantize_decimals_spin.setValue(
+            QgsSettings().value(
+                "gpq_downloader/quantize_decimals",
+                6,
+                type=int,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.direct_to_layer_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/direct_to_layer",
+                True,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        profile = QgsSettings().value(
+            "gpq_downloader/parquet_compression_profile",
+            self.default_compression_profile,
+            type=str,
+            section=QgsSettings.Plugins,
+        )
+        index = self.compression_combo.findData(profile)
+        if index >= 0:
+            self.compression_combo.setCurrentIndex(index)
+        partitioning = QgsSettings().value(
+            "gpq_downloader/parquet_partitioning",
+            "none",
+            type=str,
+            section=QgsSettings.Plugins,
+        )
+        index = self.partitioning_combo.findData(partitioning)
+        if index >= 0:
+            self.partitioning_combo.setCurrentIndex(index)
+        self.optimize_requery_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/optimize_for_requery",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.duckdb_append_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/duckdb_append",
+                True,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.duckdb_rtree_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/duckdb_rtree",
+                True,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.range_cache_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/range_cache",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.range_cache_size_spin.setValue(
+            QgsSettings().value(
+                "gpq_downloader/range_cache_max_mb",
+                DEFAULT_RANGE_CACHE_MB,
+                type=int,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.prefetch_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/prefetch",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.live_layer_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/live_layer",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.run_in_subprocess_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/run_in_subprocess",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+        self.use_daemon_checkbox.setChecked(
+            QgsSettings().value(
+                "gpq_downloader/use_daemon",
+                False,
+                type=bool,
+                section=QgsSettings.Plugins,
+            )
+        )
+
     def on_validation_finished(self, success, message, results):
         # This method should handle the validation results
         # Check how it's setting validation_results
@@ -0,0 +1,1595 @@
+"""
+Download engine that plans, filters and exports GeoParquet extracts.
+
+This module has no Qt or QGIS dependencies, so it can be driven from the QGIS
+Python console, other plugins or plain scripts. Jobs are described with a
+DownloadJob and run either blocking with run_download, on an executor with
+submit_download / download_many, or from asyncio with download_async.
+"""
+import asyncio
+import concurrent.futures
+import glob
+import json
+import logging
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field, replace
+
+from .extensions import load_extensions
+from .planner import PlanCache, estimate_area_bytes, plan_filter
+from .range_cache import DEFAULT_RANGE_CACHE_MB, enable_range_cache, prune_range_cache
+from .remote_io import (
+    DOWNLOAD_RETRIES,
+    RETRY_BACKOFF_SECONDS,
+    RemoteReadError,
+    RemoteTuning,
+    host_key,
+    is_http_error,
+)
+from .registry import get_formats
+from .spill import (
+    default_spill_threshold_mb,
+    detach_spill,
+    enable_spill,
+    estimate_area_mb,
+    is_out_of_memory,
+    remove_spill,
+)
+
+log = logging.getLogger(__name__)
+
+# Rows written per candidate level when measuring "auto" compression
+AUTO_COMPRESSION_SAMPLE_ROWS = 20000
+# Bytes written when measuring the output disk's write speed
+DISK_SPEED_PROBE_BYTES = 16 * 1024 * 1024
+# Target number of rows in each file of a Hilbert partitioned output
+PARTITION_TARGET_ROWS = 1000000
+MAX_PARTITIONS = 256
+# Name of the index file written next to partitioned output
+PARTITION_INDEX_FILE = "_partitions.json"
+PARTITION_SCHEMES = ("hilbert", "quadkey")
+# Re-query optimized output aims for at least this many row groups, each
+# covering a compact Hilbert range, within DuckDB's row group size limits
+REQUERY_MIN_ROW_GROUPS = 64
+REQUERY_MIN_ROW_GROUP_SIZE = 10000
+REQUERY_MAX_ROW_GROUP_SIZE = 122880
+# GeoJSON outputs estimated above this size (in MB) need confirmation
+GEOJSON_SIZE_WARNING_MB = 4096
+# Table holding the areas of interest of a multi-AOI job, and the column that
+# tags every downloaded row with the area it falls in
+AOI_TABLE = "download_aois"
+AOI_ID_COLUMN = "aoi_id"
+AOI_OUTPUTS = ("files", "column")
+# Columns only used while clipping, dropped before the rows are stored
+CLIPPED_GEOMETRY_COLUMN = "__clipped_geometry"
+AOI_GEOMETRY_COLUMN = "__aoi_geometry"
+# Added to clipped features of datasets without an id column
+SOURCE_FEATURE_ID_COLUMN = "source_feature_id"
+# Approximate length of one degree at the equator, for tolerances given in meters
+METERS_PER_DEGREE = 111320
+# Vector tile output is tiled from the zoom level where the whole area fits in
+# one tile up to this level; clients overzoom the last level beyond it
+VECTOR_TILE_MAX_ZOOM = 14
+# Simplification tolerance in tile units (of 4096 per tile side), so every zoom
+# level is simplified for its own resolution, and a finer one at the max zoom
+VECTOR_TILE_SIMPLIFICATION = 4
+VECTOR_TILE_SIMPLIFICATION_MAX_ZOOM = 1
+
+GEOPARQUET_GEOMETRY_TYPES = {
+    "POINT": "Point",
+    "LINESTRING": "LineString",
+    "POLYGON": "Polygon",
+    "MULTIPOINT": "MultiPoint",
+    "MULTILINESTRING": "MultiLineString",
+    "MULTIPOLYGON": "MultiPolygon",
+    "GEOMETRYCOLLECTION": "GeometryCollection",
+}
+
+_disk_write_speeds = {}
+
+
+@dataclass
+class DownloadJob:
+    """
+    Plain description of a download
+
+    Attributes:
+        dataset_url: URL of the GeoParquet file or partition
+        bbox: (xmin, ymin, xmax, ymax) of the area to download, in EPSG:4326
+        output_file: Path of the output; the extension picks the format
+        columns: Columns to keep, or None for all columns
+        filters: SQL boolean expressions that rows must also match
+        layer_name: Display name of the dataset
+        bbox_column: Name of the bbox struct column, found from the schema and
+            GeoParquet covering metadata when None
+        geometry_column: Name of the geometry column, detected when None
+        compression_profile: GeoParquet compression profile from formats.json
+        partitioning: "none", "hilbert" or "quadkey" for GeoParquet output
+        optimize_for_requery: Write bbox covering and small spatial row groups
+        duckdb_append: Append to existing DuckDB workspace tables
+        duckdb_rtree: Build an R-tree index on DuckDB workspace tables
+        extension_repository: Local path or URL to install extensions from
+        geojson_size_limit_mb: Stop with a "size_warning" result above this
+            estimated GeoJSON size, or None to always write
+        memory_layer_max_rows: Hand results with at most this many rows to the
+            row consumer instead of writing a file, 0 to disable. The rows are
+            counted before they are downloaded.
+        aois: (id, WKT) tuples of areas of interest in EPSG:4326. The source is
+            scanned once for bbox, which should cover all of them, and rows are
+            joined to every area they intersect.
+        aoi_output: "files" to write one output per area of interest, or
+            "column" to write one output with an aoi_id column. DuckDB output
+            is one workspace, so "files" adds one table per area to it.
+        aoi_wkb: WKB polygon in EPSG:4326 that rows must intersect. bbox should
+            be its bounding box, which is used to prune the scan first.
+        clip: Cut geometries to the AOI polygon, the areas of interest or bbox
+        keep_original_id: Add a source_feature_id column identifying the
+            unclipped feature when clipping a dataset without an id column
+        target_crs: CRS (authority id or WKT) to reproject GDAL, DuckDB and row
+            consumer outputs to, or None to keep EPSG:4326
+        simplify_tolerance: Simplify geometries with this tolerance in degrees,
+            keeping their topology, or None to keep every vertex
+        precision_decimals: Round coordinates in the output CRS to this many
+            decimal places, or None to keep full precision
+        filter_strategy: Filter strategy from planner.STRATEGIES to use instead
+            of the planned one, if the dataset supports it
+        plan_cache: JSON file to reuse and record filter plans in, or None
+        remote_tuning: JSON file to keep per-host remote I/O tuning in, or None
+            to keep it for the session only
+        range_cache: Folder to cache remote byte ranges in, or None to always
+            read from the network
+        range_cache_max_mb: Size the range cache is pruned to after the download
+        retries: Times to retry a download that fails with request errors
+        max_threads: Limit on the number of DuckDB threads, for background
+            downloads that shouldn't compete for bandwidth. Such runs aren't
+            representative, so they don't update the plan cache or I/O tuning.
+        vector_tile_min_zoom: Lowest zoom level of PMTiles and MBTiles output,
+            or None for the level where bbox fits in a single tile
+        vector_tile_max_zoom: Highest zoom level of PMTiles and MBTiles output
+        spill_threshold_mb: Collect the rows in an on-disk database when the
+            row groups in bbox are estimated above this size, or None for a
+            share of the physical memory
+        spill_directory: Folder for the on-disk database and DuckDB's spill
+            files, or None for the system temp folder
+        warm_only: Only read the rows in bbox, keeping and writing nothing, to
+            fill the range cache
+    """
+
+    dataset_url: str
+    bbox: tuple
+    output_file: str
+    columns: list = None
+    filters: list = field(default_factory=list)
+    layer_name: str = None
+    bbox_column: str = None
+    geometry_column: str = None
+    compression_profile: str = ""
+    partitioning: str = "none"
+    optimize_for_requery: bool = False
+    duckdb_append: bool = True
+    duckdb_rtree: bool = True
+    extension_repository: str = ""
+    geojson_size_limit_mb: float = GEOJSON_SIZE_WARNING_MB
+    memory_layer_max_rows: int = 0
+    aois: list = None
+    aoi_output: str = "files"
+    aoi_wkb: bytes = None
+    clip: bool = False
+    keep_original_id: bool = True
+    simplify_tolerance: float = None
+    precision_decimals: int = None
+    target_crs: str = None
+    filter_strategy: str = None
+    plan_cache: str = None
+    remote_tuning: str = None
+    range_cache: str = None
+    range_cache_max_mb: float = DEFAULT_RANGE_CACHE_MB
+    retries: int = DOWNLOAD_RETRIES
+    max_threads: int = None
+    vector_tile_min_zoom: int = None
+    vector_tile_max_zoom: int = VECTOR_TILE_MAX_ZOOM
+    spill_threshold_mb: float = None
+    spill_directory: str = None
+    warm_only: bool = False
+
+
+@dataclass
+class DownloadResult:
+    """
+    Outcome of a download
+
+    Attributes:
+        status: One of "written", "partitioned", "duckdb", "memory", "empty",
+            "size_warning", "cancelled", "per_aoi" or "warmed"
+        output: Path written, folder for partitioned output, or table name for
+            DuckDB output
+        outputs: Outputs of a "per_aoi" result, by area of interest id
+        row_count: Number of rows downloaded
+        message: Human readable summary
+        estimated_size_mb: Estimated GeoJSON size for "size_warning" results
+        layer: Object returned by the row consumer for "memory" results
+        schema: DESCRIBE rows of the source dataset
+        geometry_column: Geometry column that was used
+        bbox_column: bbox covering column of the dataset, or None
+        filter_strategy: Filter strategy the download ran with
+    """
+
+    status: str
+    output: str = None
+    outputs: dict = None
+    row_count: int = 0
+    message: str = ""
+    estimated_size_mb: float = 0.0
+    layer: object = None
+    schema: list = None
+    geometry_column: str = None
+    bbox_column: str = None
+    filter_strategy: str = None
+
+
+def measure_disk_write_speed(directory):
+    """
+    Measure how fast data can be written to disk in a directory
+
+    The result is cached per directory for the rest of the session.
+
+    Args:
+        directory (str): Directory on the disk to measure
+
+    Returns:
+        float: Write speed in bytes per second
+    """
+    if directory in _disk_write_speeds:
+        return _disk_write_speeds[directory]
+
+    payload = os.urandom(DISK_SPEED_PROBE_BYTES)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".probe") as f:
+        start = time.perf_counter()
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+        elapsed = max(time.perf_counter() - start, 1e-6)
+
+    speed = DISK_SPEED_PROBE_BYTES / elapsed
+    _disk_write_speeds[directory] = speed
+    return speed
+
+
+def duckdb_table_name(dataset_url, layer_name=None):
+    """
+    Derive a DuckDB table name for a dataset
+
+    Args:
+        dataset_url (str): The dataset URL
+        layer_name (str): Optional display name of the dataset, used when given
+
+    Returns:
+        str: A lower case table name containing only letters, digits and underscores
+    """
+    if layer_name:
+        source = layer_name
+    else:
+        parts = [
+            part for part in dataset_url.split("?")[0].rstrip("/").split("/")
+            if part and "*" not in part
+        ]
+        # Hive style partition folders such as theme=buildings name the dataset best
+        hive_values = [part.split("=", 1)[1] for part in parts if "=" in part]
+        if hive_values:
+            source = "_".join(hive_values)
+        else:
+            source = os.path.splitext(parts[-1])[0] if parts else ""
+
+    name = re.sub(r"[^0-9a-zA-Z_]+", "_", source).strip("_").lower()
+    if not name or name[0].isdigit():
+        name = f"dataset_{name}".rstrip("_")
+    return name
+
+
+def duckdb_version_at_least(major, minor):
+    """Check whether the installed DuckDB is at least the given version"""
+    import duckdb
+
+    try:
+        installed = tuple(int(part) for part in duckdb.__version__.split(".")[:2])
+    except (AttributeError, ValueError):
+        return False
+    return installed >= (major, minor)
+
+
+def requery_row_group_size(row_count):
+    """
+    Row group size for re-query optimized output
+
+    The rows are Hilbert sorted, so every row group covers a compact spatial range.
+    Smaller groups give tighter row group bboxes for readers to prune with.
+    """
+    size = math.ceil(row_count / REQUERY_MIN_ROW_GROUPS)
+    return min(REQUERY_MAX_ROW_GROUP_SIZE, max(REQUERY_MIN_ROW_GROUP_SIZE, size))
+
+
+def build_geo_metadata(geometry_column, geometry_types, has_z, bbox):
+    """
+    Build GeoParquet 1.1 "geo" metadata with a bbox covering
+
+    Args:
+        geometry_column (str): Name of the WKB geometry column
+        geometry_types (list): Geometry type names as returned by ST_GeometryType
+        has_z (bool): Whether any of the geometries have Z values
+        bbox (list): [xmin, ymin, xmax, ymax] of all geometries
+
+    Returns:
+        dict: The metadata to store under the "geo" key
+    """
+    suffix = " Z" if has_z else ""
+    types = sorted(
+        GEOPARQUET_GEOMETRY_TYPES[str(t).upper()] + suffix
+        for t in geometry_types
+        if str(t).upper() in GEOPARQUET_GEOMETRY_TYPES
+    )
+    column = {
+        "encoding": "WKB",
+        "geometry_types": types,
+        "covering": {
+            "bbox": {
+                "xmin": ["bbox", "xmin"],
+                "ymin": ["bbox", "ymin"],
+                "xmax": ["bbox", "xmax"],
+                "ymax": ["bbox", "ymax"],
+            }
+        },
+    }
+    if bbox and None not in bbox:
+        column["bbox"] = list(bbox)
+    return {
+        "version": "1.1.0",
+        "primary_column": geometry_column,
+        "columns": {geometry_column: column},
+    }
+
+
+def bbox_polygon_wkt(bbox):
+    """Return a WKT polygon for an (xmin, ymin, xmax, ymax) tuple"""
+    xmin, ymin, xmax, ymax = bbox
+    return (
+        f"POLYGON(({xmin} {ymin}, {xmax} {ymin}, {xmax} {ymax}, "
+        f"{xmin} {ymax}, {xmin} {ymin}))"
+    )
+
+
+def meters_to_degrees(meters):
+    """Convert a distance in meters to approximate degrees for EPSG:4326 data"""
+    return meters / METERS_PER_DEGREE
+
+
+def union_bbox(bboxes):
+    """Return the (xmin, ymin, xmax, ymax) covering all the given bboxes"""
+    bboxes = list(bboxes)
+    return (
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    )
+
+
+def aoi_output_path(output_file, aoi_id):
+    """Output path for one area of interest, e.g. buildings_site_3.gpkg"""
+    base, extension = os.path.splitext(output_file)
+    safe_id = re.sub(r"[^0-9a-zA-Z_-]+", "_", str(aoi_id)).strip("_") or "aoi"
+    return f"{base}_{safe_id}{extension}"
+
+
+def vector_tile_zoom_range(bbox, min_zoom=None, max_zoom=VECTOR_TILE_MAX_ZOOM):
+    """
+    Zoom levels to tile an area at
+
+    Args:
+        bbox (tuple): (xmin, ymin, xmax, ymax) of the area in EPSG:4326
+        min_zoom (int): Lowest zoom level, or None for the level where the
+            whole area fits in one tile
+        max_zoom (int): Highest zoom level
+
+    Returns:
+        tuple: (min_zoom, max_zoom)
+    """
+    if min_zoom is None:
+        width = max(bbox[2] - bbox[0], bbox[3] - bbox[1], 1e-9)
+        min_zoom = max(0, math.floor(math.log2(360 / width)))
+    return min(min_zoom, max_zoom), max_zoom
+
+
+def write_vector_tiles(source_file, output_file, driver, layer_name, min_zoom, max_zoom):
+    """
+    Tile a vector file into a PMTiles or MBTiles archive with GDAL
+
+    Tiles are written in EPSG:3857, each zoom level simplified to its own
+    resolution, with GDAL allowed to use all cores.
+
+    Raises:
+        RuntimeError: If GDAL isn't available or can't write the archive
+    """
+    try:
+        from osgeo import gdal
+    except ImportError:
+        raise RuntimeError("Writing vector tiles needs the GDAL Python bindings")
+
+    gdal.UseExceptions()
+    if gdal.GetDriverByName(driver) is None:
+        raise RuntimeError(
+            f"This GDAL version ({gdal.__version__}) can't write {driver} vector tiles"
+        )
+    if os.path.exists(output_file):
+        os.remove(output_file)
+    options = gdal.VectorTranslateOptions(
+        format=driver,
+        layerName=layer_name,
+        datasetCreationOptions=[
+            f"MINZOOM={min_zoom}",
+            f"MAXZOOM={max_zoom}",
+            f"SIMPLIFICATION={VECTOR_TILE_SIMPLIFICATION}",
+            f"SIMPLIFICATION_MAX_ZOOM={VECTOR_TILE_SIMPLIFICATION_MAX_ZOOM}",
+        ],
+    )
+    num_threads = gdal.GetConfigOption("GDAL_NUM_THREADS")
+    gdal.SetConfigOption("GDAL_NUM_THREADS", "ALL_CPUS")
+    try:
+        gdal.VectorTranslate(output_file, source_file, options=options)
+    finally:
+        gdal.SetConfigOption("GDAL_NUM_THREADS", num_threads)
+
+
+def output_stays_in_4326(output_file):
+    """
+    Check whether an output is always written in EPSG:4326, whatever the target CRS
+
+    GeoParquet output always stays in EPSG:4326, as DuckDB can't write the
+    PROJJSON that other CRSs need in the GeoParquet metadata. Vector tiles
+    are tiled in EPSG:3857 from EPSG:4326 input.
+    """
+    extension = os.path.splitext(output_file.lower())[1]
+    output_format = next(
+        (fmt for fmt in get_formats().values() if fmt["extension"] == extension), None
+    )
+    return extension == '.parquet' or bool(
+        output_format and output_format.get("vector_tile_driver")
+    )
+
+
+def detect_geometry_column(schema_result):
+    """Find the geometry column in DESCRIBE rows, by type first and then by name"""
+    for row in schema_result:
+        col_type = row[1].upper()
+        if 'GEOMETRY' in col_type or 'GEOGRAPHY' in col_type:
+            log.info(f"Found geometry column by type: {row[0]}")
+            return row[0]
+
+    for row in schema_result:
+        if row[0].lower() in ('geom', 'the_geom', 'wkb_geometry'):
+            return row[0]  # Use original case
+    return 'geometry'
+
+
+def process_schema_columns(schema_result):
+    """Process schema columns and return formatted SELECT clause"""
+    columns = []
+    for row in schema_result:
+        col_name = row[0]
+        col_type = row[1]
+        quoted_col_name = f'"{col_name}"'
+
+        if "STRUCT" in col_type.upper() or "MAP" in col_type.upper():
+            columns.append(f"TO_JSON({quoted_col_name}) AS {quoted_col_name}")
+        elif "[]" in col_type:
+            columns.append(
+                f"array_to_string({quoted_col_name}, ', ') AS {quoted_col_name}"
+            )
+        elif col_type.upper() == "UTINYINT":
+            columns.append(
+                f"CAST({quoted_col_name} AS INTEGER) AS {quoted_col_name}"
+            )
+        else:
+            columns.append(quoted_col_name)
+    return columns
+
+
+def estimate_file_size(conn, table_name):
+    """Estimate the output file size in MB using GeoJSON feature collection structure"""
+    try:
+        # Get total row count
+        row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+
+        # Use a smaller sample size for large datasets
+        sample_size = min(100, row_count)
+
+        if sample_size > 0:
+            # Create a proper GeoJSON FeatureCollection sample with all properties
+            sample_query = f"""
+                WITH sample AS (
+                    SELECT * FROM {table_name} LIMIT {sample_size}
+                )
+                SELECT AVG(LENGTH(
+                    json_object(
+                        'type', 'Feature',
+                        'geometry', ST_AsGeoJSON(geometry),
+                        'properties', json_object(
+                            {', '.join([
+                f"'{col[0]}', COALESCE(CAST({col[0]} AS VARCHAR), 'null')"
+                for col in conn.execute(f"DESCRIBE {table_name}").fetchall()
+                if col[0] != 'geometry'
+            ])}
+                        )
+                    )::VARCHAR
+                )) as avg_feature_size
+                FROM sample;
+            """
+
+            # Get average feature size
+            avg_feature_size = conn.execute(sample_query).fetchone()[0]
+
+            if avg_feature_size:
+                # Account for GeoJSON overhead
+                collection_overhead = (
+                    50  # {"type":"FeatureCollection","features":[]}
+                )
+                comma_overhead = row_count - 1  # Commas between features
+
+                total_estimated_bytes = (
+                    (row_count * avg_feature_size)
+                    + collection_overhead
+                    + comma_overhead
+                )
+                return total_estimated_bytes / (1024 * 1024)  # Convert to MB
+        return 0
+
+    except Exception as e:
+        log.error(f"Error estimating file size: {str(e)}")
+        return 0
+
+
+class DownloadEngine:
+    """
+    Runs a single DownloadJob against DuckDB
+
+    Args:
+        job (DownloadJob): What to download
+        progress (callable): Called with a status message as the job advances
+        cancel_event (threading.Event): Set to stop the job at the next step
+        row_consumer (callable): For results under job.memory_layer_max_rows, called
+            with (conn, table_name, geometry_column) instead of writing a file.
+            Returning None falls back to writing the file. Not used for DuckDB
+            output or areas of interest.
+        database: DuckDB connection shared by several jobs. Runs use a cursor on
+            it, so they share its loaded extensions and metadata caches. DuckDB
+            output still opens its own database file.
+    """
+
+    table_name = "download_data"
+
+    def __init__(self, job, progress=None, cancel_event=None, row_consumer=None, database=None):
+        self.job = job
+        self.progress_callback = progress
+        self.cancel_event = cancel_event
+        self.row_consumer = row_consumer
+        self.database = database
+        if database is not None:
+            # Jobs sharing a database also share its tables
+            self.table_name = f"download_data_{uuid.uuid4().hex[:8]}"
+        # On-disk database, once the job spills
+        self.spill = None
+        # Connection of the running job, for interrupt()
+        self.conn = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def interrupt(self):
+        """Cancel the job, aborting the query it is running instead of waiting for it"""
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+        conn = self.conn
+        if conn is not None:
+            try:
+                conn.interrupt()
+            except Exception as e:
+                # The job finished and closed its connection meanwhile
+                log.info(f"Could not interrupt the download query: {e}")
+
+    def progress(self, message):
+        if self.progress_callback is not None:
+            self.progress_callback(message)
+
+    @property
+    def layer_info(self):
+        return f" for {self.job.layer_name}" if self.job.layer_name else ""
+
+    @property
+    def file_extension(self):
+        return os.path.splitext(self.job.output_file.lower())[1]
+
+    @property
+    def keeps_nested_types(self):
+        """Whether the output format stores structs, maps and lists natively"""
+        return self.file_extension in ('.parquet', '.duckdb')
+
+    @property
+    def output_crs(self):
+        """CRS of the downloaded geometries, quoted for use in SQL"""
+        if not self.job.target_crs or output_stays_in_4326(self.job.output_file):
+            return "EPSG:4326"
+        return self.job.target_crs.replace("'", "''")
+
+    @property
+    def output_format(self):
+        """Entry of data/formats.json for the output file, or None"""
+        return next(
+            (fmt for fmt in get_formats().values() if fmt["extension"] == self.file_extension),
+            None,
+        )
+
+    @property
+    def vector_tile_driver(self):
+        """GDAL driver tiling the output, for PMTiles and MBTiles output"""
+        output_format = self.output_format
+        return output_format.get("vector_tile_driver") if output_format else None
+
+    def connect(self):
+        """Open the DuckDB connection for the job"""
+        import duckdb
+
+        if self.file_extension == '.duckdb':
+            return duckdb.connect(self.job.output_file)  # Connect directly to output file
+        if self.database is not None:
+            return self.database.cursor()
+        return duckdb.connect()
+
+    def run(self):
+        """
+        Run the job
+
+        Returns:
+            DownloadResult: The outcome of the download
+
+        Raises:
+            Exception: Any DuckDB or I/O error raised while downloading
+        """
+        job = self.job
+        table_name = self.table_name
+        self.progress(f"Connecting to database{self.layer_info}...")
+        conn = self.connect()
+        self.conn = conn
+        try:
+            # Install and load the spatial extension
+            self.progress(f"Loading spatial extension{self.layer_info}...")
+            load_extensions(conn, repository=job.extension_repository)
+            if job.range_cache:
+                enable_range_cache(conn, job.range_cache, job.extension_repository)
+
+            url = self.support_s3_style_urls(conn)
+            remote_tuning = RemoteTuning(job.remote_tuning)
+            remote_tuning.configure(conn, url, job.max_threads)
+
+            # Get schema early as we need it for both column names and bbox check
+            schema_query = f"DESCRIBE SELECT * FROM read_parquet('{url}')"
+            start = time.perf_counter()
+            schema_result = conn.execute(schema_query).fetchall()
+            remote_tuning.record_latency(url, time.perf_counter() - start)
+
+            geometry_column = job.geometry_column or detect_geometry_column(schema_result)
+
+            self.progress(f"Planning query{self.layer_info}...")
+            plan_cache = PlanCache(job.plan_cache) if job.plan_cache else None
+            plan = plan_filter(conn, url, schema_result, job, geometry_column, plan_cache)
+            bbox_column = plan.bbox_column
+            if not job.warm_only:
+                self.spill_if_large(conn, url, plan)
+
+            result = DownloadResult(
+                status="written",
+                schema=schema_result,
+                geometry_column=geometry_column,
+                bbox_column=bbox_column,
+                filter_strategy=plan.strategy,
+            )
+
+            self.progress(f"Preparing query{self.layer_info}...")
+            select_query = self.build_select(schema_result, geometry_column)
+            where_clause = self.build_where(
+                plan.filter_bbox_column, geometry_column, plan.strategy
+            )
+
+            # DuckDB output downloads into a staging table that is merged into
+            # the workspace table afterwards
+            table_type = "TEMP TABLE" if self.file_extension == '.duckdb' else "TABLE"
+
+            source_query = f"""{select_query} FROM read_parquet('{url}')
+                {where_clause}"""
+            if job.warm_only:
+                # Hashing whole rows makes DuckDB read every column without
+                # keeping any of them
+                self.progress(f"Reading{self.layer_info} data...")
+                result.row_count = conn.execute(f"""
+                    SELECT COUNT(*) FROM ({source_query}) AS source
+                    WHERE hash(source) IS NOT NULL
+                """).fetchone()[0]
+                result.status = "cancelled" if self.cancelled else "warmed"
+                return result
+            if job.aois:
+                # One scan of the shared bbox, then a spatial join assigns each row
+                # to every area of interest it intersects
+                self.create_aoi_table(conn)
+                aoi_geometry = f", aois.geom AS {AOI_GEOMETRY_COLUMN}" if job.clip else ""
+                source_query = f"""
+                SELECT source.*, aois.{AOI_ID_COLUMN}{aoi_geometry}
+                FROM ({source_query}) AS source
+                JOIN {AOI_TABLE} AS aois
+                ON ST_Intersects(source."{geometry_column}", aois.geom)"""
+
+            if job.clip:
+                source_query = self.build_clip_query(
+                    source_query, schema_result, geometry_column, bbox_column
+                )
+
+            if (
+                job.simplify_tolerance
+                or job.precision_decimals is not None
+                or self.output_crs != "EPSG:4326"
+            ):
+                source_query = self.build_generalize_query(source_query, geometry_column)
+
+            to_consumer = (
+                self.row_consumer is not None
+                and job.memory_layer_max_rows > 0
+                and self.file_extension != '.duckdb'
+                and not job.aois
+            )
+            if to_consumer and job.memory_layer_max_rows < sys.maxsize:
+                # The count only reads the filter columns, and stops once the
+                # result is too large for the row consumer
+                self.progress(f"Counting{self.layer_info} features...")
+                try:
+                    preflight_count = conn.execute(f"""
+                        SELECT COUNT(*) FROM (
+                            SELECT 1 FROM ({source_query}) LIMIT {job.memory_layer_max_rows + 1}
+                        )
+                    """).fetchone()[0]
+                    to_consumer = preflight_count <= job.memory_layer_max_rows
+                except Exception as e:
+                    if not is_http_error(e) or self.cancelled:
+                        raise
+                    # The download retries failed requests, and writes a file
+                    log.info(f"Could not count the features before downloading: {e}")
+                    to_consumer = False
+                if self.cancelled:
+                    result.status = "cancelled"
+                    return result
+
+            # Base query
+            base_query = f"""
+            CREATE {table_type} {table_name} AS (
+                {source_query}
+            )
+            """
+            self.progress(f"Downloading{self.layer_info} data...")
+            log.info("Executing SQL query:")
+            log.info(base_query)
+            try:
+                elapsed = self.execute_with_retries(conn, base_query, url, remote_tuning)
+            except Exception as e:
+                if not is_out_of_memory(e) or self.file_extension == '.duckdb':
+                    raise
+                if self.spill is not None:
+                    raise MemoryError(
+                        f"Downloading{self.layer_info} ran out of memory even when "
+                        "spilling to disk. Download a smaller area or fewer columns."
+                    ) from e
+                # The estimate missed, start over on disk
+                log.warning(f"Download ran out of memory, retrying on disk: {e}")
+                conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+                self.start_spilling(conn)
+                elapsed = self.execute_with_retries(conn, base_query, url, remote_tuning)
+
+            if self.cancelled:
+                result.status = "cancelled"
+                return result
+
+            # Add check for empty results
+            row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+            result.row_count = row_count
+            if job.max_threads is None:
+                if plan_cache is not None:
+                    plan_cache.record(job.dataset_url, plan, elapsed, row_count)
+                if host_key(url) is not None:
+                    remote_tuning.record(url, elapsed, self.estimate_read_bytes(conn, url, plan))
+            if row_count == 0:
+                result.status = "empty"
+                result.message = (
+                    f"No data found{self.layer_info} in the requested area. Check that your "
+                    "map extent overlaps with the data and/or expand your map extent. "
+                    "Skipping to next dataset if available."
+                )
+                return result
+
+            if to_consumer:
+                self.progress(f"Loading{self.layer_info} data into a temporary layer...")
+                layer = self.row_consumer(conn, table_name, geometry_column)
+                if layer is not None:
+                    result.status = "cancelled" if self.cancelled else "memory"
+                    result.layer = layer
+                    result.message = (
+                        f"{row_count} features{self.layer_info} were loaded into a "
+                        f"temporary layer, so {job.output_file} was not written."
+                    )
+                    return result
+                log.warning("Mixed geometry types, writing to file instead of a temporary layer")
+
+            self.progress(f"Processing{self.layer_info} data to requested format...")
+            self.write_output(conn, result)
+            if self.cancelled:
+                result.status = "cancelled"
+            return result
+        finally:
+            # Clean up temporary tables
+            try:
+                conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+                if job.aois:
+                    conn.execute(f"DROP TABLE IF EXISTS {AOI_TABLE}")
+                if self.spill is not None:
+                    detach_spill(conn, self.spill)
+            except Exception:
+                pass
+            self.conn = None
+            conn.close()
+            remove_spill(self.spill)
+            self.spill = None
+            if job.range_cache:
+                prune_range_cache(job.range_cache, job.range_cache_max_mb)
+
+    def spill_if_large(self, conn, url, plan):
+        """
+        Collect the rows on disk when the area could take much of the memory
+
+        The size is only estimated for datasets whose row groups are spatially
+        clustered; in others every row group overlaps the area. DuckDB output
+        already goes to a database file, which DuckDB spills next to on its own.
+        """
+        if (
+            self.file_extension == '.duckdb'
+            or plan.filter_bbox_column is None
+            or not plan.clustered
+        ):
+            return
+        threshold = self.job.spill_threshold_mb
+        if threshold is None:
+            threshold = default_spill_threshold_mb()
+        estimate = estimate_area_mb(conn, url, self.job.bbox, plan.bbox_column)
+        if estimate is not None and estimate > threshold:
+            log.info(f"Estimated {estimate:.0f} MB in the area, above {threshold:.0f} MB")
+            self.start_spilling(conn)
+
+    def estimate_read_bytes(self, conn, url, plan):
+        """
+        Estimate the bytes a download fetched, from the row groups of its area
+
+        Runs after the download, when the footers are in the metadata cache.
+
+        Returns:
+            float: Compressed size of the column chunks read, 0 if unknown
+        """
+        columns = None
+        if self.job.columns:
+            columns = set(self.job.columns) | {plan.geometry_column, plan.bbox_column} - {None}
+        estimate = estimate_area_bytes(conn, url, self.job.bbox, plan.bbox_column, columns)
+        return estimate[0] if estimate else 0
+
+    def start_spilling(self, conn):
+        self.progress(f"Large download{self.layer_info}, working on disk to save memory...")
+        self.spill = enable_spill(conn, self.job.spill_directory)
+
+    def execute_with_retries(self, conn, query, url, remote_tuning):
+        """
+        Run the download query, retrying it with backoff after request errors
+
+        Every failure is fed into the host's tuning, which lowers the number of
+        parallel requests before the next attempt. Retries run on the same
+        connection, so the metadata already fetched is reused.
+
+        Returns:
+            float: Seconds the successful attempt took
+
+        Raises:
+            RemoteReadError: If request errors persist after all retries
+        """
+        for attempt in range(self.job.retries + 1):
+            start = time.perf_counter()
+            try:
+                conn.execute(query)
+                return time.perf_counter() - start
+            except Exception as e:
+                if not is_http_error(e) or self.cancelled:
+                    raise
+                remote_tuning.record(url, error=True)
+                if attempt == self.job.retries:
+                    raise RemoteReadError(
+                        f"Reading {host_key(url) or url} failed after {attempt + 1} "
+                        f"attempts: {e}\n\n{remote_tuning.describe(url)}. The server "
+                        "may be busy or the connection unstable, try again later or "
+                        "download a smaller area."
+                    ) from e
+                wait = RETRY_BACKOFF_SECONDS * 2 ** attempt
+                log.warning(f"Download request failed, retrying in {wait} s: {e}")
+                self.progress(f"Request failed{self.layer_info}, retrying in {wait} s...")
+                conn.execute(f"DROP TABLE IF EXISTS {self.table_name}")
+                if self.cancel_event is not None:
+                    self.cancel_event.wait(wait)
+                else:
+                    time.sleep(wait)
+                if self.cancelled:
+                    # run() reports the cancellation
+                    return 0.0
+                remote_tuning.configure(conn, url, self.job.max_threads)
+
+    def create_aoi_table(self, conn):
+        """Load the job's areas of interest into a temporary table"""
+        conn.execute(
+            f"CREATE OR REPLACE TEMP TABLE {AOI_TABLE} ({AOI_ID_COLUMN} VARCHAR, geom GEOMETRY)"
+        )
+        values = ", ".join(
+            "('{}', ST_GeomFromText('{}'))".format(
+                str(aoi_id).replace("'", "''"), wkt
+            )
+            for aoi_id, wkt in self.job.aois
+        )
+        conn.execute(f"INSERT INTO {AOI_TABLE} VALUES {values}")
+
+    def build_select(self, schema_result, geometry_column):
+        """Build the SELECT clause, converting nested types for formats without them"""
+        job = self.job
+        if job.columns:
+            wanted = set(job.columns) | {geometry_column}
+            schema_result = [row for row in schema_result if row[0] in wanted]
+
+        if self.keeps_nested_types:
+            if job.columns:
+                return "SELECT " + ", ".join(f'"{row[0]}"' for row in schema_result)
+            return "SELECT *"
+
+        # Construct the SELECT clause with array conversion to strings
+        columns = process_schema_columns(schema_result)
+
+        # Check if this is Overture data and has a names column
+        has_names_column = any('names' in row[0] for row in schema_result)
+        if 'overture' in job.dataset_url and has_names_column:
+            return f'SELECT "names"."primary" as name,{", ".join(columns)}'
+        return f'SELECT {", ".join(columns)}'
+
+    def build_where(self, bbox_column, geometry_column, strategy=None):
+        """Build the WHERE clause for the bbox, the AOI polygon and any extra filters"""
+        xmin, ymin, xmax, ymax = self.job.bbox
+        conditions = []
+        if bbox_column is not None:
+            conditions = [
+                f'"{bbox_column}".xmin BETWEEN {xmin} AND {xmax}',
+                f'"{bbox_column}".ymin BETWEEN {ymin} AND {ymax}',
+            ]
+        elif strategy == "geometry_stats":
+            # Extent test that DuckDB can answer from row group geometry statistics
+            conditions.append(
+                f'ST_Intersects_Extent("{geometry_column}", '
+                f'ST_MakeEnvelope({xmin}, {ymin}, {xmax}, {ymax}))'
+            )
+        if self.job.aoi_wkb:
+            # Exact test against the polygon for rows that passed the bbox prefilter
+            conditions.append(f"""ST_Intersects(
+                    "{geometry_column}",
+                    ST_GeomFromWKB(from_hex('{self.job.aoi_wkb.hex()}'))
+                )""")
+        elif bbox_column is None:
+            conditions.append(f"""ST_Intersects(
+                    "{geometry_column}",
+                    ST_GeomFromText('{bbox_polygon_wkt(self.job.bbox)}')
+                )""")
+        conditions.extend(f"({condition})" for condition in self.job.filters)
+        return "WHERE " + "\n                AND ".join(conditions)
+
+    def build_clip_query(self, source_query, schema_result, geometry_column, bbox_column):
+        """
+        Wrap the download query so geometries are cut to the requested area
+
+        Geometries inside the area are kept as they are, others are intersected
+        with it and reduced to the source geometry's dimension, and rows left
+        with empty geometries are dropped. A bbox column is recomputed from the
+        clipped geometry so it stays a valid covering.
+        """
+        job = self.job
+        geometry = f'"{geometry_column}"'
+        if job.aois:
+            clip_geometry = AOI_GEOMETRY_COLUMN
+        elif job.aoi_wkb:
+            clip_geometry = f"ST_GeomFromWKB(from_hex('{job.aoi_wkb.hex()}'))"
+        else:
+            clip_geometry = "ST_MakeEnvelope({}, {}, {}, {})".format(*job.bbox)
+
+        output_columns = {
+            row[0] for row in schema_result
+            if not job.columns or row[0] in job.columns or row[0] == geometry_column
+        }
+        extra_columns = ""
+        if job.keep_original_id and "id" not in output_columns:
+            extra_columns = f", md5(ST_AsHEXWKB({geometry})) AS {SOURCE_FEATURE_ID_COLUMN}"
+
+        clipped = CLIPPED_GEOMETRY_COLUMN
+        replacements = [f"{clipped} AS {geometry}"]
+        if bbox_column in output_columns:
+            bbox_struct = f"""struct_pack(
+                xmin := ST_XMin({clipped}),
+                ymin := ST_YMin({clipped}),
+                xmax := ST_XMax({clipped}),
+                ymax := ST_YMax({clipped})
+            )"""
+            if not self.keeps_nested_types:
+                # Nested columns are written as JSON to formats without them
+                bbox_struct = f"TO_JSON({bbox_struct})"
+            replacements.append(f'{bbox_struct} AS "{bbox_column}"')
+        excluded = [clipped] + ([AOI_GEOMETRY_COLUMN] if job.aois else [])
+
+        return f"""
+                SELECT * EXCLUDE ({", ".join(excluded)}) REPLACE ({", ".join(replacements)})
+                FROM (
+                    SELECT *,
+                        CASE WHEN ST_Within({geometry}, {clip_geometry}) THEN {geometry}
+                        ELSE ST_CollectionExtract(
+                            ST_Intersection({geometry}, {clip_geometry}),
+                            ST_Dimension({geometry}) + 1
+                        ) END AS {clipped}{extra_columns}
+                    FROM ({source_query})
+                )
+                WHERE NOT ST_IsEmpty({clipped})"""
+
+    def build_generalize_query(self, source_query, geometry_column):
+        """
+        Wrap the download query to simplify, reproject and round geometries
+
+        Simplification runs in EPSG:4326, where its tolerance is given, and
+        rounding runs last, so the coordinates written are the rounded ones.
+        """
+        job = self.job
+        geometry = f'"{geometry_column}"'
+        if job.simplify_tolerance:
+            geometry = f"ST_SimplifyPreserveTopology({geometry}, {job.simplify_tolerance})"
+        if self.output_crs != "EPSG:4326":
+            geometry = (
+                f"ST_Transform({geometry}, 'EPSG:4326', '{self.output_crs}', always_xy := true)"
+            )
+        if job.precision_decimals is not None:
+            geometry = f"ST_ReducePrecision({geometry}, {10 ** -job.precision_decimals})"
+        return f"""
+                SELECT * REPLACE ({geometry} AS "{geometry_column}")
+                FROM ({source_query})"""
+
+    def write_output(self, conn, result):
+        """Write the downloaded table to the job's output and fill in the result"""
+        job = self.job
+        table_name = self.table_name
+        geometry_column = result.geometry_column
+
+        if job.aois and job.aoi_output == "files":
+            self.write_aoi_outputs(conn, result)
+            return
+
+        if self.file_extension == '.duckdb':
+            workspace_table = self.merge_into_workspace(conn, geometry_column)
+            # Commit the transaction to ensure the data is saved
+            conn.commit()
+            result.status = "duckdb"
+            result.output = workspace_table
+            result.message = (
+                f"Data has been successfully saved to the {workspace_table} table "
+                "of the DuckDB database."
+            )
+            return
+
+        if self.file_extension == '.parquet' and job.partitioning in PARTITION_SCHEMES:
+            partition_count = self.write_partitioned_parquet(
+                conn, geometry_column, result.row_count
+            )
+            result.status = "partitioned"
+            result.output = self.partition_directory()
+            result.message = (
+                f"Data has been saved as {partition_count} GeoParquet files in "
+                f"{result.output}.\n\n"
+                f"{PARTITION_INDEX_FILE} in that folder lists the bbox of each file, "
+                "so you can open just the pieces you need."
+            )
+            return
+
+        # Check size if exporting to GeoJSON
+        if self.file_extension == '.geojson' and job.geojson_size_limit_mb is not None:
+            estimated_size = estimate_file_size(conn, table_name)
+            if estimated_size > job.geojson_size_limit_mb:
+                result.status = "size_warning"
+                result.estimated_size_mb = estimated_size
+                return
+
+        select_columns = "*"
+        extra_options = None
+        if self.file_extension == '.parquet' and job.optimize_for_requery:
+            select_columns, extra_options = self.requery_copy_options(
+                conn, geometry_column, result.row_count
+            )
+
+        format_options = self.get_format_options(conn, extra_options)
+        if format_options is None:
+            raise ValueError("Unsupported file format.")
+
+        # Vector tiles are cut by GDAL from a Hilbert sorted FlatGeobuf next to
+        # the output, so neighbouring features are read together
+        copy_target = job.output_file
+        if self.vector_tile_driver is not None:
+            copy_target = f"{os.path.splitext(job.output_file)[0]}.tiling.fgb"
+
+        # Use the geometry column from validation results for the Hilbert sorting
+        copy_query = f"""
+        COPY (
+            SELECT {select_columns} FROM (
+                SELECT * FROM {table_name}
+                ORDER BY ST_Hilbert(
+                    "{geometry_column}",
+                    (SELECT ST_Extent(ST_Extent_Agg("{geometry_column}"))::BOX_2D FROM {table_name})
+                )
+            )
+        ) TO '{copy_target}'"""
+
+        log.info("Executing SQL query:")
+        log.info(copy_query + format_options)
+        conn.execute(copy_query + format_options)
+        if copy_target != job.output_file:
+            min_zoom, max_zoom = vector_tile_zoom_range(
+                job.bbox, job.vector_tile_min_zoom, job.vector_tile_max_zoom
+            )
+            self.progress(f"Cutting{self.layer_info} vector tiles for zoom levels {min_zoom}-{max_zoom}...")
+            try:
+                write_vector_tiles(
+                    copy_target, job.output_file, self.vector_tile_driver,
+                    duckdb_table_name(job.dataset_url, job.layer_name), min_zoom, max_zoom,
+                )
+            finally:
+                if os.path.exists(copy_target):
+                    os.remove(copy_target)
+        result.status = "written"
+        result.output = job.output_file
+
+    def write_aoi_outputs(self, conn, result):
+        """
+        Write one output per area of interest from the shared download
+
+        Every area's rows are copied to a staging table that is written the same
+        way a single area download would be, so all formats and options apply.
+        DuckDB output gets one table per area in the job's workspace.
+        """
+        job = self.job
+        download_table = self.table_name
+        aoi_ids = [
+            row[0] for row in conn.execute(
+                f"SELECT DISTINCT {AOI_ID_COLUMN} FROM {download_table} ORDER BY {AOI_ID_COLUMN}"
+            ).fetchall()
+        ]
+        result.outputs = {}
+        try:
+            for aoi_id in aoi_ids:
+                if self.cancelled:
+                    return
+                self.progress(f"Writing area of interest {aoi_id}...")
+                self.table_name = f"{download_table}_aoi"
+                conn.execute(f"""
+                    CREATE OR REPLACE TEMP TABLE {self.table_name} AS
+                    SELECT * EXCLUDE ({AOI_ID_COLUMN}) FROM {download_table}
+                    WHERE {AOI_ID_COLUMN} = '{str(aoi_id).replace("'", "''")}'
+                """)
+                if self.file_extension == '.duckdb':
+                    output_file = job.output_file
+                else:
+                    output_file = aoi_output_path(job.output_file, aoi_id)
+                self.job = replace(
+                    job,
+                    output_file=output_file,
+                    layer_name=f"{job.layer_name or duckdb_table_name(job.dataset_url)}_{aoi_id}",
+                    aois=None,
+                )
+                aoi_result = DownloadResult(
+                    status="written",
+                    geometry_column=result.geometry_column,
+                    row_count=conn.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0],
+                )
+                self.write_output(conn, aoi_result)
+                conn.execute(f"DROP TABLE IF EXISTS {self.table_name}")
+                if aoi_result.status == "size_warning":
+                    result.status = "size_warning"
+                    result.estimated_size_mb = aoi_result.estimated_size_mb
+                    return
+                result.outputs[aoi_id] = aoi_result.output
+        finally:
+            self.table_name = download_table
+            self.job = job
+
+        result.status = "per_aoi"
+        result.message = (
+            f"Data has been saved for {len(result.outputs)} of {len(job.aois)} areas of interest."
+        )
+        if self.file_extension == '.duckdb':
+            result.message += f" Each area is a table of {job.output_file}."
+
+    def support_s3_style_urls(self, conn):
+        dataset_url = self.job.dataset_url
+        if "minio://" in dataset_url:
+            url = dataset_url[len("minio://"):]
+            first_slash = url.find("/")
+            if first_slash == -1:
+                return
+
+            host = url[:first_slash]
+            path = "s3://" + url[first_slash+1:]
+
+            conn.execute("SET s3_url_style='path';")
+            conn.execute(f"SET s3_endpoint='{host}';")
+            return path
+        return dataset_url
+
+    def merge_into_workspace(self, conn, geometry_column):
+        """
+        Merge the downloaded rows into a per-dataset table of the DuckDB workspace
+
+        New tables are created from the download. Existing tables are either
+        replaced, or appended to with rows sharing an id with the download
+        replaced. A bbox struct column is materialized when the data has none, or
+        replaces a bbox column of another type, and an R-tree index on the
+        geometry is rebuilt after loading.
+
+        Returns:
+            str: The name of the workspace table
+        """
+        job = self.job
+        table_name = self.table_name
+        target = duckdb_table_name(job.dataset_url, job.layer_name)
+        self.progress(f"Saving to the {target} table...")
+
+        schema = conn.execute(f"DESCRIBE {table_name}").fetchall()
+        column_types = {row[0]: row[1].upper() for row in schema}
+        select_columns = "*"
+        bbox_name = next((name for name in column_types if name.lower() == "bbox"), None)
+        if bbox_name is None or "STRUCT" not in column_types[bbox_name]:
+            bbox_struct = f"""struct_pack(
+                xmin := ST_XMin("{geometry_column}"),
+                ymin := ST_YMin("{geometry_column}"),
+                xmax := ST_XMax("{geometry_column}"),
+                ymax := ST_YMax("{geometry_column}")
+            )"""
+            if bbox_name is None:
+                select_columns = f"*, {bbox_struct} AS bbox"
+            else:
+                select_columns = f'* REPLACE ({bbox_struct} AS "{bbox_name}")'
+
+        index_name = f"{target}_{geometry_column}_rtree"
+        table_exists = conn.execute(
+            f"SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = '{target}' AND NOT temporary"
+        ).fetchone()[0] > 0
+
+        if table_exists and job.duckdb_append:
+            # Bulk changes are faster without the index, it is rebuilt below
+            conn.execute(f'DROP INDEX IF EXISTS "{index_name}"')
+            if "id" in column_types:
+                conn.execute(
+                    f'DELETE FROM "{target}" WHERE "id" IN (SELECT "id" FROM {table_name})'
+                )
+            conn.execute(
+                f'INSERT INTO "{target}" BY NAME SELECT {select_columns} FROM {table_name}'
+            )
+        else:
+            conn.execute(
+                f'CREATE OR REPLACE TABLE "{target}" AS SELECT {select_columns} FROM {table_name}'
+            )
+
+        if job.duckdb_rtree and column_types.get(geometry_column) == "GEOMETRY":
+            self.progress(f"Building spatial index on {target}...")
+            conn.execute(
+                f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{target}" USING RTREE ("{geometry_column}")'
+            )
+        return target
+
+    def get_format_options(self, conn, extra_options=None):
+        """Build the COPY options for the output file from data/formats.json"""
+        output_format = self.output_format
+        if output_format is None:
+            return None
+
+        profiles = output_format.get("compression_profiles")
+        if not profiles:
+            return self.add_format_options(
+                output_format["format_options"].format(srs=self.output_crs), extra_options
+            )
+
+        profile_name = self.job.compression_profile
+        if profile_name not in profiles:
+            profile_name = output_format["default_compression_profile"]
+        profile = dict(profiles[profile_name])
+        if profile["compression_level"] is None:
+            profile["compression_level"] = self.choose_compression_level(conn, profile)
+        log.info(
+            f"Using {profile_name} compression profile: "
+            f"{profile['compression']} level {profile['compression_level']}"
+        )
+        return self.add_format_options(
+            output_format["format_options"].format(**profile), extra_options
+        )
+
+    def add_format_options(self, format_options, extra_options=None):
+        """Append extra COPY options inside the closing parenthesis"""
+        if extra_options:
+            format_options = f"{format_options[:-1]}, {', '.join(extra_options)})"
+        return format_options + ";"
+
+    def partition_directory(self):
+        """Folder that holds the files of a partitioned output"""
+        return os.path.splitext(self.job.output_file)[0]
+
+    def write_partitioned_parquet(self, conn, geometry_column, row_count):
+        """
+        Write the results as a folder of GeoParquet files split by spatial partition
+
+        Hilbert partitioning splits the Hilbert sorted rows into ranges of similar
+        size, quadkey partitioning groups features by the web mercator tile holding
+        their centroid. DuckDB writes the partitions in parallel, and an index file
+        with the bbox and row count of every file is written next to them.
+
+        Returns:
+            int: The number of partitions written
+        """
+        job = self.job
+        table_name = self.table_name
+        partition_dir = self.partition_directory()
+        hilbert_order = f"""ST_Hilbert(
+            "{geometry_column}",
+            (SELECT ST_Extent(ST_Extent_Agg("{geometry_column}"))::BOX_2D FROM {table_name})
+        )"""
+        if job.partitioning == "hilbert":
+            partition_column = "hilbert_range"
+            partitions = min(MAX_PARTITIONS, max(1, math.ceil(row_count / PARTITION_TARGET_ROWS)))
+            partition_key = f"ntile({partitions}) OVER (ORDER BY {hilbert_order})"
+        else:
+            partition_column = "quadkey"
+            # Pick a zoom where the requested extent spans roughly 8 tiles across
+            extent_width = max(job.bbox[2] - job.bbox[0], 1e-9)
+            zoom = min(20, max(1, int(math.log2(360 / extent_width)) + 3))
+            partition_key = f"""ST_QuadKey(
+                ST_X(ST_Centroid("{geometry_column}")),
+                ST_Y(ST_Centroid("{geometry_column}")),
+                {zoom}
+            )"""
+
+        self.progress("Assigning spatial partitions...")
+        conn.execute(f"""
+            CREATE TABLE {table_name}_partitioned AS
+            SELECT *, {partition_key} AS {partition_column}
+            FROM {table_name}
+            ORDER BY {hilbert_order}
+        """)
+        conn.execute(f"DROP TABLE {table_name}")
+        conn.execute(f"ALTER TABLE {table_name}_partitioned RENAME TO {table_name}")
+
+        self.progress("Writing partitioned GeoParquet files...")
+        select_columns = "*"
+        extra_options = [f"PARTITION_BY ({partition_column})", "OVERWRITE_OR_IGNORE true"]
+        if job.optimize_for_requery:
+            select_columns, requery_options = self.requery_copy_options(
+                conn, geometry_column, row_count
+            )
+            extra_options.extend(requery_options)
+        format_options = self.get_format_options(conn, extra_options)
+        copy_query = f"COPY (SELECT {select_columns} FROM {table_name}) TO '{partition_dir}' {format_options}"
+        log.info("Executing SQL query:")
+        log.info(copy_query)
+        conn.execute(copy_query)
+
+        partition_stats = conn.execute(f"""
+            SELECT
+                {partition_column},
+                MIN(ST_XMin("{geometry_column}")),
+                MIN(ST_YMin("{geometry_column}")),
+                MAX(ST_XMax("{geometry_column}")),
+                MAX(ST_YMax("{geometry_column}")),
+                COUNT(*)
+            FROM {table_name}
+            GROUP BY {partition_column}
+            ORDER BY {partition_column}
+        """).fetchall()
+
+        index = {
+            "partitioning": job.partitioning,
+            "partition_column": partition_column,
+            "geometry_column": geometry_column,
+            "source": job.dataset_url,
+            "partitions": [],
+        }
+        for key, xmin, ymin, xmax, ymax, count in partition_stats:
+            folder = os.path.join(partition_dir, f"{partition_column}={key}")
+            index["partitions"].append({
+                partition_column: key,
+                "files": sorted(
+                    os.path.relpath(path, partition_dir)
+                    for path in glob.glob(os.path.join(folder, "*.parquet"))
+                ),
+                "bbox": [xmin, ymin, xmax, ymax],
+                "row_count": count,
+            })
+        with open(os.path.join(partition_dir, PARTITION_INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=2)
+
+        return len(partition_stats)
+
+    def choose_compression_level(self, conn, profile):
+        """
+        Pick the compression level with the lowest combined compress and write time
+
+        Each candidate level compresses a sample of the table. The time taken plus
+        the time the output disk needs to write the compressed bytes gives the
+        estimated cost, so slow disks favour higher levels and fast disks lower ones.
+        """
+        self.progress("Measuring compression speed...")
+        output_dir = os.path.dirname(os.path.abspath(self.job.output_file))
+        disk_speed = measure_disk_write_speed(output_dir)
+
+        best_level = None
+        best_cost = None
+        with tempfile.TemporaryDirectory(dir=output_dir) as sample_dir:
+            for level in profile["candidate_levels"]:
+                sample_file = os.path.join(sample_dir, f"sample_{level}.parquet")
+                start = time.perf_counter()
+                conn.execute(f"""
+                    COPY (SELECT * FROM {self.table_name} LIMIT {AUTO_COMPRESSION_SAMPLE_ROWS})
+                    TO '{sample_file}'
+                    (FORMAT 'parquet', COMPRESSION '{profile['compression']}', COMPRESSION_LEVEL {level})
+                """)
+                cost = time.perf_counter() - start + os.path.getsize(sample_file) / disk_speed
+                # Prefer the higher level when costs are equal, as it gives smaller files
+                if best_cost is None or cost <= best_cost:
+                    best_level, best_cost = level, cost
+
+        log.info(f"Disk writes {disk_speed / (1024 * 1024):.0f} MB/s, auto compression level {best_level}")
+        return best_level
+
+    def requery_copy_options(self, conn, geometry_column, row_count):
+        """
+        Build the SELECT list and COPY options for GeoParquet optimized for re-querying
+
+        The output always gets a bbox struct column described as a GeoParquet 1.1
+        covering, row groups sized to compact Hilbert ranges, and bloom filters for
+        dictionary encoded columns such as ids. The geometry is written as WKB with
+        our own "geo" metadata so the covering is always declared.
+
+        Returns:
+            tuple: (SELECT list, list of extra COPY options)
+        """
+        table_name = self.table_name
+        self.progress("Preparing optimized GeoParquet layout...")
+        select_columns = []
+        has_bbox_column = False
+        for row in conn.execute(f"DESCRIBE {table_name}").fetchall():
+            col_name, col_type = row[0], row[1]
+            if col_name == geometry_column:
+                select_columns.append(f'ST_AsWKB("{col_name}") AS "{col_name}"')
+            else:
+                select_columns.append(f'"{col_name}"')
+            if col_name.lower() == 'bbox' and 'struct' in col_type.lower():
+                has_bbox_column = True
+        if not has_bbox_column:
+            select_columns.append(f"""struct_pack(
+                xmin := ST_XMin("{geometry_column}"),
+                ymin := ST_YMin("{geometry_column}"),
+                xmax := ST_XMax("{geometry_column}"),
+                ymax := ST_YMax("{geometry_column}")
+            ) AS bbox""")
+
+        geometry_types, has_z, xmin, ymin, xmax, ymax = conn.execute(f"""
+            SELECT
+                list(DISTINCT ST_GeometryType("{geometry_column}")),
+                COALESCE(bool_or(ST_HasZ("{geometry_column}")), false),
+                MIN(ST_XMin("{geometry_column}")),
+                MIN(ST_YMin("{geometry_column}")),
+                MAX(ST_XMax("{geometry_column}")),
+                MAX(ST_YMax("{geometry_column}"))
+            FROM {table_name}
+        """).fetchone()
+        geo_metadata = build_geo_metadata(
+            geometry_column, geometry_types or [], has_z, [xmin, ymin, xmax, ymax]
+        )
+        geo_json = json.dumps(geo_metadata).replace("'", "''")
+
+        row_group_size = requery_row_group_size(row_count)
+        options = [
+            f"ROW_GROUP_SIZE {row_group_size}",
+            f"KV_METADATA {{geo: '{geo_json}'}}",
+        ]
+        if duckdb_version_at_least(1, 2):
+            # Bloom filters are only written for dictionary encoded columns, so allow
+            # dictionaries large enough to hold unique id values of a whole row group
+            options.append(f"DICTIONARY_SIZE_LIMIT {row_group_size}")
+            options.append("BLOOM_FILTER_FALSE_POSITIVE_RATIO 0.01")
+        return ", ".join(select_columns), options
+
+
+def run_download(job, progress=None, cancel_event=None):
+    """
+    Run a download and block until it completes
+
+    Args:
+        job (DownloadJob): What to download
+        progress (callable): Called with status messages
+        cancel_event (threading.Event): Set to cancel the job
+
+    Returns:
+        DownloadResult: The outcome of the download
+    """
+    return DownloadEngine(job, progress, cancel_event).run()
+
+
+def submit_download(job, executor, progress=None, cancel_event=None):
+    """
+    Start a download on an executor
+
+    Returns:
+        concurrent.futures.Future: Resolves to the DownloadResult
+    """
+    return executor.submit(run_download, job, progress, cancel_event)
+
+
+def download_many(jobs, max_workers=4, progress=None, cancel_event=None):
+    """
+    Run several downloads in parallel and wait for all of them
+
+    Args:
+        jobs (list): DownloadJob objects
+        max_workers (int): Number of downloads to run at once
+        progress (callable): Called with (job, message) for every status message
+        cancel_event (threading.Event): Set to cancel all remaining work
+
+    Returns:
+        list: DownloadResult objects in the order of the jobs; failed jobs hold
+        the exception instead
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            submit_download(
+                job,
+                executor,
+                (lambda message, job=job: progress(job, message)) if progress else None,
+                cancel_event,
+            )
+            for job in jobs
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+async def download_async(job, progress=None, cancel_event=None, executor=None):
+    """
+    Run a download from asyncio without blocking the event loop
+
+    The job runs on the given executor, or the loop's default one. Progress
+    callbacks are made from that worker thread.
+
+    Returns:
+        DownloadResult: The outcome of the download
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, run_download, job, progress, cancel_event)
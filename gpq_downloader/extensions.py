@@ -0,0 +1,98 @@
+import os
+import threading
+
+# Extensions every download needs
+DEFAULT_EXTENSIONS = ("httpfs", "spatial")
+# Optional extensions published in DuckDB's community repository
+COMMUNITY_EXTENSIONS = ("cache_httpfs",)
+
+# Optional folder of extension binaries shipped with the plugin, laid out as
+# extensions/v<duckdb version>/<platform>/<name>.duckdb_extension
+BUNDLED_EXTENSIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "extensions"
+)
+
+# Extensions known to be installed in this session, so jobs only need to LOAD
+_ready_extensions = set()
+_lock = threading.Lock()
+
+
+def bundled_extension_path(conn, name, version):
+    """
+    Find a bundled binary of an extension for the running DuckDB
+
+    Args:
+        conn: DuckDB connection, used to look up the platform
+        name (str): Extension name
+        version (str): DuckDB version, e.g. "1.2.1"
+
+    Returns:
+        str: Path of the .duckdb_extension file, or None if none is bundled
+    """
+    version_dir = os.path.join(BUNDLED_EXTENSIONS_DIR, f"v{version}")
+    if not os.path.isdir(version_dir):
+        return None
+    platform = conn.execute("PRAGMA platform").fetchone()[0]
+    path = os.path.join(version_dir, platform, f"{name}.duckdb_extension")
+    return path if os.path.exists(path) else None
+
+
+def installed_extensions(conn):
+    """Return the names of extensions present in the local extension directory"""
+    rows = conn.execute(
+        "SELECT extension_name, installed FROM duckdb_extensions()"
+    ).fetchall()
+    return {row[0] for row in rows if row[1] is True}
+
+
+def install_extension(conn, name, version, repository=None):
+    """
+    Install an extension, preferring local sources over the default repository
+
+    Bundled binaries are used first, then the configured repository (a local
+    folder or mirror URL), and only then DuckDB's default or community repository.
+    """
+    bundled_path = bundled_extension_path(conn, name, version)
+    if bundled_path:
+        conn.execute(f"INSTALL '{bundled_path}';")
+    elif repository:
+        conn.execute(f"INSTALL {name} FROM '{repository}';")
+    elif name in COMMUNITY_EXTENSIONS:
+        conn.execute(f"INSTALL {name} FROM community;")
+    else:
+        conn.execute(f"INSTALL {name};")
+
+
+def load_extensions(conn, names=DEFAULT_EXTENSIONS, repository=None):
+    """
+    Load DuckDB extensions, installing any that are missing once per session
+
+    The local extension directory is only checked the first time an extension is
+    requested. After that, connections just LOAD it, which keeps installation
+    off the critical path of every job and works without network access once
+    the extensions are present.
+
+    Args:
+        conn: DuckDB connection to load the extensions into
+        names (tuple): Extension names
+        repository (str): Optional local path or URL of an extension repository
+    """
+    import duckdb
+
+    with _lock:
+        missing = [name for name in names if name not in _ready_extensions]
+        if missing:
+            installed = installed_extensions(conn)
+            for name in missing:
+                if name not in installed:
+                    install_extension(conn, name, duckdb.__version__, repository)
+                _ready_extensions.add(name)
+
+    for name in names:
+        conn.execute(f"LOAD {name};")
+
+
+def reset_extension_cache():
+    """Forget which extensions are installed, so the next load checks again"""
+    with _lock:
+        _ready_extensions.clear()
@@ -0,0 +1,390 @@
+"""
+Live layers that query a remote GeoParquet dataset for the current map view.
+
+Instead of a one-shot download, a LiveLayer keeps a temporary layer filled with
+the features in view. The view is split into tiles of a lon/lat grid at a zoom
+level that follows the map scale. Tiles that aren't cached yet are read in a
+QgsTask through the download engine, with the same planned bbox pushdown as a
+regular download, and kept in an LRU cache. Extent changes are debounced, and a
+read for a view the user already left is cancelled.
+"""
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsFeature,
+    QgsField,
+    QgsGeometry,
+    QgsProject,
+    QgsSettings,
+    QgsTask,
+    QgsVectorLayer,
+)
+from qgis.PyQt.QtCore import QObject, QTimer
+
+from . import logger
+from .engine import DownloadEngine, DownloadJob, duckdb_table_name, union_bbox
+from .range_cache import DEFAULT_RANGE_CACHE_MB
+
+log = logging.getLogger(__name__)
+
+# Wait this long after the last extent change before reading tiles
+LIVE_LAYER_DEBOUNCE_MS = 500
+# Tiles are 360 / 2**zoom degrees wide. Views needing tiles larger than the
+# minimum zoom would read too much data, so the layer stays empty there.
+LIVE_LAYER_MIN_ZOOM = 10
+LIVE_LAYER_MAX_ZOOM = 16
+# Tiles kept in memory across view changes
+LIVE_LAYER_CACHE_TILES = 256
+
+
+def tile_zoom(bbox):
+    """Zoom level whose tiles are about half the width of the view"""
+    width = max(bbox[2] - bbox[0], 1e-9)
+    return min(LIVE_LAYER_MAX_ZOOM, max(0, math.floor(math.log2(360 / width)) + 1))
+
+
+def tile_for_point(x, y, zoom):
+    """Key (zoom, column, row) of the tile holding a lon/lat point"""
+    size = 360 / 2 ** zoom
+    return (zoom, math.floor((x + 180) / size), math.floor((y + 90) / size))
+
+
+def tile_bbox(key):
+    """(xmin, ymin, xmax, ymax) of a tile"""
+    zoom, column, row = key
+    size = 360 / 2 ** zoom
+    return (
+        column * size - 180,
+        row * size - 90,
+        (column + 1) * size - 180,
+        (row + 1) * size - 90,
+    )
+
+
+def tiles_for_bbox(bbox, zoom):
+    """Keys of the tiles covering a bbox"""
+    _, first_column, first_row = tile_for_point(bbox[0], bbox[1], zoom)
+    _, last_column, last_row = tile_for_point(bbox[2], bbox[3], zoom)
+    return [
+        (zoom, column, row)
+        for column in range(first_column, last_column + 1)
+        for row in range(first_row, last_row + 1)
+    ]
+
+
+class TileCache:
+    """
+    Features of recently viewed tiles, evicting the least recently used
+
+    Args:
+        max_tiles (int): Number of tiles to keep
+    """
+
+    def __init__(self, max_tiles=LIVE_LAYER_CACHE_TILES):
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def get(self, key):
+        self.tiles.move_to_end(key)
+        return self.tiles[key]
+
+    def put(self, key, features):
+        self.tiles[key] = features
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+
+
+class TileReader:
+    """
+    Row consumer that sorts the downloaded rows into tiles as QGIS features
+
+    Every feature goes to the tile holding its bbox's lower left corner, the
+    point the bbox filter tests, so features crossing tile edges appear once.
+
+    Args:
+        tiles (list): Keys of the tiles wanted; rows of other tiles are dropped
+    """
+
+    def __init__(self, tiles):
+        self.tiles = set(tiles)
+        self.zoom = tiles[0][0]
+        self.fields = []
+        self.geometry_types = set()
+        self.features = {key: [] for key in tiles}
+
+    def __call__(self, conn, table_name, geometry_column):
+        from .utils import memory_field_type
+
+        self.geometry_types = {
+            row[0] for row in conn.execute(
+                f'SELECT DISTINCT ST_GeometryType("{geometry_column}") FROM {table_name}'
+            ).fetchall()
+        }
+        select_columns = []
+        for col_name, col_type, *_ in conn.execute(f"DESCRIBE {table_name}").fetchall():
+            if col_name == geometry_column:
+                continue
+            field_type, cast_type = memory_field_type(col_type)
+            self.fields.append(QgsField(col_name, field_type))
+            if cast_type is None:
+                select_columns.append(f'"{col_name}"')
+            elif 'STRUCT' in col_type.upper() or 'MAP' in col_type.upper() or '[]' in col_type:
+                select_columns.append(f'CAST(TO_JSON("{col_name}") AS VARCHAR)')
+            else:
+                select_columns.append(f'CAST("{col_name}" AS {cast_type})')
+        select_columns.extend([
+            f'ST_XMin("{geometry_column}")',
+            f'ST_YMin("{geometry_column}")',
+            f'ST_AsWKB("{geometry_column}")',
+        ])
+        rows = conn.execute(f"SELECT {', '.join(select_columns)} FROM {table_name}").fetchall()
+        for row in rows:
+            key = tile_for_point(row[-3], row[-2], self.zoom)
+            if key not in self.tiles or row[-1] is None:
+                continue
+            feature = QgsFeature()
+            feature.setAttributes(list(row[:-3]))
+            geometry = QgsGeometry()
+            geometry.fromWkb(bytes(row[-1]))
+            geometry.convertToMultiType()
+            feature.setGeometry(geometry)
+            self.features[key].append(feature)
+        return self.features
+
+
+class LiveTileTask(QgsTask):
+    """
+    Reads a set of missing tiles with one engine job over their combined bbox
+
+    Cancelling interrupts the query the engine is running, so a read for a
+    view the user already left stops at once.
+
+    Args:
+        job (DownloadJob): Job for the combined bbox
+        reader (TileReader): Row consumer collecting the tiles' features
+    """
+
+    def __init__(self, job, reader):
+        super().__init__(f"Loading {job.layer_name}", QgsTask.CanCancel)
+        self.job = job
+        self.reader = reader
+        self.cancel_event = threading.Event()
+        self.engine = DownloadEngine(
+            job, cancel_event=self.cancel_event, row_consumer=reader
+        )
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.engine.run()
+        except Exception as e:
+            if not self.cancel_event.is_set():
+                self.error = str(e)
+            return False
+        return self.result.status in ("memory", "empty")
+
+    def cancel(self):
+        self.engine.interrupt()
+        super().cancel()
+
+
+class LiveLayer(QObject):
+    """
+    A temporary layer showing a remote dataset's features in the map view
+
+    Args:
+        iface: The QGIS interface, whose map canvas is followed
+        dataset_url (str): URL of the GeoParquet file or partition
+        layer_name (str): Name of the layer, derived from the URL when None
+    """
+
+    def __init__(self, iface, dataset_url, layer_name=None):
+        super().__init__()
+        logger.install_log_handler()
+        self.iface = iface
+        self.dataset_url = dataset_url
+        self.layer_name = layer_name or duckdb_table_name(dataset_url)
+        self.layer = None
+        self.layer_id = None
+        self.cache = TileCache()
+        self.task = None
+        self.visible_tiles = []
+        # Columns found by the first read, so later reads skip detection
+        self.validation_results = {}
+        # Whether the view is zoomed out too far, to only say so once
+        self.zoomed_out = False
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(LIVE_LAYER_DEBOUNCE_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.iface.mapCanvas().extentsChanged.connect(self.schedule)
+        QgsProject.instance().layerWillBeRemoved.connect(self.layer_removed)
+
+    def start(self):
+        self.refresh()
+
+    def schedule(self):
+        """Restart the debounce timer and drop any read for the previous view"""
+        self.cancel_task()
+        self.timer.start()
+
+    def cancel_task(self):
+        if self.task is not None:
+            try:
+                self.task.cancel()
+            except RuntimeError:
+                pass  # The task manager already deleted the finished task
+            self.task = None
+
+    def current_bbox(self):
+        from .utils import transform_bbox_to_4326
+
+        canvas = self.iface.mapCanvas()
+        extent = transform_bbox_to_4326(
+            canvas.extent(), canvas.mapSettings().destinationCrs()
+        )
+        return (
+            max(-180.0, extent.xMinimum()),
+            max(-90.0, extent.yMinimum()),
+            min(180.0, extent.xMaximum()),
+            min(90.0, extent.yMaximum()),
+        )
+
+    def refresh(self):
+        """Show the cached tiles in view and start reading the missing ones"""
+        bbox = self.current_bbox()
+        zoom = tile_zoom(bbox)
+        if zoom < LIVE_LAYER_MIN_ZOOM:
+            self.visible_tiles = []
+            if not self.zoomed_out:
+                self.zoomed_out = True
+                self.iface.messageBar().pushInfo(
+                    self.layer_name, "Zoom in to load features of this live layer."
+                )
+            self.update_layer()
+            return
+
+        self.zoomed_out = False
+        self.visible_tiles = tiles_for_bbox(bbox, zoom)
+        missing = [key for key in self.visible_tiles if key not in self.cache]
+        self.update_layer()
+        if not missing:
+            return
+
+        reader = TileReader(missing)
+        task = LiveTileTask(self.tile_job(union_bbox(tile_bbox(key) for key in missing)), reader)
+        task.taskCompleted.connect(lambda: self.tiles_loaded(task))
+        task.taskTerminated.connect(lambda: self.tiles_failed(task))
+        self.task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def tile_job(self, bbox):
+        """Describe reading the rows of a bbox as an engine job"""
+        from .utils import plan_cache_path, range_cache_path, remote_tuning_path
+
+        settings = QgsSettings()
+        range_cache = settings.value(
+            "gpq_downloader/range_cache", False, type=bool, section=QgsSettings.Plugins
+        )
+        return DownloadJob(
+            dataset_url=self.dataset_url,
+            bbox=bbox,
+            output_file=os.path.join(tempfile.gettempdir(), "gpq_live_layer.parquet"),
+            layer_name=self.layer_name,
+            bbox_column=self.validation_results.get("bbox_column"),
+            geometry_column=self.validation_results.get("geometry_column"),
+            extension_repository=settings.value(
+                "gpq_downloader/extension_repository", "", type=str, section=QgsSettings.Plugins
+            ),
+            memory_layer_max_rows=sys.maxsize,
+            plan_cache=plan_cache_path(),
+            remote_tuning=remote_tuning_path(),
+            range_cache=range_cache_path() if range_cache else None,
+            range_cache_max_mb=settings.value(
+                "gpq_downloader/range_cache_max_mb", DEFAULT_RANGE_CACHE_MB, type=int, section=QgsSettings.Plugins
+            ),
+        )
+
+    def tiles_loaded(self, task):
+        reader = task.reader
+        if not self.validation_results and task.result is not None:
+            self.validation_results = {
+                "bbox_column": task.result.bbox_column,
+                "geometry_column": task.result.geometry_column,
+            }
+        for key, features in reader.features.items():
+            self.cache.put(key, features)
+        if self.layer is None and reader.geometry_types:
+            self.create_layer(reader)
+        if self.task is task:
+            self.task = None
+        self.update_layer()
+
+    def tiles_failed(self, task):
+        if task.error:
+            self.iface.messageBar().pushWarning(self.layer_name, task.error)
+        if self.task is task:
+            self.task = None
+
+    def create_layer(self, reader):
+        """Create the layer once the first read shows the geometry type and fields"""
+        from .utils import memory_layer_geometry_type
+
+        geometry_type = memory_layer_geometry_type(reader.geometry_types)
+        if geometry_type is None:
+            log.warning(f"{self.layer_name} mixes geometry types, showing polygons only")
+            geometry_type = "Polygon"
+        if not geometry_type.startswith("Multi"):
+            geometry_type = f"Multi{geometry_type}"
+        self.layer = QgsVectorLayer(geometry_type, self.layer_name, "memory")
+        self.layer.setCrs(QgsCoordinateReferenceSystem("EPSG:4326"))
+        self.layer.dataProvider().addAttributes(reader.fields)
+        self.layer.updateFields()
+        self.layer.dataProvider().createSpatialIndex()
+        self.layer_id = self.layer.id()
+        QgsProject.instance().addMapLayer(self.layer)
+
+    def update_layer(self):
+        """Replace the layer's features with those of the visible cached tiles"""
+        if self.layer is None:
+            return
+        provider = self.layer.dataProvider()
+        provider.truncate()
+        geometry_type = self.layer.geometryType()
+        features = [
+            feature
+            for key in self.visible_tiles if key in self.cache
+            for feature in self.cache.get(key)
+            if feature.geometry().type() == geometry_type
+        ]
+        provider.addFeatures(features)
+        self.layer.updateExtents()
+        self.layer.triggerRepaint()
+
+    def layer_removed(self, layer_id):
+        if layer_id == self.layer_id:
+            self.layer = None
+            self.stop()
+
+    def stop(self):
+        """Stop following the map view"""
+        self.timer.stop()
+        self.cancel_task()
+        try:
+            self.iface.mapCanvas().extentsChanged.disconnect(self.schedule)
+            QgsProject.instance().layerWillBeRemoved.disconnect(self.layer_removed)
+        except TypeError:
+            pass  # Already stopped
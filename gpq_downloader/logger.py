@@ -1,3 +1,5 @@
+import logging
+
 from qgis.core import Qgis, QgsMessageLog
 
 
@@ -12,3 +14,24 @@ def log(message: str, level_in: int = 0):
         level = Qgis.MessageLevel.Info
 
     QgsMessageLog.logMessage(str(message), "GeoParquet Downloader", level)
+
+
+class QgsLogHandler(logging.Handler):
+    """Forward records from the Qt-free modules to the QGIS message log"""
+
+    def emit(self, record):
+        if record.levelno >= logging.ERROR:
+            level_in = 2
+        elif record.levelno >= logging.WARNING:
+            level_in = 1
+        else:
+            level_in = 0
+        log(self.format(record), level_in)
+
+
+def install_log_handler():
+    """Send the package's standard logging output to the QGIS message log, once"""
+    package_logger = logging.getLogger(__package__)
+    if not any(isinstance(h, QgsLogHandler) for h in package_logger.handlers):
+        package_logger.addHandler(QgsLogHandler())
+        package_logger.setLevel(logging.INFO)
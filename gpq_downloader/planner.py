@@ -0,0 +1,400 @@
+"""
+Filter strategy planning for downloads.
+
+Before a download the planner probes the dataset's schema, GeoParquet covering
+metadata and Parquet row group statistics to choose the cheapest way to find
+the rows in the requested area. Decisions and the measured cost of running
+them are kept in a JSON plan cache, so later downloads of the same dataset skip
+the probe; each supported strategy is run once, and after that the one that
+performed best is reused.
+
+Like the engine, this module has no Qt or QGIS dependencies.
+"""
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+
+log = logging.getLogger(__name__)
+
+# Strategies:
+#   bbox            test the small bbox covering struct. When its row group
+#                   statistics are spatially clustered DuckDB skips most row
+#                   groups without reading them, otherwise every one is read.
+#   geometry_stats  native Parquet GEOMETRY column with bbox statistics, pruned
+#                   with an extent test before the exact intersection
+#   geometry        exact ST_Intersects on every geometry
+STRATEGIES = ("bbox", "geometry_stats", "geometry")
+# Reads every geometry, so it is only run when nothing else is supported
+EXACT_STRATEGY = "geometry"
+# Row groups count as spatially clustered when their average xmin range is at
+# most this fraction of the xmin range of the whole file
+CLUSTERED_ROW_GROUP_FRACTION = 0.5
+# File name of the plan cache in the plugin's settings folder
+PLAN_CACHE_FILE = "filter_plans.json"
+# Footers read to estimate the size of an area in a multi-file dataset
+SIZE_SAMPLE_FILES = 8
+
+_cache_lock = threading.Lock()
+
+
+@dataclass
+class FilterPlan:
+    """
+    How a download finds the rows in its area
+
+    Attributes:
+        strategy: One of STRATEGIES
+        geometry_column: Geometry column to test
+        bbox_column: bbox covering column of the dataset, or None
+        candidates: Strategies the dataset supports, expected cheapest first
+        clustered: Whether the row group statistics of the bbox column are
+            spatially clustered, so a bbox filter skips most row groups
+        reason: Why the strategy was chosen, for the log
+        cached: Whether the plan came from the plan cache
+    """
+
+    strategy: str
+    geometry_column: str
+    bbox_column: str = None
+    candidates: list = field(default_factory=list)
+    clustered: bool = False
+    reason: str = ""
+    cached: bool = False
+
+    @property
+    def filter_bbox_column(self):
+        """The bbox column to filter on, or None when the strategy doesn't use it"""
+        return self.bbox_column if self.strategy == "bbox" else None
+
+
+class PlanCache:
+    """
+    Plans and their measured costs, persisted as JSON by dataset URL
+
+    Args:
+        path (str): JSON file to read and write
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, plans):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(plans, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def get(self, dataset_url):
+        """Return the cached entry of a dataset, or None"""
+        with _cache_lock:
+            return self.load().get(dataset_url)
+
+    def record(self, dataset_url, plan, seconds, row_count):
+        """Store a plan and add one run of it to the strategy's measured cost"""
+        with _cache_lock:
+            plans = self.load()
+            entry = plans.get(dataset_url, {})
+            costs = entry.get("costs", {})
+            cost = costs.get(plan.strategy, {"seconds": 0.0, "rows": 0, "runs": 0})
+            cost["seconds"] += seconds
+            cost["rows"] += row_count
+            cost["runs"] += 1
+            costs[plan.strategy] = cost
+            plans[dataset_url] = {
+                "geometry_column": plan.geometry_column,
+                "bbox_column": plan.bbox_column,
+                "candidates": plan.candidates,
+                "clustered": plan.clustered,
+                "reason": plan.reason,
+                "costs": costs,
+            }
+            try:
+                self.save(plans)
+            except OSError as e:
+                log.warning(f"Could not save the filter plan cache: {e}")
+
+
+def seconds_per_row(cost):
+    """Average measured cost of a strategy, in seconds per downloaded row"""
+    return cost["seconds"] / max(cost["rows"], 1)
+
+
+def best_strategy(candidates, costs):
+    """
+    Pick the strategy to run from the supported candidates
+
+    Candidates that weren't measured yet are run first, in the expected order,
+    so every one gets measured once; after that the measured cheapest wins. The
+    exact geometry test is only measured when nothing else is supported, as it
+    reads every geometry of the dataset.
+    """
+    unmeasured = [s for s in candidates if s not in costs and s != EXACT_STRATEGY]
+    if unmeasured:
+        return unmeasured[0]
+    measured = [s for s in candidates if s in costs]
+    if measured:
+        return min(measured, key=lambda s: seconds_per_row(costs[s]))
+    return candidates[0]
+
+
+def probe_file(conn, url):
+    """
+    Pick one file of a dataset to read metadata from
+
+    Footers of a single file are enough to judge how the dataset is written,
+    and reading every footer of a large partitioned dataset would cost more
+    than the download.
+    """
+    if "*" not in url:
+        return url
+    try:
+        rows = conn.execute(f"SELECT file FROM glob('{url}') LIMIT 1").fetchall()
+    except Exception as e:
+        log.info(f"Could not list files of {url}: {e}")
+        return None
+    return rows[0][0] if rows else None
+
+
+def sample_files(conn, url):
+    """
+    Pick files of a dataset to estimate sizes from
+
+    Files are taken at even steps through the listing, so a spatially
+    partitioned dataset is sampled across its whole extent.
+
+    Returns:
+        tuple: (sampled file URLs, number of files in the dataset)
+    """
+    if "*" not in url:
+        return [url], 1
+    files = [row[0] for row in conn.execute(f"SELECT file FROM glob('{url}')").fetchall()]
+    if len(files) <= SIZE_SAMPLE_FILES:
+        return files, len(files)
+    step = len(files) / SIZE_SAMPLE_FILES
+    return [files[int(i * step)] for i in range(SIZE_SAMPLE_FILES)], len(files)
+
+
+def estimate_area_bytes(conn, url, bbox, bbox_column, columns=None):
+    """
+    Estimate the size of the row groups in an area from Parquet footers
+
+    Sums the sizes of the row groups whose bbox statistics overlap the area,
+    in a sample of the dataset's files scaled up to all of them. The
+    compressed size of the column chunks read approximates the bytes a
+    download fetches, the uncompressed size bounds the memory its rows take.
+
+    Args:
+        conn: DuckDB connection with httpfs loaded
+        url (str): Parquet file or glob
+        bbox (tuple): (xmin, ymin, xmax, ymax) of the area
+        bbox_column (str): bbox covering column with row group statistics
+        columns (list): Top level columns read, or None for all of them
+
+    Returns:
+        tuple: (compressed, uncompressed) size in bytes, or None without bbox
+        statistics to go by
+    """
+    if not bbox_column:
+        return None
+    xmin, ymin, xmax, ymax = bbox
+
+    def stat(function, value, field):
+        paths = f"'{bbox_column}, {field}', '{bbox_column}.{field}'"
+        return (
+            f"{function}(TRY_CAST(stats_{value}_value AS DOUBLE)) "
+            f"FILTER (WHERE path_in_schema IN ({paths}))"
+        )
+
+    read = "true"
+    if columns:
+        names = ", ".join("'{}'".format(name.replace("'", "''")) for name in columns)
+        read = f"regexp_extract(path_in_schema, '^[^,.]+') IN ({names})"
+
+    try:
+        files, file_count = sample_files(conn, url)
+        if not files:
+            return None
+        file_list = ", ".join("'{}'".format(f.replace("'", "''")) for f in files)
+        rows = conn.execute(f"""
+            SELECT SUM(compressed), SUM(uncompressed) FROM (
+                SELECT
+                    SUM(total_compressed_size) FILTER (WHERE {read}) AS compressed,
+                    ANY_VALUE(row_group_bytes) AS uncompressed
+                FROM parquet_metadata([{file_list}])
+                GROUP BY file_name, row_group_id
+                HAVING COALESCE(
+                    {stat("MIN", "min", "xmin")} <= {xmax}
+                    AND {stat("MAX", "max", "xmax")} >= {xmin}
+                    AND {stat("MIN", "min", "ymin")} <= {ymax}
+                    AND {stat("MAX", "max", "ymax")} >= {ymin},
+                    true
+                )
+            )
+        """).fetchall()
+    except Exception as e:
+        log.info(f"Could not estimate the size of the area: {e}")
+        return None
+    if not rows or rows[0][1] is None:
+        return None
+    scale = file_count / len(files)
+    return float(rows[0][0] or 0) * scale, float(rows[0][1]) * scale
+
+
+def covering_bbox_column(conn, file_url, geometry_column):
+    """Read the bbox covering column of the geometry from GeoParquet metadata"""
+    try:
+        rows = conn.execute(
+            f"SELECT key, value FROM parquet_kv_metadata('{file_url}')"
+        ).fetchall()
+        value = next(row[1] for row in rows if row[0] in (b"geo", "geo"))
+        geo = json.loads(value.decode() if isinstance(value, bytes) else value)
+        return geo["columns"][geometry_column]["covering"]["bbox"]["xmin"][0]
+    except StopIteration:
+        return None
+    except Exception as e:
+        log.info(f"Could not read GeoParquet covering metadata: {e}")
+        return None
+
+
+def row_groups_clustered(conn, file_url, bbox_column):
+    """
+    Check whether row group statistics of the bbox column allow pruning
+
+    Spatially sorted files (Hilbert or similar) have row groups that each cover a
+    narrow range of xmin values, so a bbox filter skips most of them. In randomly
+    ordered files every row group spans nearly the whole extent.
+    """
+    try:
+        rows = conn.execute(f"""
+            SELECT stats_min_value, stats_max_value FROM parquet_metadata('{file_url}')
+            WHERE path_in_schema IN ('{bbox_column}, xmin', '{bbox_column}.xmin')
+        """).fetchall()
+        ranges = [
+            (float(low), float(high)) for low, high in rows
+            if low is not None and high is not None
+        ]
+    except Exception as e:
+        log.info(f"Could not read row group statistics: {e}")
+        return False
+    if len(ranges) < 2:
+        return False
+    total = max(high for _, high in ranges) - min(low for low, _ in ranges)
+    average = sum(high - low for low, high in ranges) / len(ranges)
+    return total > 0 and average <= total * CLUSTERED_ROW_GROUP_FRACTION
+
+
+def has_geometry_stats(conn, file_url, geometry_column):
+    """Check whether a native GEOMETRY column has bbox statistics per row group"""
+    try:
+        rows = conn.execute(f"""
+            SELECT geo_bbox FROM parquet_metadata('{file_url}')
+            WHERE path_in_schema = '{geometry_column}'
+        """).fetchall()
+    except Exception:
+        # Older DuckDB versions don't report geometry statistics
+        return False
+    return len(rows) > 1 and all(row[0] is not None for row in rows)
+
+
+def plan_filter(conn, url, schema_result, job, geometry_column, cache=None):
+    """
+    Choose how a download filters the dataset to its area
+
+    Args:
+        conn: DuckDB connection with httpfs and spatial loaded
+        url (str): Resolved dataset URL to read metadata from
+        schema_result (list): DESCRIBE rows of the dataset
+        job (DownloadJob): The download; its bbox_column is used when given and
+            its filter_strategy is used when the dataset supports it
+        geometry_column (str): Geometry column of the dataset
+        cache (PlanCache): Plan cache to reuse and record plans in, or None
+
+    Returns:
+        FilterPlan: The chosen plan
+    """
+    struct_columns = {
+        row[0] for row in schema_result if "struct" in row[1].lower()
+    }
+    entry = cache.get(job.dataset_url) if cache is not None else None
+    # A cached plan only applies while the dataset still has the same columns
+    if (
+        entry
+        and all(strategy in STRATEGIES for strategy in entry["candidates"])
+        and entry.get("geometry_column") == geometry_column
+        and (entry.get("bbox_column") is None or entry["bbox_column"] in struct_columns)
+        and (not job.bbox_column or entry.get("bbox_column") == job.bbox_column)
+    ):
+        plan = FilterPlan(
+            strategy=best_strategy(entry["candidates"], entry.get("costs", {})),
+            geometry_column=geometry_column,
+            bbox_column=entry.get("bbox_column"),
+            candidates=entry["candidates"],
+            clustered=entry.get("clustered", False),
+            reason=entry.get("reason", ""),
+            cached=True,
+        )
+    else:
+        plan = probe_dataset(conn, url, struct_columns, job, geometry_column)
+
+    if job.filter_strategy:
+        if job.filter_strategy in plan.candidates:
+            plan.strategy = job.filter_strategy
+            plan.reason = "requested by the job"
+        else:
+            log.warning(
+                f"Filter strategy {job.filter_strategy} isn't supported by "
+                f"{job.dataset_url}, using {plan.strategy}"
+            )
+
+    log.info(
+        f"Filter plan for {job.dataset_url}: {plan.strategy} "
+        f"({'cached' if plan.cached else plan.reason})"
+    )
+    return plan
+
+
+def probe_dataset(conn, url, struct_columns, job, geometry_column):
+    """Inspect the dataset's metadata to list the strategies it supports"""
+    file_url = probe_file(conn, url)
+
+    bbox_column = job.bbox_column or "bbox"
+    if bbox_column not in struct_columns and file_url:
+        bbox_column = covering_bbox_column(conn, file_url, geometry_column)
+    if bbox_column not in struct_columns:
+        bbox_column = None
+
+    clustered = bool(
+        bbox_column and file_url and row_groups_clustered(conn, file_url, bbox_column)
+    )
+    candidates = []
+    reasons = []
+    if clustered:
+        candidates.append("bbox")
+        reasons.append(f"row groups of {bbox_column} are spatially clustered")
+    if file_url and has_geometry_stats(conn, file_url, geometry_column):
+        candidates.append("geometry_stats")
+        reasons.append(f"{geometry_column} has geometry statistics")
+    if bbox_column and not clustered:
+        candidates.append("bbox")
+        reasons.append(f"{bbox_column} is a bbox covering")
+    candidates.append("geometry")
+    reasons.append("exact geometry test")
+
+    return FilterPlan(
+        strategy=candidates[0],
+        geometry_column=geometry_column,
+        bbox_column=bbox_column,
+        candidates=candidates,
+        clustered=clustered,
+        reason=reasons[0],
+    )
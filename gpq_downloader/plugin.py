@@ -14,14 +14,13 @@ from qgis.PyQt.QtWidgets import (
     QLineEdit,
 )
 from qgis.PyQt.QtGui import QIcon
-from qgis.PyQt.QtCore import Qt, QThread
-from qgis.core import QgsProject, QgsVectorLayer, QgsSettings
+from qgis.PyQt.QtCore import Qt, QThread, QUrl
+from qgis.core import QgsApplication, QgsProject, QgsVectorLayer, QgsVectorTileLayer, QgsSettings
 import os
 import datetime
 from pathlib import Path
 
 from .dialog import DataSourceDialog
-from .utils import Worker
 
 
 class QgisPluginGeoParquet:
@@ -30,6 +29,13 @@ class QgisPluginGeoParquet:
         self.worker = None
         self.worker_thread = None
         self.action = None
+        self.provider = None
+        # Created once prefetching is enabled and a download finishes
+        self.prefetcher = None
+        # Layers following the map view instead of being downloaded
+        self.live_layers = []
+        # Selected polygons to download instead of the map extent
+        self.aoi_geometry = None
         self.output_file = None
         # Create a default downloads directory in user's home directory
         self.download_dir = Path.home() / "Downloads"
@@ -49,6 +55,22 @@ class QgisPluginGeoParquet:
         # Add the actions to the toolbar
         self.iface.addToolBarIcon(self.action)
 
+        self.initProcessing()
+
+    def initProcessing(self):
+        """
+        Register the Processing provider so downloads can run in models and qgis_process
+
+        qgis_process calls this without initGui, as metadata.txt declares
+        hasProcessingProvider.
+        """
+        if self.provider is not None:
+            return
+        from .processing_provider import GeoParquetProvider
+
+        self.provider = GeoParquetProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def unload(self):
         # Clean up worker and thread when plugin is unloaded
         if self.worker_thread and self.worker_thread.isRunning():
@@ -60,7 +82,27 @@ class QgisPluginGeoParquet:
             return
         self.cleanup_thread()
         # Remove all actions from the toolbar
-        self.iface.removeToolBarIcon(self.action)
+        if self.action is not None:
+            self.iface.removeToolBarIcon(self.action)
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+        if self.prefetcher is not None:
+            self.prefetcher.unload()
+            self.prefetcher = None
+        for live_layer in self.live_layers:
+            live_layer.stop()
+        self.live_layers = []
+
+    def remember_download(self, dataset_url, validation_results):
+        """Let the prefetcher read around the map view for a downloaded dataset"""
+        from .prefetch import Prefetcher
+
+        if self.prefetcher is None:
+            if not Prefetcher.enabled():
+                return
+            self.prefetcher = Prefetcher(self.iface)
+        self.prefetcher.remember(dataset_url, validation_results)
 
     def run(self, default_source=None):
         # Check if a worker is already running
@@ -89,6 +131,22 @@ class QgisPluginGeoParquet:
             # Get the selected URLs from the dialog
             urls = dialog.get_urls()
             extent = self.iface.mapCanvas().extent()
+            self.aoi_geometry = None
+            if dialog.download_area() == "selection":
+                from .utils import selected_features_aoi
+
+                self.aoi_geometry = selected_features_aoi(self.iface.activeLayer())
+                if self.aoi_geometry is None:
+                    QMessageBox.warning(
+                        self.iface.mainWindow(),
+                        "No Area Selected",
+                        "Select one or more polygons in the active layer to use them as the download area."
+                    )
+                    return
+
+            if dialog.live_layer_checkbox.isChecked():
+                self.add_live_layers(urls)
+                return
             
             # First, collect all file locations from user
             download_queue = []
@@ -126,7 +184,7 @@ class QgisPluginGeoParquet:
                     self.iface.mainWindow(),
                     f"Save Data for {theme if dialog.overture_radio.isChecked() else 'dataset'}",
                     default_save_path,
-                    "GeoParquet (*.parquet);;DuckDB Database (*.duckdb);;GeoPackage (*.gpkg);;FlatGeobuf (*.fgb);;GeoJSON (*.geojson)"
+                    "GeoParquet (*.parquet);;DuckDB Database (*.duckdb);;GeoPackage (*.gpkg);;FlatGeobuf (*.fgb);;GeoJSON (*.geojson);;PMTiles vector tiles (*.pmtiles);;MBTiles vector tiles (*.mbtiles)"
                 )
                 
                 if output_file:
@@ -137,6 +195,15 @@ class QgisPluginGeoParquet:
             # Now process downloads one at a time
             self.process_download_queue(download_queue, extent)
 
+    def add_live_layers(self, urls):
+        """Show each dataset as a layer that reads the map view instead of downloading it"""
+        from .live_layer import LiveLayer
+
+        for url in urls:
+            live_layer = LiveLayer(self.iface, url)
+            self.live_layers.append(live_layer)
+            live_layer.start()
+
     def handle_validation_complete(
         self, success, message, validation_results, url, extent, dialog
     ):
@@ -170,7 +237,7 @@ class QgisPluginGeoParquet:
                 self.iface.mainWindow(),
                 "Save Data",
                 default_save_path,
-                "GeoParquet (*.parquet);;DuckDB Database (*.duckdb);;GeoPackage (*.gpkg);;FlatGeobuf (*.fgb);;GeoJSON (*.geojson)",
+                "GeoParquet (*.parquet);;DuckDB Database (*.duckdb);;GeoPackage (*.gpkg);;FlatGeobuf (*.fgb);;GeoJSON (*.geojson);;PMTiles vector tiles (*.pmtiles);;MBTiles vector tiles (*.mbtiles)",
             )
 
             if output_file:
@@ -220,44 +287,20 @@ class QgisPluginGeoParquet:
             self.progress_dialog.close()
 
     def load_layer(self, output_file):
-        """Load the layer into QGIS if GeoParquet is supported"""
-        if output_file.lower().endswith(".parquet"):
-            # Try to create a test layer to check GeoParquet support
-            test_layer = QgsVectorLayer(output_file, "test", "ogr")
-            if not test_layer.isValid():
-                dialog = QDialog(self.iface.mainWindow())
-                dialog.setWindowTitle("GeoParquet Support Not Available")
-                dialog.setMinimumWidth(400)
-
-                layout = QVBoxLayout()
-
-                message = QLabel(
-                    "Data has been successfully saved to GeoParquet file.\n\n"
-                    "Note: Your current QGIS installation does not support reading GeoParquet files directly. You can select GeoPackage for your output format to view immediately.\n\n"
-                    "To view GeoParquet files in QGIS, you'll need to install QGIS with GDAL 3.8 "
-                    "or higher with 'libgdal-arrow-parquet'. You can find instructions at:"
-                )
-                message.setWordWrap(True)
-                layout.addWidget(message)
-
-                link = QLabel()
-                link.setText(
-                    '<a href="https://github.com/cholmes/qgis_plugin_gpq_downloader/wiki/Installing-GeoParquet-Support-in-QGIS">Installing GeoParquet Support in QGIS</a>'
-                )
-                link.setOpenExternalLinks(True)
-                layout.addWidget(link)
-
-                button_box = QPushButton("OK")
-                button_box.clicked.connect(dialog.accept)
-                layout.addWidget(button_box)
-
-                dialog.setLayout(layout)
-                dialog.exec()
-                return
+        """Open a downloaded file once, prepare it for fast rendering and add it to the map"""
+        from .utils import optimize_loaded_layer
 
         layer_name = Path(output_file).stem  # Get filename without extension
-        # Create the layer
-        layer = QgsVectorLayer(output_file, layer_name, "ogr")
+        if output_file.lower().endswith((".pmtiles", ".mbtiles")):
+            layer = self.vector_tile_layer(output_file, layer_name)
+        else:
+            layer = QgsVectorLayer(output_file, layer_name, "ogr")
+            if not layer.isValid() and output_file.lower().endswith(".parquet"):
+                # GDAL without the Arrow Parquet driver can't read the file
+                self.show_geoparquet_support_dialog()
+                return
+            if layer.isValid():
+                optimize_loaded_layer(layer)
         if not layer.isValid():
             QMessageBox.critical(
                 self.iface.mainWindow(),
@@ -268,6 +311,65 @@ class QgisPluginGeoParquet:
         # Add the layer to the QGIS project
         QgsProject.instance().addMapLayer(layer)
 
+    def show_geoparquet_support_dialog(self):
+        """Explain how to get GeoParquet support when QGIS can't open the output"""
+        dialog = QDialog(self.iface.mainWindow())
+        dialog.setWindowTitle("GeoParquet Support Not Available")
+        dialog.setMinimumWidth(400)
+
+        layout = QVBoxLayout()
+
+        message = QLabel(
+            "Data has been successfully saved to GeoParquet file.\n\n"
+            "Note: Your current QGIS installation does not support reading GeoParquet files directly. You can select GeoPackage for your output format to view immediately.\n\n"
+            "To view GeoParquet files in QGIS, you'll need to install QGIS with GDAL 3.8 "
+            "or higher with 'libgdal-arrow-parquet'. You can find instructions at:"
+        )
+        message.setWordWrap(True)
+        layout.addWidget(message)
+
+        link = QLabel()
+        link.setText(
+            '<a href="https://github.com/cholmes/qgis_plugin_gpq_downloader/wiki/Installing-GeoParquet-Support-in-QGIS">Installing GeoParquet Support in QGIS</a>'
+        )
+        link.setOpenExternalLinks(True)
+        layout.addWidget(link)
+
+        button_box = QPushButton("OK")
+        button_box.clicked.connect(dialog.accept)
+        layout.addWidget(button_box)
+
+        dialog.setLayout(layout)
+        dialog.exec()
+
+    def vector_tile_layer(self, output_file, layer_name):
+        """
+        Open tiled output as a vector tile layer, which only draws the tiles in view
+
+        QGIS versions that can't open the archive as vector tiles get a vector
+        layer through GDAL instead.
+        """
+        tile_type = "mbtiles" if output_file.lower().endswith(".mbtiles") else "xyz"
+        url = output_file if tile_type == "mbtiles" else QUrl.fromLocalFile(output_file).toString()
+        layer = QgsVectorTileLayer(f"type={tile_type}&url={url}", layer_name)
+        if layer.isValid():
+            return layer
+        return QgsVectorLayer(output_file, layer_name, "ogr")
+
+    def add_memory_layer(self, layer, message=""):
+        """Add a temporary layer built directly from the download results"""
+        if not layer.isValid():
+            QMessageBox.critical(
+                self.iface.mainWindow(),
+                "Error",
+                f"Failed to create a temporary layer for {layer.name()}",
+            )
+            return
+        QgsProject.instance().addMapLayer(layer)
+        if message:
+            # No file was written, which users who picked one need to know
+            self.iface.messageBar().pushInfo(layer.name(), message)
+
     def show_info(self, message):
         """Show an information message to the user"""
         QMessageBox.information(self.iface.mainWindow(), "Success", message)
@@ -284,6 +386,7 @@ class QgisPluginGeoParquet:
             'iface': self.worker.iface,
             'validation_results': self.worker.validation_results,
             'output_file': self.worker.output_file,
+            'aoi_geometry': self.worker.aoi_geometry,
             'size_warning_accepted': False,
             'remaining_queue': getattr(self.worker, 'remaining_queue', [])
         }
@@ -317,7 +420,9 @@ class QgisPluginGeoParquet:
         format_combo.addItems([
             "FlatGeobuf (*.fgb)",
             "GeoPackage (*.gpkg)",
-            "GeoParquet (*.parquet)"
+            "GeoParquet (*.parquet)",
+            "PMTiles vector tiles (*.pmtiles)",
+            "MBTiles vector tiles (*.mbtiles)"
         ])
         format_row.addWidget(format_combo)
         
@@ -363,12 +468,15 @@ class QgisPluginGeoParquet:
                     
                     self.output_file = output_file
                     
+                    from .utils import Worker
+
                     self.worker = Worker(
                         worker_info['dataset_url'],
                         worker_info['extent'],
                         output_file,
                         worker_info['iface'],
-                        worker_info['validation_results']
+                        worker_info['validation_results'],
+                        aoi_geometry=worker_info['aoi_geometry'],
                     )
                     self.worker.remaining_queue = worker_info['remaining_queue']
                     self.worker_thread = QThread()
@@ -377,6 +485,7 @@ class QgisPluginGeoParquet:
                     self.worker_thread.started.connect(self.worker.run)
                     self.worker.error.connect(self.handle_error)
                     self.worker.load_layer.connect(self.load_layer)
+                    self.worker.load_memory_layer.connect(self.add_memory_layer)
                     self.worker.info.connect(self.show_info)
                     self.worker.file_size_warning.connect(self.handle_large_file_warning)
                     self.worker.finished.connect(lambda: self.handle_download_complete(worker_info['remaining_queue'], worker_info['extent']))
@@ -394,12 +503,15 @@ class QgisPluginGeoParquet:
                 self.progress_dialog.setWindowModality(Qt.WindowModality.NonModal)
                 self.progress_dialog.setMinimumDuration(0)
                 
+                from .utils import Worker
+
                 self.worker = Worker(
                     worker_info['dataset_url'],
                     worker_info['extent'],
                     worker_info['output_file'],
                     worker_info['iface'],
-                    worker_info['validation_results']
+                    worker_info['validation_results'],
+                    aoi_geometry=worker_info['aoi_geometry'],
                 )
                 self.worker.remaining_queue = worker_info['remaining_queue']
                 self.worker_thread = QThread()
@@ -408,6 +520,7 @@ class QgisPluginGeoParquet:
                 self.worker_thread.started.connect(self.worker.run)
                 self.worker.error.connect(self.handle_error)
                 self.worker.load_layer.connect(self.load_layer)
+                self.worker.load_memory_layer.connect(self.add_memory_layer)
                 self.worker.info.connect(self.show_info)
                 self.worker.file_size_warning.connect(self.handle_large_file_warning)
                 self.worker.finished.connect(lambda: self.handle_download_complete(worker_info['remaining_queue'], worker_info['extent']))
@@ -441,8 +554,11 @@ class QgisPluginGeoParquet:
 
     def setup_worker(self, dataset_url, extent, output_file, validation_results):
         """Create and setup a worker thread with all connections"""
+        from .utils import Worker
+
         self.worker = Worker(
-            dataset_url, extent, output_file, self.iface, validation_results
+            dataset_url, extent, output_file, self.iface, validation_results,
+            aoi_geometry=self.aoi_geometry,
         )
         self.worker_thread = QThread()
         self.worker.moveToThread(self.worker_thread)
@@ -451,9 +567,13 @@ class QgisPluginGeoParquet:
         self.worker_thread.started.connect(self.worker.run)
         self.worker.error.connect(self.handle_error)
         self.worker.load_layer.connect(self.load_layer)
+        self.worker.load_memory_layer.connect(self.add_memory_layer)
         self.worker.info.connect(self.show_info)
         self.worker.file_size_warning.connect(self.handle_large_file_warning)
         self.worker.finished.connect(self.cleanup_thread)
+        self.worker.finished.connect(
+            lambda: self.remember_download(dataset_url, validation_results)
+        )
         self.worker.progress.connect(self.update_progress)
         self.progress_dialog.canceled.connect(self.cancel_download)
 
@@ -480,25 +600,9 @@ class QgisPluginGeoParquet:
                 else:
                     layer_name = f"Overture {theme.title()}"
         
-        # Create validation results (we know Overture URLs are valid)
-        validation_results = {'has_bbox': True, 'bbox_column': 'bbox', 'geometry_column': 'geometry'}
-        
-        # For non-Overture data, try to detect the geometry column name from the URL
-        if 'overture' not in url:
-            from . import logger
-            #logger.log(f"Processing URL: {url}")
-            
-            # Try to extract dataset name from URL for better logging
-            dataset_name = url.split('/')[-1].split('?')[0]
-            #logger.log(f"Dataset name from URL: {dataset_name}")
-            
-            # For specific known datasets, set the geometry column
-            if 'addresses.nobbox.pq' in url or 'addresses.pq' in url:
-                #logger.log("Detected addresses dataset, setting geometry column to 'geom'")
-                validation_results['geometry_column'] = 'geom'
-        
-       #logger.log(f"Initial validation_results: {validation_results}")
-        
+        # The engine's filter planner finds the geometry and bbox columns
+        validation_results = {}
+
         # Create progress dialog
         self.progress_dialog = QProgressDialog(
             "Starting download..." if not layer_name else f"Starting {layer_name} download...",
@@ -509,7 +613,12 @@ class QgisPluginGeoParquet:
         self.progress_dialog.setMinimumDuration(0)
         
         # Create worker with layer name
-        self.worker = Worker(url, extent, output_file, self.iface, validation_results, layer_name)
+        from .utils import Worker
+
+        self.worker = Worker(
+            url, extent, output_file, self.iface, validation_results, layer_name,
+            aoi_geometry=self.aoi_geometry,
+        )
         self.worker.remaining_queue = remaining_queue  # Store remaining queue in worker
         self.worker_thread = QThread()
         
@@ -520,8 +629,10 @@ class QgisPluginGeoParquet:
         self.worker_thread.started.connect(self.worker.run)
         self.worker.error.connect(self.handle_error)
         self.worker.load_layer.connect(self.load_layer)
+        self.worker.load_memory_layer.connect(self.add_memory_layer)
         self.worker.info.connect(self.show_info)
         self.worker.file_size_warning.connect(self.handle_large_file_warning)
+        self.worker.finished.connect(lambda: self.remember_download(url, validation_results))
         self.worker.finished.connect(lambda: self.handle_download_complete(remaining_queue, extent))
         self.worker.progress.connect(self.update_progress)
         self.progress_dialog.canceled.connect(self.cancel_download)
@@ -0,0 +1,262 @@
+"""
+Background prefetching of data around the map view.
+
+After a download users often pan to the neighbouring area and download again.
+When prefetching is enabled, the Prefetcher watches the map canvas and, once
+the view has settled, reads the tiles next to it for the most recently
+downloaded datasets in a low priority QgsTask. The reads only fill the on-disk
+byte range cache, so prefetching needs that cache to be enabled too; the next
+download nearby then reads from disk.
+"""
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from qgis.core import QgsApplication, QgsSettings, QgsTask
+from qgis.PyQt.QtCore import QObject, QTimer
+
+from . import logger
+from .engine import DownloadEngine, DownloadJob
+from .range_cache import DEFAULT_RANGE_CACHE_MB, range_cache_size
+from .remote_io import host_key
+
+log = logging.getLogger(__name__)
+
+# Wait this long after the last extent change before prefetching
+PREFETCH_DEBOUNCE_MS = 1500
+# Number of recently downloaded datasets to prefetch for
+PREFETCH_MAX_DATASETS = 3
+# Prefetch reads run with this many DuckDB threads so they don't compete with
+# downloads and map rendering for bandwidth
+PREFETCH_THREADS = 1
+DEFAULT_PREFETCH_MAX_MB = 256
+# Forget which tiles were prefetched after this many, they may have been pruned
+# from the cache since
+PREFETCHED_TILES_MEMORY = 1000
+
+
+def neighbour_bboxes(bbox, direction=(0.0, 0.0)):
+    """
+    The eight tiles of the same size around a bbox
+
+    Args:
+        bbox (tuple): (xmin, ymin, xmax, ymax) of the current view
+        direction (tuple): (dx, dy) of the last pan; tiles in that direction
+            come first, as the user most likely continues that way
+
+    Returns:
+        list: (xmin, ymin, xmax, ymax) tuples, clamped to valid coordinates
+    """
+    xmin, ymin, xmax, ymax = bbox
+    width, height = xmax - xmin, ymax - ymin
+    tiles = []
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            if i == 0 and j == 0:
+                continue
+            tile = (
+                max(-180.0, xmin + i * width),
+                max(-90.0, ymin + j * height),
+                min(180.0, xmax + i * width),
+                min(90.0, ymax + j * height),
+            )
+            if tile[0] < tile[2] and tile[1] < tile[3]:
+                # Ahead of the pan first, then edge neighbours before corners
+                tiles.append(((-(i * direction[0] + j * direction[1]), abs(i) + abs(j)), tile))
+    tiles.sort(key=lambda item: item[0])
+    return [tile for _, tile in tiles]
+
+
+def prefetch_job(dataset_url, bbox, validation_results, range_cache, range_cache_max_mb):
+    """
+    Describe reading one tile of a dataset as an engine job
+
+    The rows are read without being kept or written; the reads just leave
+    their byte ranges in the range cache.
+    """
+    from .utils import plan_cache_path, remote_tuning_path
+
+    return DownloadJob(
+        dataset_url=dataset_url,
+        bbox=bbox,
+        output_file=os.path.join(tempfile.gettempdir(), "gpq_prefetch.parquet"),
+        bbox_column=validation_results.get("bbox_column"),
+        geometry_column=validation_results.get("geometry_column"),
+        extension_repository=QgsSettings().value(
+            "gpq_downloader/extension_repository", "", type=str, section=QgsSettings.Plugins
+        ),
+        warm_only=True,
+        plan_cache=plan_cache_path(),
+        remote_tuning=remote_tuning_path(),
+        range_cache=range_cache,
+        range_cache_max_mb=range_cache_max_mb,
+        retries=0,
+        max_threads=PREFETCH_THREADS,
+    )
+
+
+class PrefetchTask(QgsTask):
+    """
+    Reads prefetch jobs one after the other until the byte budget is spent
+
+    Args:
+        jobs (list): (tile key, DownloadJob) tuples to run, most wanted first
+        max_mb (float): Stop once the range cache grew by this much
+    """
+
+    def __init__(self, jobs, max_mb):
+        super().__init__("Prefetching GeoParquet data", QgsTask.CanCancel)
+        self.jobs = jobs
+        self.max_mb = max_mb
+        self.cancel_event = threading.Event()
+        # Engine of the tile being read, interrupted on cancel
+        self.engine = None
+        # Keys of the tiles that were read completely
+        self.completed = []
+
+    def run(self):
+        cache_dir = self.jobs[0][1].range_cache
+        start_size = range_cache_size(cache_dir)
+        for index, (key, job) in enumerate(self.jobs):
+            if self.isCanceled():
+                return False
+            self.engine = DownloadEngine(job, cancel_event=self.cancel_event)
+            if self.isCanceled():
+                return False
+            try:
+                result = self.engine.run()
+                if result.status != "cancelled":
+                    self.completed.append(key)
+            except Exception as e:
+                if self.isCanceled():
+                    return False
+                log.info(f"Prefetching {job.dataset_url} failed: {e}")
+            self.setProgress(100 * (index + 1) / len(self.jobs))
+            if range_cache_size(cache_dir) - start_size > self.max_mb * 1024 * 1024:
+                log.info("Prefetch budget reached")
+                break
+        return True
+
+    def cancel(self):
+        self.cancel_event.set()
+        engine = self.engine
+        if engine is not None:
+            engine.interrupt()
+        super().cancel()
+
+
+class Prefetcher(QObject):
+    """
+    Prefetches tiles around the map view for recently downloaded datasets
+
+    Args:
+        iface: The QGIS interface, whose map canvas is watched
+    """
+
+    def __init__(self, iface):
+        super().__init__()
+        logger.install_log_handler()
+        self.iface = iface
+        # Validation results of recent datasets by URL, most recent last
+        self.datasets = OrderedDict()
+        self.prefetched = set()
+        self.task = None
+        self.last_center = None
+        self.direction = (0.0, 0.0)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(PREFETCH_DEBOUNCE_MS)
+        self.timer.timeout.connect(self.prefetch)
+        self.iface.mapCanvas().extentsChanged.connect(self.schedule)
+
+    @staticmethod
+    def enabled():
+        """Prefetching is opt-in and only useful with the range cache enabled"""
+        settings = QgsSettings()
+        return settings.value(
+            "gpq_downloader/prefetch", False, type=bool, section=QgsSettings.Plugins
+        ) and settings.value(
+            "gpq_downloader/range_cache", False, type=bool, section=QgsSettings.Plugins
+        )
+
+    def remember(self, dataset_url, validation_results):
+        """Add a downloaded dataset to the ones prefetched for"""
+        if host_key(dataset_url) is None:
+            return  # Local data doesn't need prefetching
+        self.datasets[dataset_url] = validation_results
+        self.datasets.move_to_end(dataset_url)
+        while len(self.datasets) > PREFETCH_MAX_DATASETS:
+            self.datasets.popitem(last=False)
+        self.schedule()
+
+    def schedule(self):
+        """Restart the debounce timer, dropping prefetching for the old view"""
+        self.cancel()
+        if self.datasets and self.enabled():
+            self.timer.start()
+
+    def cancel(self):
+        self.timer.stop()
+        if self.task is not None:
+            try:
+                self.task.cancel()
+            except RuntimeError:
+                pass  # The task manager already deleted the finished task
+            self.task = None
+
+    def current_bbox(self):
+        from .utils import transform_bbox_to_4326
+
+        canvas = self.iface.mapCanvas()
+        extent = transform_bbox_to_4326(
+            canvas.extent(), canvas.mapSettings().destinationCrs()
+        )
+        return (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+
+    def prefetch(self):
+        """Start a task reading the tiles around the view that weren't read yet"""
+        bbox = self.current_bbox()
+        center = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+        if self.last_center is not None:
+            self.direction = (center[0] - self.last_center[0], center[1] - self.last_center[1])
+        self.last_center = center
+
+        settings = QgsSettings()
+        range_cache_max_mb = settings.value(
+            "gpq_downloader/range_cache_max_mb", DEFAULT_RANGE_CACHE_MB, type=int, section=QgsSettings.Plugins
+        )
+        max_mb = settings.value(
+            "gpq_downloader/prefetch_max_mb", DEFAULT_PREFETCH_MAX_MB, type=int, section=QgsSettings.Plugins
+        )
+        from .utils import range_cache_path
+
+        if len(self.prefetched) > PREFETCHED_TILES_MEMORY:
+            self.prefetched.clear()
+        jobs = []
+        for tile in neighbour_bboxes(bbox, self.direction):
+            for dataset_url, validation_results in reversed(self.datasets.items()):
+                key = (dataset_url,) + tuple(round(value, 6) for value in tile)
+                if key not in self.prefetched:
+                    jobs.append((key, prefetch_job(
+                        dataset_url, tile, validation_results, range_cache_path(), range_cache_max_mb
+                    )))
+        if not jobs:
+            return
+
+        task = PrefetchTask(jobs, max_mb)
+        task.taskCompleted.connect(lambda: self.task_finished(task))
+        task.taskTerminated.connect(lambda: self.task_finished(task))
+        self.task = task
+        QgsApplication.taskManager().addTask(task)
+
+    def task_finished(self, task):
+        """Remember the tiles a finished or cancelled task read"""
+        self.prefetched.update(task.completed)
+        if self.task is task:
+            self.task = None
+
+    def unload(self):
+        self.cancel()
+        self.iface.mapCanvas().extentsChanged.disconnect(self.schedule)
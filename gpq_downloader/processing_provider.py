@@ -0,0 +1,412 @@
+import os
+import threading
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import (
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsGeometry,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingException,
+    QgsProcessingOutputNumber,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterExtent,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterString,
+    QgsProcessingProvider,
+    QgsSettings,
+    NULL,
+)
+
+from .registry import get_formats, get_presets
+
+CUSTOM_URL_OPTION = "Custom URL"
+DUCKDB_FILE_FILTER = "DuckDB Database (*.duckdb)"
+
+
+def preset_dataset_options():
+    """
+    List the preset datasets that can be picked in Processing
+
+    Returns:
+        list: (label, url) tuples, with one entry per subtype for datasets that
+        have subtypes
+    """
+    options = []
+    for source, datasets in get_presets().items():
+        for name, dataset in datasets.items():
+            if isinstance(dataset.get("url"), str):
+                options.append((f"{source}: {name}", dataset["url"]))
+            elif dataset.get("subtypes"):
+                for subtype in dataset["subtypes"]:
+                    options.append((
+                        f"{source}: {name} ({subtype})",
+                        dataset["url_template"].format(subtype=subtype),
+                    ))
+            elif isinstance(dataset.get("url_template"), str):
+                options.append((f"{source}: {name}", dataset["url_template"]))
+    return options
+
+
+class DownloadGeoParquetAlgorithm(QgsProcessingAlgorithm):
+    DATASET = "DATASET"
+    URL = "URL"
+    EXTENT = "EXTENT"
+    AOI = "AOI"
+    COLUMNS = "COLUMNS"
+    FILTER = "FILTER"
+    CLIP = "CLIP"
+    KEEP_ORIGINAL_ID = "KEEP_ORIGINAL_ID"
+    SIMPLIFY_TOLERANCE = "SIMPLIFY_TOLERANCE"
+    PRECISION_DECIMALS = "PRECISION_DECIMALS"
+    TARGET_CRS = "TARGET_CRS"
+    OUTPUT = "OUTPUT"
+    ROW_COUNT = "ROW_COUNT"
+
+    def createInstance(self):
+        return DownloadGeoParquetAlgorithm()
+
+    def name(self):
+        return "download"
+
+    def displayName(self):
+        return "Download GeoParquet data"
+
+    def shortHelpString(self):
+        return (
+            "Downloads the part of a cloud GeoParquet dataset that falls within an "
+            "extent or the extent of an area of interest layer. Pick a preset "
+            "dataset or enter the URL of any GeoParquet file or partition. "
+            "Columns limits the attributes kept (comma separated) and Filter is a "
+            "SQL expression rows must match, e.g. subtype = 'residential'."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.add_dataset_parameters()
+        self.addParameter(QgsProcessingParameterExtent(
+            self.EXTENT,
+            "Extent",
+            optional=True,
+        ))
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.AOI,
+            "Area of interest layer (used instead of the extent)",
+            [QgsProcessing.TypeVectorPolygon],
+            optional=True,
+        ))
+        self.add_output_parameters()
+
+    def add_dataset_parameters(self):
+        self.dataset_options = preset_dataset_options()
+        self.addParameter(QgsProcessingParameterEnum(
+            self.DATASET,
+            "Dataset",
+            options=[label for label, _ in self.dataset_options] + [CUSTOM_URL_OPTION],
+            defaultValue=len(self.dataset_options),
+        ))
+        self.addParameter(QgsProcessingParameterString(
+            self.URL,
+            "GeoParquet URL (for a custom dataset)",
+            optional=True,
+        ))
+
+    def add_output_parameters(self):
+        self.addParameter(QgsProcessingParameterString(
+            self.COLUMNS,
+            "Columns to keep (comma separated, empty for all)",
+            optional=True,
+        ))
+        self.addParameter(QgsProcessingParameterString(
+            self.FILTER,
+            "Filter (SQL expression)",
+            optional=True,
+        ))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.CLIP,
+            "Clip features to the area of interest",
+            defaultValue=False,
+        ))
+        self.addParameter(QgsProcessingParameterBoolean(
+            self.KEEP_ORIGINAL_ID,
+            "Add a source feature id to clipped features of datasets without an id",
+            defaultValue=True,
+        ))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.SIMPLIFY_TOLERANCE,
+            "Simplification tolerance in meters (empty to keep every vertex)",
+            QgsProcessingParameterNumber.Double,
+            optional=True,
+            minValue=0,
+        ))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.PRECISION_DECIMALS,
+            "Round coordinates to decimal places (empty for full precision)",
+            QgsProcessingParameterNumber.Integer,
+            optional=True,
+            minValue=0,
+            maxValue=15,
+        ))
+        self.addParameter(QgsProcessingParameterCrs(
+            self.TARGET_CRS,
+            "Reproject to (not used for GeoParquet output)",
+            optional=True,
+        ))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.OUTPUT,
+            "Output file",
+            ";;".join(list(get_formats()) + [DUCKDB_FILE_FILTER]),
+        ))
+        self.addOutput(QgsProcessingOutputNumber(self.ROW_COUNT, "Number of features"))
+
+    def dataset_url(self, parameters, context):
+        """Resolve the dataset parameter to a URL"""
+        index = self.parameterAsEnum(parameters, self.DATASET, context)
+        if index < len(self.dataset_options):
+            return self.dataset_options[index][1]
+        url = self.parameterAsString(parameters, self.URL, context).strip()
+        if not url:
+            raise QgsProcessingException("Enter a GeoParquet URL for a custom dataset")
+        return url
+
+    def area_of_interest(self, parameters, context):
+        """
+        Return the area to download in EPSG:4326
+
+        Returns:
+            tuple: ((xmin, ymin, xmax, ymax), WKB of the AOI polygons or None)
+        """
+        wgs84 = QgsCoordinateReferenceSystem("EPSG:4326")
+        source = self.parameterAsSource(parameters, self.AOI, context)
+        if source is not None:
+            geometries = [f.geometry() for f in source.getFeatures() if f.hasGeometry()]
+            if not geometries:
+                raise QgsProcessingException("The area of interest layer has no geometries")
+            aoi = QgsGeometry.unaryUnion(geometries)
+            if source.sourceCrs() != wgs84:
+                aoi.transform(QgsCoordinateTransform(source.sourceCrs(), wgs84, context.transformContext()))
+            extent = aoi.boundingBox()
+            aoi_wkb = bytes(aoi.asWkb())
+        elif parameters.get(self.EXTENT):
+            extent = self.parameterAsExtent(parameters, self.EXTENT, context, wgs84)
+            aoi_wkb = None
+        else:
+            raise QgsProcessingException("Set an extent or an area of interest layer")
+        return (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()), aoi_wkb
+
+    def build_job(self, parameters, context):
+        """Describe the download as an engine job"""
+        from .engine import DownloadJob, meters_to_degrees
+        from .range_cache import DEFAULT_RANGE_CACHE_MB
+        from .utils import plan_cache_path, range_cache_path, remote_tuning_path
+
+        output_file = self.parameterAsFileOutput(parameters, self.OUTPUT, context)
+        columns = [
+            column.strip()
+            for column in self.parameterAsString(parameters, self.COLUMNS, context).split(",")
+            if column.strip()
+        ]
+        filter_expression = self.parameterAsString(parameters, self.FILTER, context).strip()
+        settings = QgsSettings()
+        bbox, aoi_wkb = self.area_of_interest(parameters, context)
+        target_crs = self.parameterAsCrs(parameters, self.TARGET_CRS, context)
+        tolerance = (
+            self.parameterAsDouble(parameters, self.SIMPLIFY_TOLERANCE, context)
+            if parameters.get(self.SIMPLIFY_TOLERANCE) is not None
+            else None
+        )
+        job = DownloadJob(
+            dataset_url=self.dataset_url(parameters, context),
+            bbox=bbox,
+            aoi_wkb=aoi_wkb,
+            clip=self.parameterAsBoolean(parameters, self.CLIP, context),
+            keep_original_id=self.parameterAsBoolean(parameters, self.KEEP_ORIGINAL_ID, context),
+            simplify_tolerance=meters_to_degrees(tolerance) if tolerance else None,
+            target_crs=(target_crs.authid() or target_crs.toWkt()) if target_crs.isValid() else None,
+            precision_decimals=(
+                self.parameterAsInt(parameters, self.PRECISION_DECIMALS, context)
+                if parameters.get(self.PRECISION_DECIMALS) is not None
+                else None
+            ),
+            output_file=output_file,
+            columns=columns or None,
+            filters=[filter_expression] if filter_expression else [],
+            compression_profile=settings.value(
+                "gpq_downloader/parquet_compression_profile", "", type=str, section=QgsSettings.Plugins
+            ),
+            extension_repository=settings.value(
+                "gpq_downloader/extension_repository", "", type=str, section=QgsSettings.Plugins
+            ),
+            # Nobody is around to confirm large GeoJSON files in a batch run
+            geojson_size_limit_mb=None,
+            plan_cache=plan_cache_path(),
+            remote_tuning=remote_tuning_path(),
+            range_cache=(
+                range_cache_path()
+                if settings.value("gpq_downloader/range_cache", False, type=bool, section=QgsSettings.Plugins)
+                else None
+            ),
+            range_cache_max_mb=settings.value(
+                "gpq_downloader/range_cache_max_mb", DEFAULT_RANGE_CACHE_MB, type=int, section=QgsSettings.Plugins
+            ),
+        )
+        return job
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from .engine import run_download
+
+        job = self.build_job(parameters, context)
+        output_file = job.output_file
+        cancel_event = threading.Event()
+        feedback.canceled.connect(cancel_event.set)
+        try:
+            result = run_download(job, progress=feedback.pushInfo, cancel_event=cancel_event)
+        except Exception as e:
+            raise QgsProcessingException(str(e))
+
+        if result.status == "cancelled":
+            return {}
+        if result.message:
+            feedback.pushInfo(result.message)
+        if result.status == "written":
+            layer_files = [output_file]
+        elif result.status == "per_aoi":
+            layer_files = list(result.outputs.values())
+        else:
+            layer_files = []
+        if context.project() is not None:
+            for layer_file in layer_files:
+                context.addLayerToLoadOnCompletion(
+                    layer_file,
+                    QgsProcessingContext.LayerDetails(
+                        os.path.splitext(os.path.basename(layer_file))[0],
+                        context.project(),
+                        self.OUTPUT,
+                    ),
+                )
+        return {self.OUTPUT: result.output or output_file, self.ROW_COUNT: result.row_count}
+
+
+def aoi_id(feature, id_fields):
+    """
+    Area of interest id of a feature
+
+    Features whose id field is NULL or empty fall back to their feature id,
+    as "NULL" ids would give several areas the same table and file names.
+    """
+    if id_fields:
+        value = feature[id_fields[0]]
+        if value is not None and value != NULL and str(value) != "":
+            return str(value)
+    return str(feature.id())
+
+
+class DownloadAoisAlgorithm(DownloadGeoParquetAlgorithm):
+    """Download the areas of interest of a polygon layer with a single scan of the source"""
+
+    ID_FIELD = "ID_FIELD"
+    AOI_OUTPUT = "AOI_OUTPUT"
+    AOI_OUTPUT_OPTIONS = [
+        ("files", "One file per area of interest (one table each for DuckDB)"),
+        ("column", "One file with an aoi_id column"),
+    ]
+
+    def createInstance(self):
+        return DownloadAoisAlgorithm()
+
+    def name(self):
+        return "download_aois"
+
+    def displayName(self):
+        return "Download GeoParquet data for many areas of interest"
+
+    def shortHelpString(self):
+        return (
+            "Downloads a cloud GeoParquet dataset for every polygon of an area of "
+            "interest layer. The source is read once for the combined extent of the "
+            "areas, and each feature is assigned to the areas it intersects. Write "
+            "one output per area, named after the output file with the area id "
+            "appended, or one output with an aoi_id column. A DuckDB database gets "
+            "one table per area instead of one file. Areas with an empty id use "
+            "their feature id."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.add_dataset_parameters()
+        self.addParameter(QgsProcessingParameterFeatureSource(
+            self.AOI,
+            "Areas of interest layer",
+            [QgsProcessing.TypeVectorPolygon],
+        ))
+        self.addParameter(QgsProcessingParameterField(
+            self.ID_FIELD,
+            "Area of interest id field (feature id when empty)",
+            parentLayerParameterName=self.AOI,
+            optional=True,
+        ))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.AOI_OUTPUT,
+            "Output",
+            options=[label for _, label in self.AOI_OUTPUT_OPTIONS],
+            defaultValue=0,
+        ))
+        self.add_output_parameters()
+
+    def area_of_interest(self, parameters, context):
+        """
+        Collect every area of interest of the layer in EPSG:4326
+
+        The areas are kept on the algorithm for build_job, and their combined
+        bounding box is the area that is scanned.
+        """
+        source = self.parameterAsSource(parameters, self.AOI, context)
+        id_fields = self.parameterAsFields(parameters, self.ID_FIELD, context)
+        wgs84 = QgsCoordinateReferenceSystem("EPSG:4326")
+        transform = QgsCoordinateTransform(source.sourceCrs(), wgs84, context.transformContext())
+
+        self.aois = []
+        bboxes = []
+        for feature in source.getFeatures():
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            geometry.transform(transform)
+            box = geometry.boundingBox()
+            bboxes.append((box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum()))
+            self.aois.append((aoi_id(feature, id_fields), geometry.asWkt()))
+        if not self.aois:
+            raise QgsProcessingException("The areas of interest layer has no geometries")
+
+        from .engine import union_bbox
+
+        return union_bbox(bboxes), None
+
+    def build_job(self, parameters, context):
+        job = super().build_job(parameters, context)
+        job.aois = self.aois
+        job.aoi_output = self.AOI_OUTPUT_OPTIONS[
+            self.parameterAsEnum(parameters, self.AOI_OUTPUT, context)
+        ][0]
+        return job
+
+
+class GeoParquetProvider(QgsProcessingProvider):
+    def loadAlgorithms(self):
+        self.addAlgorithm(DownloadGeoParquetAlgorithm())
+        self.addAlgorithm(DownloadAoisAlgorithm())
+
+    def id(self):
+        return "gpq_downloader"
+
+    def name(self):
+        return "GeoParquet Downloader"
+
+    def icon(self):
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        return QIcon(os.path.join(base_path, "icons", "parquet-download.svg"))
@@ -0,0 +1,104 @@
+"""
+Persistent on-disk cache of remote Parquet byte ranges.
+
+DuckDB's community cache_httpfs extension sits in front of httpfs and stores
+every block it fetches (footers, column chunks) on local disk. Repeated and
+overlapping downloads, or validation followed by the download, then read those
+blocks from disk instead of the network. The extension doesn't bound the size
+of its folder, so prune_range_cache drops the least recently used blocks
+after each download.
+
+Like the engine, this module has no Qt or QGIS dependencies.
+"""
+import logging
+import os
+
+from .extensions import load_extensions
+
+log = logging.getLogger(__name__)
+
+CACHE_EXTENSION = "cache_httpfs"
+# Folder of the cache in the plugin's settings folder
+RANGE_CACHE_DIR = "range_cache"
+DEFAULT_RANGE_CACHE_MB = 2048
+# Size of the cached blocks; remote reads are rounded out to whole blocks
+RANGE_CACHE_BLOCK_SIZE = 1024 * 1024
+
+
+def enable_range_cache(conn, directory, repository=None):
+    """
+    Route a connection's remote reads through the on-disk block cache
+
+    Must be called after httpfs is loaded and before any remote reads.
+
+    Args:
+        conn: DuckDB connection
+        directory (str): Folder to keep the cached blocks in
+        repository (str): Optional local path or URL of an extension repository
+
+    Returns:
+        bool: Whether the cache is active. Without the extension (offline, or
+            not built for this platform) downloads go straight to the network.
+    """
+    try:
+        os.makedirs(directory, exist_ok=True)
+        load_extensions(conn, (CACHE_EXTENSION,), repository)
+        conn.execute("SET cache_httpfs_type='on_disk';")
+        conn.execute(
+            "SET cache_httpfs_cache_directory='{}';".format(directory.replace("'", "''"))
+        )
+        conn.execute(f"SET cache_httpfs_cache_block_size={RANGE_CACHE_BLOCK_SIZE};")
+    except Exception as e:
+        log.warning(f"Byte range cache unavailable, reading from the network: {e}")
+        return False
+    return True
+
+
+def range_cache_size(directory):
+    """Total size in bytes of the cached blocks"""
+    return sum(size for _, _, size in cached_blocks(directory))
+
+
+def cached_blocks(directory):
+    """Return (last used time, path, size) for every cached block file"""
+    blocks = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Access times aren't updated on every read on many file systems,
+            # the later of both times is the best estimate of the last use
+            blocks.append((max(stat.st_atime, stat.st_mtime), path, stat.st_size))
+    return blocks
+
+
+def prune_range_cache(directory, max_mb):
+    """
+    Delete least recently used blocks until the cache fits in max_mb
+
+    Returns:
+        int: Number of bytes freed
+    """
+    blocks = cached_blocks(directory)
+    total = sum(size for _, _, size in blocks)
+    limit = max_mb * 1024 * 1024
+    freed = 0
+    for _, path, size in sorted(blocks):
+        if total - freed <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        freed += size
+    if freed:
+        log.info(f"Pruned {freed / (1024 * 1024):.1f} MB from the byte range cache")
+    return freed
+
+
+def clear_range_cache(directory):
+    """Delete every cached block"""
+    return prune_range_cache(directory, 0)
@@ -0,0 +1,75 @@
+import json
+import os
+
+# Parsed contents of data/presets.json and data/formats.json, loaded on first use
+_presets = None
+_formats = None
+
+
+def _load_data_file(file_name):
+    base_path = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(base_path, "data", file_name), "r") as f:
+        return json.load(f)
+
+
+def validate_presets(presets):
+    """
+    Check that every preset dataset can be turned into a URL
+
+    Raises:
+        ValueError: If a source or dataset entry is malformed
+    """
+    for source_name, datasets in presets.items():
+        if not isinstance(datasets, dict):
+            raise ValueError(f"Preset source '{source_name}' must be an object")
+        for dataset_name, dataset in datasets.items():
+            url = dataset.get("url", dataset.get("url_template"))
+            if not isinstance(url, str):
+                raise ValueError(
+                    f"Preset '{source_name}/{dataset_name}' needs a url or url_template"
+                )
+
+
+def validate_formats(formats):
+    """
+    Check that every output format has an extension and COPY options
+
+    Raises:
+        ValueError: If a format entry is malformed
+    """
+    for format_name, output_format in formats.items():
+        for key in ("extension", "format_options"):
+            if not isinstance(output_format.get(key), str):
+                raise ValueError(f"Format '{format_name}' needs a '{key}' string")
+        profiles = output_format.get("compression_profiles")
+        if profiles and output_format.get("default_compression_profile") not in profiles:
+            raise ValueError(
+                f"Format '{format_name}' has no valid default_compression_profile"
+            )
+
+
+def get_presets():
+    """Return the validated preset datasets, parsing presets.json only once"""
+    global _presets
+    if _presets is None:
+        presets = _load_data_file("presets.json")
+        validate_presets(presets)
+        _presets = presets
+    return _presets
+
+
+def get_formats():
+    """Return the validated output formats, parsing formats.json only once"""
+    global _formats
+    if _formats is None:
+        formats = _load_data_file("formats.json")
+        validate_formats(formats)
+        _formats = formats
+    return _formats
+
+
+def clear_cache():
+    """Forget the loaded presets and formats so they are read again on next use"""
+    global _presets, _formats
+    _presets = None
+    _formats = None
@@ -0,0 +1,305 @@
+"""
+Remote I/O tuning for DuckDB's httpfs reads.
+
+Every connection that reads remote data gets keep-alive, metadata caching and
+retry settings, plus the S3 region of the endpoint when it can be told from the
+bucket or host name. The number of DuckDB threads, which bounds the number of
+parallel range requests, is tuned per host with an AIMD controller: it grows
+additively while the bytes fetched per second hold up and is halved when
+requests fail. The
+tuned state is kept in a JSON file, so later sessions start from the best
+setting found for each host.
+
+To cut tail latency, the time of each host's metadata reads is tracked and
+httpfs' request timeout is set to a multiple of their 95th percentile, so a
+straggling request is abandoned and retried by httpfs instead of stalling the
+whole download. Downloads that still fail with request errors are retried with
+exponential backoff on the same connection, whose metadata cache (and the byte
+range cache, when enabled) keeps the bytes already fetched.
+
+Like the engine, this module has no Qt or QGIS dependencies.
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+# httpfs settings applied to every connection reading remote data
+HTTP_SETTINGS = {
+    "http_keep_alive": True,
+    "enable_http_metadata_cache": True,
+    "enable_object_cache": True,
+    "http_retries": 5,
+    "http_retry_wait_ms": 250,
+    "http_retry_backoff": 2,
+}
+# Bounds and step of the per-host thread count
+MIN_THREADS = 2
+# More parallel requests than this to one host rarely adds throughput and
+# tends to get requests throttled
+MAX_THREADS = 16
+THREADS_STEP = 4
+# A run counts as keeping up when its throughput is within this fraction of
+# the best seen, and the best decays by it whenever a run falls behind, so
+# stale measurements are eventually probed again
+THROUGHPUT_TOLERANCE = 0.1
+# Metadata read times kept per host, and the request timeout derived from them
+LATENCY_SAMPLES = 50
+MIN_LATENCY_SAMPLES = 5
+HTTP_TIMEOUT_P95_FACTOR = 4
+MIN_HTTP_TIMEOUT = 10
+MAX_HTTP_TIMEOUT = 120
+# Retries of a download failing with request errors, after waiting
+# RETRY_BACKOFF_SECONDS, then twice as long before every further attempt
+DOWNLOAD_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 2
+# File name of the tuning state in the plugin's settings folder
+REMOTE_TUNING_FILE = "remote_io.json"
+# AWS style region names in bucket or host names, e.g. overturemaps-us-west-2
+REGION_PATTERN = re.compile(r"(?<![a-z])((?:us|eu|ap|sa|ca|me|af|il|mx)-[a-z]+-\d)(?!\d)")
+# Request failures worth retrying: server errors, throttling, timeouts and
+# dropped connections. Others, such as 403 or 404, fail the same way again.
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r"\bHTTP (?:5\d\d|429)\b|SlowDown|Too Many Requests|timed out|Timeout"
+    r"|Connection reset|reset by peer|Broken pipe",
+    re.IGNORECASE,
+)
+
+_tuning_lock = threading.Lock()
+# Tuning state of this session, used when no file is configured
+_session_hosts = {}
+
+
+class RemoteReadError(IOError):
+    """A remote dataset couldn't be read, even after retrying"""
+
+
+def host_key(url):
+    """
+    Identify the endpoint a URL is read from
+
+    Returns:
+        str: "scheme://host" for remote URLs (the bucket for s3:// URLs), or
+            None for local paths
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("s3", "s3a", "gcs", "gs", "r2", "http", "https") or not parsed.netloc:
+        return None
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def infer_s3_region(url):
+    """Guess the S3 region from a bucket or host name, or None"""
+    match = REGION_PATTERN.search(urlparse(url).netloc)
+    return match.group(1) if match else None
+
+
+def is_http_error(error):
+    """Check whether a DuckDB error was caused by a request that may succeed when retried"""
+    return TRANSIENT_ERROR_PATTERN.search(str(error)) is not None
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def sql_value(value):
+    """Format a setting value as a SQL literal"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+
+def default_threads():
+    """Starting thread count for hosts that haven't been tuned yet"""
+    return min(MAX_THREADS, max(MIN_THREADS, 2 * (os.cpu_count() or 1)))
+
+
+def new_host_state(url):
+    """Tuning entry for a host that hasn't been read from before"""
+    threads = default_threads()
+    state = {
+        "threads": threads,
+        "best_threads": threads,
+        "best_throughput": 0.0,
+        "runs": 0,
+        "errors": 0,
+        "latencies": [],
+        "settings": {},
+    }
+    region = infer_s3_region(url)
+    if region and urlparse(url).scheme in ("s3", "s3a"):
+        state["settings"]["s3_region"] = region
+    return state
+
+
+class RemoteTuning:
+    """
+    Per-host httpfs settings and thread counts
+
+    Entries map a host key to {"threads", "best_threads", "best_throughput",
+    "runs", "errors", "latencies", "settings"}. "settings" holds extra httpfs/S3
+    settings for that endpoint, such as s3_region, and can be edited in the file.
+
+    Args:
+        path (str): JSON file to keep the state in, or None to keep it for the
+            rest of the session only
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def load(self):
+        if self.path is None:
+            return _session_hosts
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, hosts):
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(hosts, f, indent=2)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            log.warning(f"Could not save the remote I/O tuning: {e}")
+
+    def host_state(self, url):
+        """Return the tuning entry of a URL's host, creating a default one"""
+        with _tuning_lock:
+            state = self.load().get(host_key(url))
+        return state or new_host_state(url)
+
+    def configure(self, conn, url, max_threads=None):
+        """
+        Apply the httpfs settings and thread count for a URL to a connection
+
+        Args:
+            conn: DuckDB connection
+            url (str): Dataset URL that will be read
+            max_threads (int): Upper limit on the tuned thread count, or None
+
+        Returns:
+            int: The thread count used, or None for local data
+        """
+        if host_key(url) is None:
+            return None
+        state = self.host_state(url)
+        settings = dict(HTTP_SETTINGS, **state["settings"])
+        for name, value in settings.items():
+            try:
+                conn.execute(f"SET {name}={sql_value(value)};")
+            except Exception as e:
+                # Settings differ between DuckDB versions
+                log.info(f"Skipping unsupported setting {name}: {e}")
+        timeout = self.http_timeout(state)
+        if timeout is not None:
+            conn.execute(f"SET http_timeout={timeout};")
+        threads = min(state["threads"], MAX_THREADS, max_threads or MAX_THREADS)
+        conn.execute(f"SET threads={threads};")
+        log.info(f"Reading {host_key(url)} with {threads} threads")
+        return threads
+
+    @staticmethod
+    def http_timeout(state):
+        """Request timeout in seconds for a host, or None without enough samples"""
+        latencies = state.get("latencies", [])
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        timeout = math.ceil(percentile(latencies, 0.95) * HTTP_TIMEOUT_P95_FACTOR)
+        return min(MAX_HTTP_TIMEOUT, max(MIN_HTTP_TIMEOUT, timeout))
+
+    def statistics(self, url):
+        """
+        Summarize the recorded requests to a URL's host
+
+        Returns:
+            dict: runs, errors, error_rate and the p50/p95 metadata read time
+        """
+        state = self.host_state(url)
+        latencies = state.get("latencies", [])
+        return {
+            "runs": state["runs"],
+            "errors": state["errors"],
+            "error_rate": state["errors"] / state["runs"] if state["runs"] else 0.0,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+        }
+
+    def describe(self, url):
+        """One line summary of a host's statistics for messages"""
+        stats = self.statistics(url)
+        summary = f"{stats['errors']} of {stats['runs']} recent downloads failed"
+        if stats["p95"] is not None:
+            summary += (
+                f", metadata reads take {stats['p50']:.1f} s typically "
+                f"and {stats['p95']:.1f} s at the 95th percentile"
+            )
+        return summary
+
+    def record_latency(self, url, seconds):
+        """Add the time of a metadata read to the host's latency samples"""
+        key = host_key(url)
+        if key is None:
+            return
+        with _tuning_lock:
+            hosts = self.load()
+            state = hosts.get(key) or new_host_state(url)
+            latencies = state.setdefault("latencies", [])
+            latencies.append(round(seconds, 3))
+            del latencies[:-LATENCY_SAMPLES]
+            hosts[key] = state
+            self.save(hosts)
+
+    def record(self, url, seconds=0.0, byte_count=0, error=False):
+        """
+        Feed the outcome of a download back into the host's controller
+
+        Args:
+            url (str): Dataset URL that was read
+            seconds (float): Time the remote read took
+            byte_count (float): Bytes fetched, so throughput is bytes per
+                second; runs with an unknown size are ignored
+            error (bool): Whether the read failed with a request error
+        """
+        key = host_key(url)
+        if key is None or (not error and (byte_count <= 0 or seconds <= 0)):
+            return
+        with _tuning_lock:
+            hosts = self.load()
+            state = hosts.get(key) or new_host_state(url)
+            state["runs"] += 1
+            if error:
+                state["errors"] += 1
+                state["threads"] = max(MIN_THREADS, min(MAX_THREADS, state["threads"]) // 2)
+            else:
+                throughput = byte_count / seconds
+                best = state["best_throughput"]
+                if throughput >= best * (1 - THROUGHPUT_TOLERANCE):
+                    if throughput > best:
+                        state["best_throughput"] = throughput
+                        state["best_threads"] = state["threads"]
+                    state["threads"] = min(MAX_THREADS, state["threads"] + THREADS_STEP)
+                else:
+                    state["best_throughput"] = best * (1 - THROUGHPUT_TOLERANCE)
+                    state["threads"] = min(MAX_THREADS, state["best_threads"])
+            hosts[key] = state
+            self.save(hosts)
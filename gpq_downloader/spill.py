@@ -0,0 +1,156 @@
+"""
+Memory-bounded downloads that spill to disk.
+
+Downloads collect the filtered rows in a DuckDB table before writing them out,
+which normally lives in memory. Before a download the row groups of the area
+are sized from the Parquet footers; when they could take a large share of the
+machine's memory, the table goes to a temporary on-disk database instead, with
+a memory limit and a spill folder for DuckDB's operators, so a huge extract
+slows down rather than pushing QGIS into swap or getting it killed.
+
+Like the engine, this module has no Qt or QGIS dependencies.
+"""
+import logging
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass, field
+
+from .planner import estimate_area_bytes
+
+log = logging.getLogger(__name__)
+
+# Spill when the area's row groups could take more than this fraction of the
+# physical memory
+SPILL_MEMORY_FRACTION = 0.25
+# DuckDB's memory limit while spilling, as a fraction of the physical memory
+SPILL_MEMORY_LIMIT_FRACTION = 0.5
+# Assumed physical memory where it can't be read
+FALLBACK_PHYSICAL_MEMORY_MB = 8192
+SPILL_DATABASE_FILE = "spill.duckdb"
+SPILL_DIR_PREFIX = "gpq_spill_"
+# Connection settings changed while spilling, restored by detach_spill
+SPILL_SETTINGS = ("memory_limit", "temp_directory", "preserve_insertion_order")
+
+
+@dataclass
+class Spill:
+    """
+    An on-disk database a connection collects its tables in
+
+    Attributes:
+        directory: Temporary folder of the database and DuckDB's spill files
+        alias: Name the database is attached under
+        settings: Values of SPILL_SETTINGS before spilling, by name
+    """
+
+    directory: str
+    alias: str
+    settings: dict = field(default_factory=dict)
+
+
+def physical_memory_mb():
+    """Physical memory of the machine in MB"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        # Not available on Windows
+        return FALLBACK_PHYSICAL_MEMORY_MB
+
+
+def default_spill_threshold_mb():
+    """Estimated download size above which downloads spill to disk"""
+    return physical_memory_mb() * SPILL_MEMORY_FRACTION
+
+
+def is_out_of_memory(error):
+    """Check whether a DuckDB error was caused by reaching the memory limit"""
+    message = str(error)
+    return "Out of Memory" in message or "could not allocate" in message.lower()
+
+
+def estimate_area_mb(conn, url, bbox, bbox_column):
+    """
+    Estimate the in-memory size of the rows in an area from Parquet footers
+
+    Sums the uncompressed size of the row groups whose bbox statistics overlap
+    the area, which bounds the size of the rows the download keeps. Footers
+    of multi-file datasets are sampled, see planner.estimate_area_bytes.
+
+    Returns:
+        float: Estimated size in MB, or None without bbox statistics to go by
+    """
+    estimate = estimate_area_bytes(conn, url, bbox, bbox_column)
+    if estimate is None:
+        return None
+    return estimate[1] / (1024 * 1024)
+
+
+def restore_setting(conn, name, value):
+    """
+    Set a DuckDB setting back to a value read with current_setting
+
+    Settings are reset first, which restores defaults exactly; sizes read with
+    current_setting are rounded, so they are only set when not the default.
+    """
+    conn.execute(f"RESET {name};")
+    current = conn.execute(f"SELECT current_setting('{name}')").fetchone()[0]
+    if str(current) != str(value):
+        conn.execute("SET {}='{}';".format(name, str(value).replace("'", "''")))
+
+
+def enable_spill(conn, directory=None):
+    """
+    Move the connection's new tables to a temporary on-disk database
+
+    Tables created afterwards without a schema land in the on-disk database,
+    DuckDB spills operators that exceed the memory limit to the same folder.
+    The database is attached under the folder's unique name, so jobs sharing
+    a DuckDB database can spill at the same time.
+
+    Args:
+        conn: DuckDB connection
+        directory (str): Folder to create the temporary folder in, the system
+            temp folder when None
+
+    Returns:
+        Spill: The on-disk database, to be detached with detach_spill and
+        removed with remove_spill once the connection is closed
+    """
+    spill_dir = tempfile.mkdtemp(prefix=SPILL_DIR_PREFIX, dir=directory)
+    database = os.path.join(spill_dir, SPILL_DATABASE_FILE).replace("'", "''")
+    temp_directory = os.path.join(spill_dir, "tmp").replace("'", "''")
+    memory_limit = int(physical_memory_mb() * SPILL_MEMORY_LIMIT_FRACTION)
+    alias = os.path.basename(spill_dir)
+    settings = {
+        name: conn.execute(f"SELECT current_setting('{name}')").fetchone()[0]
+        for name in SPILL_SETTINGS
+    }
+    conn.execute(f"ATTACH '{database}' AS \"{alias}\";")
+    conn.execute(f"USE \"{alias}\";")
+    conn.execute(f"SET temp_directory='{temp_directory}';")
+    conn.execute(f"SET memory_limit='{memory_limit}MB';")
+    # Keeping the input order needs operators to hold rows back; the output is
+    # Hilbert sorted anyway
+    conn.execute("SET preserve_insertion_order=false;")
+    log.info(f"Spilling to {spill_dir} with a {memory_limit} MB memory limit")
+    return Spill(directory=spill_dir, alias=alias, settings=settings)
+
+
+def detach_spill(conn, spill):
+    """
+    Switch the connection back to memory and detach the on-disk database
+
+    The memory limit, temp folder and insertion order apply to the whole
+    database, so they are restored for other connections to it.
+    """
+    conn.execute("USE memory;")
+    conn.execute(f"DETACH \"{spill.alias}\";")
+    for name, value in spill.settings.items():
+        restore_setting(conn, name, value)
+
+
+def remove_spill(spill):
+    """Delete the folder of a database created by enable_spill"""
+    if spill is not None:
+        shutil.rmtree(spill.directory, ignore_errors=True)
@@ -0,0 +1,238 @@
+"""
+Running downloads in a separate Python process.
+
+DuckDB normally runs inside the QGIS process, where a crash in an extension or
+GDAL takes QGIS down with it, and memory DuckDB allocated is often kept after
+the job. run_in_subprocess instead starts QGIS's Python interpreter on the
+engine alone: the package is bootstrapped without its __init__, which needs
+QGIS, the job is sent as JSON on stdin, and progress, log records and the
+result come back as JSON lines on stdout. Cancelling kills the process, and
+all its memory is returned to the system when it exits.
+
+Like the engine, this module has no Qt or QGIS dependencies.
+"""
+import collections
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+from dataclasses import asdict, fields
+
+from .engine import DownloadEngine, DownloadJob, DownloadResult
+from .remote_io import RemoteReadError
+
+log = logging.getLogger(__name__)
+
+# Lines of the child's stderr kept to explain a crash
+STDERR_TAIL_LINES = 20
+# How often the cancel watcher checks whether the process is still running
+CANCEL_POLL_SECONDS = 0.2
+# Errors raised again in the parent as their own type, others as RuntimeError
+ERROR_TYPES = {"RemoteReadError": RemoteReadError, "MemoryError": MemoryError}
+
+BOOTSTRAP = """
+import importlib, sys, types
+package = types.ModuleType({package!r})
+package.__path__ = [{package_dir!r}]
+sys.modules[{package!r}] = package
+importlib.import_module({package!r} + "." + {module!r}).{function}()
+"""
+
+
+def python_executable():
+    """The Python interpreter that ships with QGIS, as opposed to the QGIS binary"""
+    if platform.system() == "Windows":
+        return os.path.join(os.path.dirname(sys.executable), "python.exe")
+    if platform.system() == "Darwin":
+        qgis_bin = os.path.dirname(sys.executable)
+        possible_paths = [
+            os.path.join(qgis_bin, "python3"),
+            os.path.join(qgis_bin, "bin", "python3"),
+            os.path.join(qgis_bin, "Resources", "python", "bin", "python3"),
+        ]
+        return next(
+            (path for path in possible_paths if os.path.exists(path)),
+            sys.executable,
+        )
+    return sys.executable
+
+
+def bootstrap_command(module, function, python=None):
+    """
+    Command running a function of one of the package's modules in a new process
+
+    The package is registered without running its __init__, which needs QGIS.
+    """
+    package = __name__.rpartition(".")[0]
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    return [
+        python or python_executable(),
+        "-c",
+        BOOTSTRAP.format(package=package, package_dir=package_dir, module=module, function=function),
+    ]
+
+
+def child_environment():
+    """Environment of a child process, which sees the same packages as QGIS"""
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+
+
+def job_to_json(job):
+    """Encode a DownloadJob as a JSON compatible dict"""
+    data = asdict(job)
+    if job.aoi_wkb is not None:
+        data["aoi_wkb"] = job.aoi_wkb.hex()
+    return data
+
+
+def job_from_json(data):
+    """Decode a DownloadJob encoded by job_to_json"""
+    data = dict(data)
+    data["bbox"] = tuple(data["bbox"])
+    if data.get("aoi_wkb") is not None:
+        data["aoi_wkb"] = bytes.fromhex(data["aoi_wkb"])
+    if data.get("aois") is not None:
+        data["aois"] = [tuple(aoi) for aoi in data["aois"]]
+    return DownloadJob(**data)
+
+
+def result_to_json(result):
+    """Encode a DownloadResult as a JSON compatible dict, without its layer"""
+    return {f.name: getattr(result, f.name) for f in fields(result) if f.name != "layer"}
+
+
+def result_from_json(data):
+    """Decode a DownloadResult encoded by result_to_json"""
+    data = dict(data)
+    if data.get("schema") is not None:
+        data["schema"] = [tuple(row) for row in data["schema"]]
+    return DownloadResult(**data)
+
+
+class ProtocolLogHandler(logging.Handler):
+    """Forwards the child's log records to the parent"""
+
+    def __init__(self, send):
+        super().__init__()
+        self.send = send
+
+    def emit(self, record):
+        self.send({"type": "log", "level": record.levelno, "message": record.getMessage()})
+
+
+def child_main():
+    """Entry point of the child process: run the job read from stdin"""
+    # Keep stdout for the protocol; anything else printed, also from C
+    # libraries, goes to stderr
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            protocol.write(json.dumps(message, default=str) + "\n")
+            protocol.flush()
+
+    package_log = logging.getLogger(__name__.rpartition(".")[0])
+    package_log.addHandler(ProtocolLogHandler(send))
+    package_log.setLevel(logging.INFO)
+
+    try:
+        job = job_from_json(json.loads(sys.stdin.readline()))
+        result = DownloadEngine(
+            job, progress=lambda message: send({"type": "progress", "message": message})
+        ).run()
+        send({"type": "result", "result": result_to_json(result)})
+    except Exception as e:
+        send({"type": "error", "error_type": type(e).__name__, "message": str(e)})
+
+
+def run_in_subprocess(job, progress=None, cancel_event=None, python=None):
+    """
+    Run a download in a separate Python process, blocking until it ends
+
+    Row consumers can't be used across processes, so results are always
+    written to the job's output.
+
+    Args:
+        job (DownloadJob): What to download
+        progress (callable): Called with a status message as the job advances
+        cancel_event (threading.Event): Set to kill the process
+        python (str): Interpreter to run, QGIS's Python when None
+
+    Returns:
+        DownloadResult: The outcome of the download, "cancelled" if it was killed
+
+    Raises:
+        RemoteReadError: If remote reads kept failing
+        MemoryError: If the download ran out of memory
+        RuntimeError: For other errors, and if the process crashed
+    """
+    process = subprocess.Popen(
+        bootstrap_command("subprocess_runner", "child_main", python),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=child_environment(),
+        text=True,
+        creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),
+    )
+
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip())
+
+    def watch_cancel():
+        while process.poll() is None:
+            if cancel_event.wait(CANCEL_POLL_SECONDS):
+                process.kill()
+                return
+
+    threading.Thread(target=read_stderr, daemon=True).start()
+    if cancel_event is not None:
+        threading.Thread(target=watch_cancel, daemon=True).start()
+
+    try:
+        process.stdin.write(json.dumps(job_to_json(job)) + "\n")
+        process.stdin.close()
+    except OSError:
+        pass  # The process already exited, its output tells why
+
+    result = None
+    error = None
+    for line in process.stdout:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            log.info(line.rstrip())
+            continue
+        if message["type"] == "progress":
+            if progress is not None:
+                progress(message["message"])
+        elif message["type"] == "log":
+            log.log(message["level"], message["message"])
+        elif message["type"] == "result":
+            result = result_from_json(message["result"])
+        elif message["type"] == "error":
+            error = message
+    exit_code = process.wait()
+
+    if cancel_event is not None and cancel_event.is_set():
+        return DownloadResult(status="cancelled")
+    if error is not None:
+        raise ERROR_TYPES.get(error["error_type"], RuntimeError)(
+            error["message"] or error["error_type"]
+        )
+    if result is None:
+        details = "\n".join(stderr_tail)
+        raise RuntimeError(
+            f"The download process stopped unexpectedly (exit code {exit_code})"
+            + (f":\n{details}" if details else "")
+        )
+    return result
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import time
+import pytest
+
+from gpq_downloader.dialog import DataSourceDialog
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import gpq_downloader.plugin
+elapsed = time.perf_counter() - start
+print(elapsed)
+print('duckdb' in sys.modules)
+"""
+
+def run_import_script():
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    elapsed, duckdb_loaded = result.stdout.strip().splitlines()[-2:]
+    return float(elapsed), duckdb_loaded == "True"
+
+def test_plugin_import_does_not_load_duckdb():
+    """Test that loading the plugin module leaves DuckDB unimported"""
+    _, duckdb_loaded = run_import_script()
+    assert not duckdb_loaded
+
+@pytest.mark.skipif(not os.environ.get('RUN_BENCHMARKS'), reason="Benchmarks not enabled")
+def test_benchmark_plugin_load_time():
+    """Measure how long importing the plugin module takes"""
+    timings = sorted(run_import_script()[0] for _ in range(5))
+    print(f"\nPlugin load: median {timings[2] * 1000:.1f} ms, best {timings[0] * 1000:.1f} ms")
+
+@pytest.mark.skipif(not os.environ.get('RUN_BENCHMARKS'), reason="Benchmarks not enabled")
+def test_benchmark_dialog_open_latency(qgs_app, mock_iface):
+    """Measure how long constructing the data source dialog takes"""
+    timings = []
+    for _ in range(20):
+        start = time.perf_counter()
+        dialog = DataSourceDialog(None, mock_iface)
+        timings.append(time.perf_counter() - start)
+        dialog.deleteLater()
+    timings.sort()
+    print(f"\nDialog open: median {timings[10] * 1000:.1f} ms, best {timings[0] * 1000:.1f} ms")
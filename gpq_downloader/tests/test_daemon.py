@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from dataclasses import replace
+
+import pytest
+
+from gpq_downloader import daemon as daemon_module
+from gpq_downloader.daemon import (
+    DownloadDaemon,
+    database_settings,
+    private_directory,
+    read_state,
+    result_key,
+    reusable_output,
+    run_in_daemon,
+)
+from gpq_downloader.engine import DownloadJob, DownloadResult
+
+class FakeEngine:
+    """Writes the output file instead of downloading"""
+
+    runs = []
+
+    def __init__(self, job, progress=None, cancel_event=None, database=None):
+        self.job = job
+        self.progress = progress
+
+    def run(self):
+        FakeEngine.runs.append(self.job)
+        self.progress("Downloading data...")
+        with open(self.job.output_file, "w") as f:
+            f.write("data")
+        return DownloadResult(status="written", output=self.job.output_file, row_count=1)
+
+@pytest.fixture
+def running_daemon(tmp_path, monkeypatch):
+    FakeEngine.runs = []
+    monkeypatch.setattr(daemon_module, "DownloadEngine", FakeEngine)
+    directory = str(tmp_path / "daemon")
+    download_daemon = DownloadDaemon(directory)
+    thread = threading.Thread(target=download_daemon.serve, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while read_state(directory) is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    yield directory
+    download_daemon.stop()
+    thread.join(5)
+
+def make_job(tmp_path, name="output.gpkg"):
+    return DownloadJob(
+        dataset_url="https://example.com/data.parquet",
+        bbox=(1, 2, 3, 4),
+        output_file=str(tmp_path / name),
+    )
+
+def test_result_key_ignores_output():
+    """Test jobs differing only in their output's location share a result"""
+    job = DownloadJob(dataset_url="a", bbox=(1, 2, 3, 4), output_file="/tmp/a.gpkg")
+    other = DownloadJob(dataset_url="a", bbox=(1, 2, 3, 4), output_file="/data/b.GPKG")
+    assert result_key(job) == result_key(other)
+    assert result_key(job) != result_key(DownloadJob(dataset_url="a", bbox=(0, 2, 3, 4), output_file="x"))
+    assert result_key(job) != result_key(replace(job, layer_name="b"))
+
+def test_result_key_keeps_format():
+    """Test a job writing another format doesn't reuse an earlier output"""
+    job = DownloadJob(dataset_url="a", bbox=(1, 2, 3, 4), output_file="/tmp/a.parquet")
+    assert result_key(job) != result_key(replace(job, output_file="/tmp/a.gpkg"))
+    assert not reusable_output(replace(job, output_file="/tmp/workspace.duckdb"))
+    assert not reusable_output(replace(job, aois=[("a", "POINT (1 2)")]))
+    assert reusable_output(replace(job, aois=[("a", "POINT (1 2)")], aoi_output="column"))
+
+def test_run_in_daemon(running_daemon, tmp_path):
+    """Test jobs run in the daemon with shared caches and stream progress"""
+    messages = []
+    result = run_in_daemon(make_job(tmp_path), progress=messages.append, directory=running_daemon)
+
+    assert result.status == "written"
+    assert result.row_count == 1
+    assert "Downloading data..." in messages
+    assert FakeEngine.runs[0].plan_cache.startswith(running_daemon)
+
+def test_run_in_daemon_reuses_results(running_daemon, tmp_path):
+    """Test an identical job is served by copying the earlier output"""
+    run_in_daemon(make_job(tmp_path), directory=running_daemon)
+    result = run_in_daemon(make_job(tmp_path, "copy.gpkg"), directory=running_daemon)
+
+    assert len(FakeEngine.runs) == 1
+    assert result.output == str(tmp_path / "copy.gpkg")
+    assert (tmp_path / "copy.gpkg").read_text() == "data"
+
+def test_run_in_daemon_keeps_duckdb_workspaces(running_daemon, tmp_path):
+    """Test DuckDB workspaces are never overwritten with an earlier output"""
+    run_in_daemon(make_job(tmp_path, "first.duckdb"), directory=running_daemon)
+    (tmp_path / "second.duckdb").write_text("other tables")
+    run_in_daemon(make_job(tmp_path, "second.duckdb"), directory=running_daemon)
+
+    assert len(FakeEngine.runs) == 2
+
+def test_daemon_rejects_invalid_token(running_daemon, tmp_path, monkeypatch):
+    """Test requests without the token from the state file are refused"""
+    state = dict(read_state(running_daemon), token="wrong")
+    monkeypatch.setattr(daemon_module, "ensure_daemon", lambda directory: state)
+    with pytest.raises(RuntimeError, match="Invalid token"):
+        run_in_daemon(make_job(tmp_path), directory=running_daemon)
+
+def test_databases_get_their_settings_back(tmp_path):
+    """Test settings a job changes don't carry over to the next job"""
+    download_daemon = DownloadDaemon(str(tmp_path))
+    database, settings = download_daemon.checkout_database()
+    database.cursor().execute(
+        f"SET threads = 1; SET memory_limit = '1GB'; SET preserve_insertion_order = false; "
+        f"SET temp_directory = '{tmp_path.as_posix()}';"
+    )
+    download_daemon.checkin_database(database, settings)
+
+    again, _ = download_daemon.checkout_database()
+    assert again is database
+    assert database_settings(again) == settings
+    again.close()
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX permissions")
+def test_private_directory(tmp_path):
+    """Test a daemon folder or state file other users can access isn't trusted"""
+    directory = tmp_path / "daemon"
+    private_directory(str(directory))
+    assert directory.stat().st_mode & 0o777 == 0o700
+
+    state_file = directory / daemon_module.DAEMON_STATE_FILE
+    state_file.write_text('{"port": 1, "token": "t", "pid": 1}')
+    state_file.chmod(0o644)
+    assert read_state(str(directory)) is None
+    state_file.chmod(0o600)
+    assert read_state(str(directory))["port"] == 1
+
+    directory.chmod(0o777)
+    with pytest.raises(PermissionError):
+        private_directory(str(directory))
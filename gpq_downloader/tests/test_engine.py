@@ -0,0 +1,563 @@
+import asyncio
+import json
+import threading
+import pytest
+from unittest.mock import MagicMock, patch
+
+from gpq_downloader.engine import (
+    DownloadEngine,
+    DownloadJob,
+    aoi_output_path,
+    build_geo_metadata,
+    download_async,
+    download_many,
+    duckdb_table_name,
+    output_stays_in_4326,
+    requery_row_group_size,
+    run_download,
+    union_bbox,
+    vector_tile_zoom_range,
+)
+from gpq_downloader.remote_io import RemoteReadError
+
+SCHEMA = [
+    ("id", "INTEGER", "YES", None, None, None),
+    ("bbox", "STRUCT(xmin DOUBLE, ymin DOUBLE, xmax DOUBLE, ymax DOUBLE)", "YES", None, None, None),
+    ("geometry", "GEOMETRY", "YES", None, None, None),
+]
+
+class MockResult:
+    def __init__(self, data):
+        self.data = data
+
+    def fetchall(self):
+        return self.data
+
+    def fetchone(self):
+        return self.data[0] if self.data else None
+
+class MockConnection:
+    """Answers DESCRIBE, COUNT, AOI id and setting queries and records all queries"""
+
+    def __init__(self, row_count=1, aoi_ids=()):
+        self.row_count = row_count
+        self.aoi_ids = aoi_ids
+        self.executed_queries = []
+        self.closed = False
+
+    def execute(self, query, *args):
+        self.executed_queries.append(query)
+        if "DESCRIBE" in query:
+            return MockResult(SCHEMA)
+        elif "COUNT" in query:
+            return MockResult([(self.row_count,)])
+        elif "DISTINCT aoi_id" in query:
+            return MockResult([(aoi_id,) for aoi_id in self.aoi_ids])
+        elif "current_setting" in query:
+            return MockResult([("",)])
+        return MockResult([])
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def make_job(tmp_path, name="output.gpkg", **kwargs):
+    return DownloadJob(
+        dataset_url="https://example.com/test.parquet",
+        bbox=(1, 2, 3, 4),
+        output_file=str(tmp_path / name),
+        bbox_column="bbox",
+        **kwargs,
+    )
+
+@patch("duckdb.connect")
+def test_run_download_writes_file(mock_connect, tmp_path):
+    """Test a blocking download filters on the bbox column and writes the output"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+    messages = []
+
+    result = run_download(make_job(tmp_path), progress=messages.append)
+
+    assert result.status == "written"
+    assert result.output == str(tmp_path / "output.gpkg")
+    assert result.bbox_column == "bbox"
+    assert any('"bbox".xmin BETWEEN 1 AND 3' in q for q in conn.executed_queries)
+    assert any("FORMAT GDAL" in q for q in conn.executed_queries)
+    assert any("Downloading" in msg for msg in messages)
+    assert conn.closed
+
+@patch("duckdb.connect")
+def test_run_download_records_filter_plan(mock_connect, tmp_path):
+    """Test the filter plan and its measured cost are saved to the plan cache"""
+    mock_connect.return_value = MockConnection(row_count=5)
+    plan_cache = tmp_path / "plans.json"
+
+    result = run_download(make_job(tmp_path, plan_cache=str(plan_cache)))
+
+    assert result.filter_strategy == "bbox"
+    entry = json.loads(plan_cache.read_text())["https://example.com/test.parquet"]
+    assert entry["bbox_column"] == "bbox"
+    assert entry["costs"]["bbox"]["rows"] == 5
+    assert entry["costs"]["bbox"]["runs"] == 1
+
+@patch("duckdb.connect")
+def test_run_download_http_error_reduces_threads(mock_connect, tmp_path):
+    """Test a failed remote read is fed back into the host's I/O tuning"""
+    class FailingConnection(MockConnection):
+        def execute(self, query, *args):
+            if "CREATE TABLE download_data" in query:
+                raise IOError("HTTP Error: HTTP GET error (HTTP 503)")
+            return super().execute(query, *args)
+
+    conn = FailingConnection()
+    mock_connect.return_value = conn
+    tuning = tmp_path / "tuning.json"
+
+    with pytest.raises(RemoteReadError):
+        run_download(make_job(tmp_path, remote_tuning=str(tuning), retries=0))
+
+    assert any(q.startswith("SET threads=") for q in conn.executed_queries)
+    state = json.loads(tuning.read_text())["https://example.com"]
+    assert state["errors"] == 1
+
+@patch("gpq_downloader.engine.RETRY_BACKOFF_SECONDS", 0)
+@patch("duckdb.connect")
+def test_run_download_retries_request_errors(mock_connect, tmp_path):
+    """Test a download is retried after a failed request and then succeeds"""
+    failures = []
+
+    class FlakyConnection(MockConnection):
+        def execute(self, query, *args):
+            if "CREATE TABLE download_data" in query and not failures:
+                failures.append(query)
+                raise IOError("HTTP Error: HTTP GET error (HTTP 503)")
+            return super().execute(query, *args)
+
+    conn = FlakyConnection()
+    mock_connect.return_value = conn
+
+    result = run_download(make_job(tmp_path))
+
+    assert result.status == "written"
+    assert len(failures) == 1
+    assert any("CREATE TABLE download_data" in q for q in conn.executed_queries)
+
+@patch("gpq_downloader.engine.RETRY_BACKOFF_SECONDS", 0)
+@patch("duckdb.connect")
+def test_run_download_does_not_retry_missing_files(mock_connect, tmp_path):
+    """Test a request that fails for good reports its error without retrying"""
+    attempts = []
+
+    class MissingFileConnection(MockConnection):
+        def execute(self, query, *args):
+            if "CREATE TABLE download_data" in query:
+                attempts.append(query)
+                raise IOError("HTTP Error: HTTP GET error on 'x' (HTTP 404)")
+            return super().execute(query, *args)
+
+    mock_connect.return_value = MissingFileConnection()
+    tuning = tmp_path / "tuning.json"
+
+    with pytest.raises(IOError, match="HTTP 404"):
+        run_download(make_job(tmp_path, remote_tuning=str(tuning)))
+
+    assert len(attempts) == 1
+    # Missing files say nothing about the host, so its tuning is left alone
+    assert json.loads(tuning.read_text())["https://example.com"]["errors"] == 0
+
+@patch("gpq_downloader.planner.row_groups_clustered", return_value=True)
+@patch("gpq_downloader.engine.estimate_area_mb", return_value=5000.0)
+@patch("duckdb.connect")
+def test_run_download_spills_large_areas(mock_connect, mock_estimate, mock_clustered, tmp_path):
+    """Test areas estimated above the threshold are collected in an on-disk database"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+    spill_directory = tmp_path / "spill"
+    spill_directory.mkdir()
+
+    result = run_download(make_job(
+        tmp_path,
+        spill_threshold_mb=100,
+        spill_directory=str(spill_directory),
+    ))
+
+    assert result.status == "written"
+    attach = next(i for i, q in enumerate(conn.executed_queries) if q.startswith("ATTACH"))
+    create = next(i for i, q in enumerate(conn.executed_queries) if "CREATE TABLE download_data" in q)
+    assert attach < create
+    assert any(q.startswith("SET memory_limit=") for q in conn.executed_queries)
+    assert list(spill_directory.iterdir()) == []
+
+@patch("duckdb.connect")
+def test_run_download_spills_when_out_of_memory(mock_connect, tmp_path):
+    """Test a download that runs out of memory starts over on disk"""
+    class SmallMemoryConnection(MockConnection):
+        def execute(self, query, *args):
+            if "CREATE TABLE download_data" in query and not any(
+                q.startswith("ATTACH") for q in self.executed_queries
+            ):
+                raise MemoryError("Out of Memory Error: failed to allocate data of size 1.0 GiB")
+            return super().execute(query, *args)
+
+    conn = SmallMemoryConnection()
+    mock_connect.return_value = conn
+
+    result = run_download(make_job(tmp_path, spill_directory=str(tmp_path)))
+
+    assert result.status == "written"
+    assert not any(path.name.startswith("gpq_spill_") for path in tmp_path.iterdir())
+
+@patch("duckdb.connect")
+def test_run_download_columns_and_filters(mock_connect, tmp_path):
+    """Test column selection and extra filters end up in the download query"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+
+    run_download(make_job(tmp_path, "output.parquet", columns=["id"], filters=["id > 10"]))
+
+    create_query = next(q for q in conn.executed_queries if "CREATE TABLE download_data" in q)
+    assert 'SELECT "id", "geometry"' in create_query
+    assert "(id > 10)" in create_query
+
+@patch("duckdb.connect")
+def test_run_download_aoi_polygon(mock_connect, tmp_path):
+    """Test an AOI polygon keeps the bbox prefilter and adds an exact intersection"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+    aoi_wkb = bytes.fromhex("0101000000000000000000f03f0000000000000040")
+
+    run_download(make_job(tmp_path, aoi_wkb=aoi_wkb))
+
+    create_query = next(q for q in conn.executed_queries if "CREATE TABLE download_data" in q)
+    assert '"bbox".xmin BETWEEN' in create_query
+    assert f"ST_GeomFromWKB(from_hex('{aoi_wkb.hex()}'))" in create_query
+
+@patch("duckdb.connect")
+def test_run_download_clip(mock_connect, tmp_path):
+    """Test clipping cuts geometries to the bbox and refreshes the bbox column"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+
+    run_download(make_job(tmp_path, "output.parquet", clip=True))
+
+    create_query = next(q for q in conn.executed_queries if "CREATE TABLE download_data" in q)
+    assert "ST_Intersection(\"geometry\", ST_MakeEnvelope(1, 2, 3, 4))" in create_query
+    assert "ST_Within" in create_query
+    assert 'AS "bbox"' in create_query
+    assert "TO_JSON(struct_pack" not in create_query
+    # The dataset has an id column, so no extra id is needed
+    assert "source_feature_id" not in create_query
+
+@patch("duckdb.connect")
+def test_run_download_clip_adds_source_id(mock_connect, tmp_path):
+    """Test clipped features without an id column get a source feature id"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+
+    run_download(make_job(tmp_path, columns=["bbox"], clip=True))
+
+    create_query = next(q for q in conn.executed_queries if "CREATE TABLE download_data" in q)
+    assert "AS source_feature_id" in create_query
+    assert "TO_JSON(struct_pack" in create_query
+
+@patch("duckdb.connect")
+def test_run_download_generalize(mock_connect, tmp_path):
+    """Test simplification and coordinate rounding wrap the geometry column"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+
+    run_download(make_job(tmp_path, simplify_tolerance=0.001, precision_decimals=5))
+
+    create_query = next(q for q in conn.executed_queries if "CREATE TABLE download_data" in q)
+    assert (
+        'ST_ReducePrecision(ST_SimplifyPreserveTopology("geometry", 0.001), 1e-05) AS "geometry"'
+        in create_query
+    )
+
+@patch("duckdb.connect")
+def test_run_download_reprojects_gdal_output(mock_connect, tmp_path):
+    """Test GDAL output is reprojected in DuckDB and written with the target SRS"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+
+    run_download(make_job(tmp_path, target_crs="EPSG:3857"))
+
+    create_query = next(q for q in conn.executed_queries if "CREATE TABLE download_data" in q)
+    assert "ST_Transform(\"geometry\", 'EPSG:4326', 'EPSG:3857', always_xy := true)" in create_query
+    assert any("SRS 'EPSG:3857'" in q for q in conn.executed_queries)
+
+@patch("duckdb.connect")
+def test_run_download_rounds_after_reprojecting(mock_connect, tmp_path):
+    """Test coordinates are rounded in the output CRS, after reprojection"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+
+    run_download(make_job(tmp_path, target_crs="EPSG:3857", precision_decimals=2))
+
+    create_query = next(q for q in conn.executed_queries if "CREATE TABLE download_data" in q)
+    assert (
+        "ST_ReducePrecision(ST_Transform(\"geometry\", 'EPSG:4326', 'EPSG:3857', always_xy := true), 0.01)"
+        in create_query
+    )
+
+@patch("duckdb.connect")
+def test_run_download_parquet_stays_in_4326(mock_connect, tmp_path):
+    """Test GeoParquet output ignores the target CRS"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+
+    run_download(make_job(tmp_path, "output.parquet", target_crs="EPSG:3857"))
+
+    assert not any("ST_Transform" in q for q in conn.executed_queries)
+
+@patch("gpq_downloader.engine.write_vector_tiles")
+@patch("duckdb.connect")
+def test_run_download_vector_tiles(mock_connect, mock_write_tiles, tmp_path):
+    """Test vector tile output is tiled from a Hilbert sorted FlatGeobuf in EPSG:4326"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+    (tmp_path / "output.tiling.fgb").write_bytes(b"")
+
+    result = run_download(make_job(tmp_path, "output.pmtiles", target_crs="EPSG:3857"))
+
+    assert result.status == "written"
+    copy_query = next(q for q in conn.executed_queries if q.lstrip().startswith("COPY"))
+    assert "ST_Hilbert" in copy_query
+    assert f"TO '{tmp_path / 'output.tiling.fgb'}'" in copy_query
+    assert "DRIVER 'FlatGeobuf', SRS 'EPSG:4326'" in copy_query
+    source, output, driver, layer_name, min_zoom, max_zoom = mock_write_tiles.call_args.args
+    assert output == str(tmp_path / "output.pmtiles")
+    assert driver == "PMTiles"
+    assert (min_zoom, max_zoom) == vector_tile_zoom_range((1, 2, 3, 4))
+    assert not (tmp_path / "output.tiling.fgb").exists()
+
+def test_output_stays_in_4326():
+    """Test GeoParquet and vector tile outputs ignore the target CRS"""
+    assert output_stays_in_4326("/tmp/out.parquet")
+    assert output_stays_in_4326("/tmp/out.PMTiles")
+    assert output_stays_in_4326("/tmp/out.mbtiles")
+    assert not output_stays_in_4326("/tmp/out.gpkg")
+
+def test_vector_tile_zoom_range():
+    """Test tiling starts where the area fits in one tile"""
+    assert vector_tile_zoom_range((0, 0, 360 / 2 ** 8, 1)) == (8, 14)
+    assert vector_tile_zoom_range((-180, -90, 180, 90)) == (0, 14)
+    assert vector_tile_zoom_range((0, 0, 1e-6, 1e-6), max_zoom=12) == (12, 12)
+    assert vector_tile_zoom_range((0, 0, 1, 1), min_zoom=3) == (3, 14)
+
+@patch("duckdb.connect")
+def test_run_download_warm_only(mock_connect, tmp_path):
+    """Test a warm only job reads every column without creating a table or output"""
+    conn = MockConnection(row_count=7)
+    mock_connect.return_value = conn
+
+    result = run_download(make_job(tmp_path, warm_only=True))
+
+    assert result.status == "warmed"
+    assert result.row_count == 7
+    assert any("WHERE hash(source) IS NOT NULL" in q for q in conn.executed_queries)
+    assert not any("CREATE TABLE" in q or "COPY" in q for q in conn.executed_queries)
+
+@patch("duckdb.connect")
+def test_run_download_empty(mock_connect, tmp_path):
+    """Test an empty result is reported without writing a file"""
+    conn = MockConnection(row_count=0)
+    mock_connect.return_value = conn
+
+    result = run_download(make_job(tmp_path))
+
+    assert result.status == "empty"
+    assert "No data found" in result.message
+    assert not any(q.strip().startswith("COPY") for q in conn.executed_queries)
+
+@patch("duckdb.connect")
+def test_run_download_cancelled(mock_connect, tmp_path):
+    """Test a cancelled job stops before writing any output"""
+    conn = MockConnection()
+    mock_connect.return_value = conn
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    result = run_download(make_job(tmp_path), cancel_event=cancel_event)
+
+    assert result.status == "cancelled"
+    assert not any("COPY" in q for q in conn.executed_queries)
+
+@patch("duckdb.connect")
+def test_row_consumer_receives_small_results(mock_connect, tmp_path):
+    """Test results under the memory row limit go to the row consumer"""
+    mock_connect.return_value = MockConnection()
+    consumer = MagicMock(return_value="layer")
+
+    result = DownloadEngine(
+        make_job(tmp_path, memory_layer_max_rows=10), row_consumer=consumer
+    ).run()
+
+    assert result.status == "memory"
+    assert result.layer == "layer"
+    assert "output.gpkg was not written" in result.message
+    consumer.assert_called_once()
+
+@patch("duckdb.connect")
+def test_rows_counted_before_download(mock_connect, tmp_path):
+    """Test the rows are counted before collecting them, and large results are written"""
+    conn = MockConnection(row_count=11)
+    mock_connect.return_value = conn
+    consumer = MagicMock(return_value="layer")
+
+    result = DownloadEngine(
+        make_job(tmp_path, memory_layer_max_rows=10), row_consumer=consumer
+    ).run()
+
+    assert result.status == "written"
+    consumer.assert_not_called()
+    count = next(i for i, q in enumerate(conn.executed_queries) if "LIMIT 11" in q)
+    create = next(i for i, q in enumerate(conn.executed_queries) if "CREATE TABLE download_data" in q)
+    assert count < create
+
+@patch("duckdb.connect")
+def test_run_download_per_aoi_outputs(mock_connect, tmp_path):
+    """Test many areas of interest share one scan and get one output each"""
+    conn = MockConnection(aoi_ids=["north", "south"])
+    mock_connect.return_value = conn
+    aois = [
+        ("north", "POLYGON((1 3, 3 3, 3 4, 1 4, 1 3))"),
+        ("south", "POLYGON((1 2, 3 2, 3 3, 1 3, 1 2))"),
+    ]
+
+    result = run_download(make_job(tmp_path, aois=aois))
+
+    assert result.status == "per_aoi"
+    assert result.outputs == {
+        "north": str(tmp_path / "output_north.gpkg"),
+        "south": str(tmp_path / "output_south.gpkg"),
+    }
+    assert sum("read_parquet" in q for q in conn.executed_queries if "CREATE" in q) == 1
+    assert any("JOIN download_aois" in q for q in conn.executed_queries)
+    assert sum(q.strip().startswith("COPY") for q in conn.executed_queries) == 2
+
+@patch("duckdb.connect")
+def test_run_download_per_aoi_duckdb_tables(mock_connect, tmp_path):
+    """Test areas of interest become tables of the one DuckDB workspace"""
+    conn = MockConnection(aoi_ids=["north", "south"])
+    mock_connect.return_value = conn
+    aois = [
+        ("north", "POLYGON((1 3, 3 3, 3 4, 1 4, 1 3))"),
+        ("south", "POLYGON((1 2, 3 2, 3 3, 1 3, 1 2))"),
+    ]
+
+    result = run_download(make_job(tmp_path, "workspace.duckdb", aois=aois))
+
+    assert result.status == "per_aoi"
+    assert result.outputs == {"north": "test_north", "south": "test_south"}
+    mock_connect.assert_called_once_with(str(tmp_path / "workspace.duckdb"))
+    assert "table of" in result.message
+
+def test_union_bbox_and_aoi_output_path():
+    """Test helpers for multi-AOI jobs"""
+    assert union_bbox([(0, 0, 1, 1), (-1, 0.5, 0.5, 2)]) == (-1, 0, 1, 2)
+    assert aoi_output_path("/tmp/out.parquet", "Site 3/a") == "/tmp/out_Site_3_a.parquet"
+
+@patch("duckdb.connect")
+def test_download_many_and_async(mock_connect, tmp_path):
+    """Test the parallel and asyncio entry points return engine results"""
+    mock_connect.side_effect = lambda *args: MockConnection()
+    jobs = [make_job(tmp_path, f"output_{i}.gpkg") for i in range(3)]
+
+    results = download_many(jobs, max_workers=2)
+    assert [r.status for r in results] == ["written"] * 3
+
+    result = asyncio.run(download_async(jobs[0]))
+    assert result.status == "written"
+
+def test_build_geo_metadata():
+    """Test GeoParquet 1.1 metadata always declares the bbox covering"""
+    metadata = build_geo_metadata("geometry", ["POLYGON", "MULTIPOLYGON"], False, [0, 1, 2, 3])
+
+    assert metadata["version"] == "1.1.0"
+    assert metadata["primary_column"] == "geometry"
+    column = metadata["columns"]["geometry"]
+    assert column["encoding"] == "WKB"
+    assert column["geometry_types"] == ["MultiPolygon", "Polygon"]
+    assert column["bbox"] == [0, 1, 2, 3]
+    assert column["covering"]["bbox"]["xmin"] == ["bbox", "xmin"]
+
+def test_requery_row_group_size():
+    """Test row group sizing for re-query optimized output stays within limits"""
+    assert requery_row_group_size(100) == 10000
+    assert requery_row_group_size(64 * 50000) == 50000
+    assert requery_row_group_size(10 ** 9) == 122880
+
+def test_duckdb_table_name():
+    """Test per-dataset DuckDB table names"""
+    assert duckdb_table_name("https://example.com/data/fields.parquet") == "fields"
+    assert duckdb_table_name(
+        "s3://overturemaps-us-west-2/release/2025-04-23.0/theme=base/type=land/*"
+    ) == "base_land"
+    assert duckdb_table_name("https://example.com/x.parquet", "Overture Base - Land") == "overture_base_land"
+    assert duckdb_table_name("https://example.com/2024.parquet") == "dataset_2024"
+
+def test_duckdb_workspace_append_twice(tmp_path):
+    """Test appending Overture-like data with a bbox struct to a workspace twice"""
+    import duckdb
+
+    source = str(tmp_path / "source.parquet").replace("\\", "/")
+    conn = duckdb.connect(str(tmp_path / "workspace.duckdb"))
+    conn.execute(f"""
+        COPY (
+            SELECT i AS id, struct_pack(xmin := i, ymin := i, xmax := i + 1, ymax := i + 1) AS bbox,
+                'POINT (' || i || ' ' || i || ')' AS geometry
+            FROM range(3) t(i)
+        ) TO '{source}' (FORMAT PARQUET)
+    """)
+    engine = DownloadEngine(DownloadJob(
+        dataset_url="https://example.com/overture/places.parquet",
+        bbox=(0, 0, 5, 5),
+        output_file=str(tmp_path / "workspace.duckdb"),
+    ))
+    schema = conn.execute(f"DESCRIBE SELECT * FROM read_parquet('{source}')").fetchall()
+
+    for _ in range(2):
+        conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE download_data AS
+            {engine.build_select(schema, "geometry")} FROM read_parquet('{source}')
+        """)
+        table = engine.merge_into_workspace(conn, "geometry")
+
+    columns = {row[0]: row[1] for row in conn.execute(f'DESCRIBE "{table}"').fetchall()}
+    assert list(columns) == ["id", "bbox", "geometry"]
+    assert columns["bbox"].startswith("STRUCT")
+    # Rows sharing an id with the second download were replaced
+    assert conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] == 3
+    conn.close()
+
+def test_rounding_after_reprojection_quantizes_output():
+    """Test a real DuckDB run writes coordinates rounded in the output CRS"""
+    import duckdb
+
+    conn = duckdb.connect()
+    try:
+        conn.execute("INSTALL spatial; LOAD spatial;")
+    except duckdb.Error as e:
+        conn.close()
+        pytest.skip(f"The spatial extension is not available: {e}")
+    engine = DownloadEngine(DownloadJob(
+        dataset_url="https://example.com/test.parquet",
+        bbox=(1, 2, 3, 4),
+        output_file="output.gpkg",
+        target_crs="EPSG:3857",
+        precision_decimals=2,
+    ))
+    query = engine.build_generalize_query(
+        "SELECT ST_Point(1.23456789, 2.3456789) AS geometry", "geometry"
+    )
+
+    x, y = conn.execute(f"SELECT ST_X(geometry), ST_Y(geometry) FROM ({query})").fetchone()
+    conn.close()
+    # Web Mercator meters, not degrees, rounded to centimeters
+    assert x > 1000
+    assert abs(x * 100 - round(x * 100)) < 1e-6
+    assert abs(y * 100 - round(y * 100)) < 1e-6
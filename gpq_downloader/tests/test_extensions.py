@@ -0,0 +1,52 @@
+import pytest
+from unittest.mock import MagicMock
+
+from gpq_downloader.extensions import load_extensions, reset_extension_cache
+
+@pytest.fixture(autouse=True)
+def fresh_extension_cache():
+    reset_extension_cache()
+    yield
+    reset_extension_cache()
+
+def executed(conn):
+    return [c.args[0] for c in conn.execute.call_args_list]
+
+def test_missing_extension_installed_once_per_session():
+    """Test a missing extension is installed once, later connections only LOAD it"""
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = []
+
+    load_extensions(conn, ("spatial",))
+    assert "INSTALL spatial;" in executed(conn)
+    assert "LOAD spatial;" in executed(conn)
+
+    second_conn = MagicMock()
+    load_extensions(second_conn, ("spatial",))
+    assert executed(second_conn) == ["LOAD spatial;"]
+
+def test_installed_extension_only_loaded():
+    """Test extensions already in the local extension directory are not reinstalled"""
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = [("spatial", True)]
+
+    load_extensions(conn, ("spatial",))
+    assert not any(query.startswith("INSTALL") for query in executed(conn))
+    assert "LOAD spatial;" in executed(conn)
+
+def test_install_from_local_repository():
+    """Test a configured local repository is used for installs"""
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = []
+
+    load_extensions(conn, ("httpfs",), repository="/opt/duckdb_extensions")
+    assert "INSTALL httpfs FROM '/opt/duckdb_extensions';" in executed(conn)
+
+def test_install_community_extension():
+    """Test community extensions are installed from the community repository"""
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = []
+
+    load_extensions(conn, ("cache_httpfs",))
+    assert "INSTALL cache_httpfs FROM community;" in executed(conn)
+    assert "LOAD cache_httpfs;" in executed(conn)
@@ -0,0 +1,98 @@
+from unittest.mock import MagicMock
+
+from gpq_downloader.engine import DownloadJob, DownloadResult
+from gpq_downloader.live_layer import (
+    LIVE_LAYER_MAX_ZOOM,
+    LiveLayer,
+    LiveTileTask,
+    TileCache,
+    TileReader,
+    tile_bbox,
+    tile_for_point,
+    tile_zoom,
+    tiles_for_bbox,
+)
+
+def test_tile_zoom_follows_view_width():
+    """Test tiles get smaller as the view zooms in, down to the maximum zoom"""
+    assert tile_zoom((0, 0, 360 / 2 ** 10, 1)) == 11
+    assert tile_zoom((0, 0, 0.5, 0.5)) < tile_zoom((0, 0, 0.1, 0.1))
+    assert tile_zoom((0, 0, 1e-7, 1e-7)) == LIVE_LAYER_MAX_ZOOM
+
+def test_tiles_cover_bbox():
+    """Test the tiles for a bbox cover it and contain their own corner points"""
+    bbox = (10.01, 50.01, 10.2, 50.1)
+    zoom = tile_zoom(bbox)
+    tiles = tiles_for_bbox(bbox, zoom)
+    bounds = [tile_bbox(key) for key in tiles]
+    assert min(b[0] for b in bounds) <= bbox[0]
+    assert min(b[1] for b in bounds) <= bbox[1]
+    assert max(b[2] for b in bounds) >= bbox[2]
+    assert max(b[3] for b in bounds) >= bbox[3]
+    for key in tiles:
+        xmin, ymin, _, _ = tile_bbox(key)
+        assert tile_for_point(xmin, ymin, zoom) == key
+
+def test_tile_cache_evicts_least_recently_used():
+    """Test the cache keeps the most recently used tiles"""
+    cache = TileCache(max_tiles=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    assert cache.get("a") == [1]
+    cache.put("c", [3])
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+def make_task():
+    job = DownloadJob(
+        dataset_url="https://example.com/test.parquet",
+        bbox=tile_bbox((12, 100, 200)),
+        output_file="live.parquet",
+        layer_name="test",
+    )
+    return LiveTileTask(job, TileReader([(12, 100, 200)]))
+
+def test_live_tile_task_cancel_interrupts_query(qgs_app):
+    """Test cancelling a tile read aborts the running DuckDB query"""
+    task = make_task()
+    conn = MagicMock()
+    task.engine.conn = conn
+
+    task.cancel()
+
+    assert task.cancel_event.is_set()
+    conn.interrupt.assert_called_once()
+
+def test_live_layer_remembers_columns_of_first_read(qgs_app):
+    """Test later tile reads reuse the columns found by the first one"""
+    live_layer = LiveLayer.__new__(LiveLayer)
+    live_layer.validation_results = {}
+    live_layer.cache = TileCache()
+    live_layer.layer = None
+    live_layer.task = None
+    live_layer.visible_tiles = []
+    task = make_task()
+    task.result = DownloadResult(status="empty", bbox_column="bbox", geometry_column="geometry")
+
+    live_layer.tiles_loaded(task)
+
+    assert live_layer.validation_results == {"bbox_column": "bbox", "geometry_column": "geometry"}
+
+def test_live_layer_says_once_to_zoom_in(qgs_app):
+    """Test panning while zoomed out doesn't repeat the zoom in message"""
+    live_layer = LiveLayer.__new__(LiveLayer)
+    live_layer.iface = MagicMock()
+    live_layer.layer_name = "test"
+    live_layer.layer = None
+    live_layer.zoomed_out = False
+    live_layer.current_bbox = lambda: (-180.0, -90.0, 180.0, 90.0)
+
+    live_layer.refresh()
+    live_layer.refresh()
+    assert live_layer.iface.messageBar().pushInfo.call_count == 1
+
+    # Zooming in and out again shows it again
+    live_layer.zoomed_out = False
+    live_layer.refresh()
+    assert live_layer.iface.messageBar().pushInfo.call_count == 2
@@ -0,0 +1,207 @@
+import json
+
+from gpq_downloader.engine import DownloadEngine, DownloadJob
+from gpq_downloader.planner import (
+    PlanCache,
+    best_strategy,
+    estimate_area_bytes,
+    plan_filter,
+    sample_files,
+)
+
+SCHEMA = [
+    ("id", "INTEGER", "YES", None, None, None),
+    ("bbox", "STRUCT(xmin DOUBLE, ymin DOUBLE, xmax DOUBLE, ymax DOUBLE)", "YES", None, None, None),
+    ("geometry", "GEOMETRY", "YES", None, None, None),
+]
+SCHEMA_NO_BBOX = [SCHEMA[0], SCHEMA[2]]
+
+class MockResult:
+    def __init__(self, data):
+        self.data = data
+
+    def fetchall(self):
+        return self.data
+
+    def fetchone(self):
+        return self.data[0] if self.data else None
+
+class MetadataConnection:
+    """Answers Parquet metadata queries and records all queries"""
+
+    def __init__(self, xmin_stats=(), geo_stats=None, geo_metadata=None):
+        self.xmin_stats = xmin_stats
+        self.geo_stats = geo_stats
+        self.geo_metadata = geo_metadata
+        self.executed_queries = []
+
+    def execute(self, query, *args):
+        self.executed_queries.append(query)
+        if "parquet_kv_metadata" in query:
+            if self.geo_metadata:
+                return MockResult([(b"geo", json.dumps(self.geo_metadata).encode())])
+            return MockResult([])
+        elif "geo_bbox" in query:
+            if self.geo_stats is None:
+                raise RuntimeError("Binder Error: column geo_bbox not found")
+            return MockResult(self.geo_stats)
+        elif "parquet_metadata" in query:
+            return MockResult([(str(low), str(high)) for low, high in self.xmin_stats])
+        return MockResult([])
+
+def make_job(**kwargs):
+    return DownloadJob(
+        dataset_url="https://example.com/test.parquet",
+        bbox=(1, 2, 3, 4),
+        output_file="output.parquet",
+        **kwargs,
+    )
+
+def test_plan_clustered_row_groups():
+    """Test spatially sorted row groups put the bbox strategy first"""
+    conn = MetadataConnection(
+        xmin_stats=[(0, 10), (10, 20), (20, 30)], geo_stats=[({"xmin": 0},), ({"xmin": 5},)]
+    )
+    plan = plan_filter(conn, "test.parquet", SCHEMA, make_job(), "geometry")
+    assert plan.strategy == "bbox"
+    assert plan.clustered
+    assert plan.filter_bbox_column == "bbox"
+    assert plan.candidates == ["bbox", "geometry_stats", "geometry"]
+
+def test_plan_unsorted_row_groups():
+    """Test geometry statistics are expected to beat a bbox column that can't prune"""
+    conn = MetadataConnection(
+        xmin_stats=[(0, 29), (1, 30)], geo_stats=[({"xmin": 0},), ({"xmin": 5},)]
+    )
+    plan = plan_filter(conn, "test.parquet", SCHEMA, make_job(), "geometry")
+    assert plan.strategy == "geometry_stats"
+    assert not plan.clustered
+    assert plan.candidates == ["geometry_stats", "bbox", "geometry"]
+
+def test_plan_covering_metadata_bbox_column():
+    """Test a bbox column named in the GeoParquet covering metadata is used"""
+    schema = [
+        SCHEMA[0],
+        ("geometry_bbox", SCHEMA[1][1], "YES", None, None, None),
+        SCHEMA[2],
+    ]
+    geo = {"columns": {"geometry": {"covering": {"bbox": {"xmin": ["geometry_bbox", "xmin"]}}}}}
+    conn = MetadataConnection(geo_metadata=geo)
+    plan = plan_filter(conn, "test.parquet", schema, make_job(), "geometry")
+    assert plan.strategy == "bbox"
+    assert plan.bbox_column == "geometry_bbox"
+
+def test_plan_without_bbox_column():
+    """Test geometry statistics are preferred over a full geometry test"""
+    conn = MetadataConnection(geo_stats=[({"xmin": 0},), ({"xmin": 5},)])
+    plan = plan_filter(conn, "test.parquet", SCHEMA_NO_BBOX, make_job(), "geometry")
+    assert plan.strategy == "geometry_stats"
+    assert plan.filter_bbox_column is None
+
+    conn = MetadataConnection()
+    plan = plan_filter(conn, "test.parquet", SCHEMA_NO_BBOX, make_job(), "geometry")
+    assert plan.strategy == "geometry"
+
+def test_plan_cache_reuses_plan(tmp_path):
+    """Test a recorded plan is reused without probing the dataset again"""
+    cache = PlanCache(str(tmp_path / "plans.json"))
+    conn = MetadataConnection(xmin_stats=[(0, 10), (10, 20)])
+    plan = plan_filter(conn, "test.parquet", SCHEMA, make_job(), "geometry", cache)
+    cache.record("https://example.com/test.parquet", plan, 2.0, 100)
+
+    conn = MetadataConnection()
+    cached_plan = plan_filter(conn, "test.parquet", SCHEMA, make_job(), "geometry", cache)
+    assert cached_plan.cached
+    assert cached_plan.strategy == "bbox"
+    assert cached_plan.clustered
+    assert not any("parquet_metadata" in q for q in conn.executed_queries)
+
+    # A schema without the cached bbox column needs a new plan
+    cached_plan = plan_filter(conn, "test.parquet", SCHEMA_NO_BBOX, make_job(), "geometry", cache)
+    assert not cached_plan.cached
+
+def test_best_strategy_uses_measured_cost():
+    """Test every candidate but the exact test is measured once, then the cheapest wins"""
+    candidates = ["bbox", "geometry_stats", "geometry"]
+    assert best_strategy(candidates, {}) == "bbox"
+    costs = {"bbox": {"seconds": 10.0, "rows": 100, "runs": 1}}
+    assert best_strategy(candidates, costs) == "geometry_stats"
+    costs["geometry_stats"] = {"seconds": 1.0, "rows": 100, "runs": 1}
+    assert best_strategy(candidates, costs) == "geometry_stats"
+    costs["geometry_stats"]["seconds"] = 100.0
+    assert best_strategy(candidates, costs) == "bbox"
+    assert best_strategy(["geometry"], {}) == "geometry"
+
+def test_plan_cache_measures_other_candidates(tmp_path):
+    """Test the download after a recorded one tries the next supported strategy"""
+    cache = PlanCache(str(tmp_path / "plans.json"))
+    conn = MetadataConnection(
+        xmin_stats=[(0, 10), (10, 20)], geo_stats=[({"xmin": 0},), ({"xmin": 5},)]
+    )
+    plan = plan_filter(conn, "test.parquet", SCHEMA, make_job(), "geometry", cache)
+    cache.record("https://example.com/test.parquet", plan, 2.0, 100)
+
+    plan = plan_filter(conn, "test.parquet", SCHEMA, make_job(), "geometry", cache)
+    assert plan.strategy == "geometry_stats"
+    assert plan.filter_bbox_column is None
+
+def test_plan_cache_ignores_old_strategies(tmp_path):
+    """Test cached plans naming strategies that no longer exist are probed again"""
+    cache = PlanCache(str(tmp_path / "plans.json"))
+    (tmp_path / "plans.json").write_text(json.dumps({"https://example.com/test.parquet": {
+        "geometry_column": "geometry",
+        "bbox_column": "bbox",
+        "candidates": ["row_group_bbox", "bbox", "geometry"],
+        "costs": {},
+    }}))
+    plan = plan_filter(MetadataConnection(), "test.parquet", SCHEMA, make_job(), "geometry", cache)
+    assert not plan.cached
+    assert plan.strategy == "bbox"
+
+def test_plan_requested_strategy():
+    """Test a job can ask for a supported strategy, and unsupported ones are ignored"""
+    conn = MetadataConnection()
+    plan = plan_filter(
+        conn, "test.parquet", SCHEMA, make_job(filter_strategy="geometry"), "geometry"
+    )
+    assert plan.strategy == "geometry"
+
+    plan = plan_filter(
+        conn, "test.parquet", SCHEMA, make_job(filter_strategy="geometry_stats"), "geometry"
+    )
+    assert plan.strategy == "bbox"
+
+def test_geometry_stats_where_clause():
+    """Test the geometry statistics strategy adds a prunable extent test"""
+    engine = DownloadEngine(make_job())
+    where = engine.build_where(None, "geometry", "geometry_stats")
+    assert 'ST_Intersects_Extent("geometry", ST_MakeEnvelope(1, 2, 3, 4))' in where
+    assert "ST_GeomFromText" in where
+
+def test_estimate_area_bytes(tmp_path):
+    """Test real Parquet footers give the size of the row groups in an area"""
+    import duckdb
+
+    conn = duckdb.connect()
+    for part in range(2):
+        path = str(tmp_path / f"part_{part}.parquet").replace("\\", "/")
+        conn.execute(f"""
+            COPY (
+                SELECT i AS id, 'name ' || i AS name,
+                    struct_pack(xmin := i + {part * 100}, ymin := 0, xmax := i + {part * 100} + 1, ymax := 1) AS bbox
+                FROM range(100) t(i) ORDER BY i
+            ) TO '{path}' (FORMAT PARQUET)
+        """)
+    url = str(tmp_path / "*.parquet").replace("\\", "/")
+
+    files, file_count = sample_files(conn, url)
+    assert file_count == 2
+    compressed, uncompressed = estimate_area_bytes(conn, url, (0, 0, 300, 1), "bbox")
+    area_compressed, area_uncompressed = estimate_area_bytes(conn, url, (0, 0, 10, 1), "bbox")
+    # Each file is one row group, only the first overlaps the small area
+    assert area_uncompressed == uncompressed / 2
+    assert 0 < area_compressed < compressed
+    id_only, _ = estimate_area_bytes(conn, url, (0, 0, 300, 1), "bbox", columns=["id"])
+    assert 0 < id_only < compressed
+    assert estimate_area_bytes(conn, url, (0, 0, 10, 1), None) is None
+    conn.close()
@@ -2,7 +2,7 @@ import pytest
 import datetime
 from unittest.mock import MagicMock, patch, call
 from qgis.PyQt.QtWidgets import QAction, QProgressDialog, QMessageBox, QFileDialog, QDialog, QVBoxLayout, QLabel
-from qgis.core import QgsProject, QgsVectorLayer, QgsSettings, QgsCoordinateReferenceSystem, QgsRectangle
+from qgis.core import QgsApplication, QgsProject, QgsVectorLayer, QgsSettings, QgsCoordinateReferenceSystem, QgsRectangle
 from pathlib import Path
 from pytestqt import qtbot
 
@@ -49,6 +49,7 @@ def test_plugin_run_with_download(mock_dialog, mock_save_dialog, mock_settings,
     dialog_instance.exec.return_value = QDialog.Accepted
     dialog_instance.get_urls.return_value = ["https://example.com/test.parquet?theme=buildings"]
     dialog_instance.overture_radio.isChecked.return_value = True
+    dialog_instance.live_layer_checkbox.isChecked.return_value = False
     mock_dialog.return_value = dialog_instance
     
     # Setup mock save dialog
@@ -69,6 +70,27 @@ def test_plugin_run_with_download(mock_dialog, mock_save_dialog, mock_settings,
     
     mock_save_dialog.assert_called_once()
 
+@patch('gpq_downloader.plugin.QFileDialog.getSaveFileName')
+@patch('gpq_downloader.plugin.DataSourceDialog')
+def test_plugin_run_live_layer(mock_dialog, mock_save_dialog, qgs_app, mock_iface):
+    """Test browsing as a live layer adds live layers without asking for a file"""
+    plugin = QgisPluginGeoParquet(mock_iface)
+
+    dialog_instance = MagicMock()
+    dialog_instance.exec.return_value = QDialog.Accepted
+    dialog_instance.get_urls.return_value = ["https://example.com/a.parquet", "https://example.com/b.parquet"]
+    dialog_instance.download_area.return_value = "extent"
+    dialog_instance.live_layer_checkbox.isChecked.return_value = True
+    mock_dialog.return_value = dialog_instance
+
+    with patch('gpq_downloader.live_layer.LiveLayer') as mock_live_layer:
+        plugin.run()
+
+    mock_save_dialog.assert_not_called()
+    assert mock_live_layer.call_count == 2
+    assert len(plugin.live_layers) == 2
+    mock_live_layer.return_value.start.assert_called()
+
 def test_plugin_handle_error(qgs_app, mock_iface):
     """Test error handling"""
     plugin = QgisPluginGeoParquet(mock_iface)
@@ -109,6 +131,7 @@ def test_plugin_load_layer_success(mock_vector_layer, qgs_app, mock_iface):
     # Setup mock layer
     mock_layer = MagicMock()
     mock_layer.isValid.return_value = True
+    mock_layer.featureCount.return_value = 10
     mock_vector_layer.return_value = mock_layer
     
     # Setup mock project
@@ -117,6 +140,8 @@ def test_plugin_load_layer_success(mock_vector_layer, qgs_app, mock_iface):
     with patch('gpq_downloader.plugin.QgsProject.instance', return_value=mock_project):
         plugin.load_layer("test.gpkg")
         mock_project.addMapLayer.assert_called_once_with(mock_layer)
+    # The file is opened once
+    mock_vector_layer.assert_called_once_with("test.gpkg", "test", "ogr")
 
 @patch('gpq_downloader.plugin.QgsVectorLayer')
 def test_plugin_load_layer_invalid(mock_vector_layer, qgs_app, mock_iface):
@@ -134,6 +159,19 @@ def test_plugin_load_layer_invalid(mock_vector_layer, qgs_app, mock_iface):
         assert mock_critical.call_args[0][0] == mock_iface.mainWindow()
         assert mock_critical.call_args[0][1] == "Error" or "test.gpkg" in mock_critical.call_args[0][1]
 
+def test_plugin_add_memory_layer(qgs_app, mock_iface):
+    """Test adding a temporary layer from direct-to-layer downloads"""
+    plugin = QgisPluginGeoParquet(mock_iface)
+    mock_layer = MagicMock()
+    mock_layer.isValid.return_value = True
+    mock_project = MagicMock()
+
+    with patch('gpq_downloader.plugin.QgsProject.instance', return_value=mock_project):
+        plugin.add_memory_layer(mock_layer, "1 features were loaded into a temporary layer")
+        mock_project.addMapLayer.assert_called_once_with(mock_layer)
+    # Users are told that the file they chose wasn't written
+    mock_iface.messageBar().pushInfo.assert_called_once()
+
 def test_plugin_show_info(qgs_app, mock_iface):
     """Test info message display"""
     plugin = QgisPluginGeoParquet(mock_iface)
@@ -166,6 +204,21 @@ def test_plugin_init_gui(qgs_app, mock_iface):
     assert len(mock_iface.toolbar_icons) == 1
     assert mock_iface.toolbar_icons[0] == plugin.action
 
+def test_plugin_init_processing_without_gui(qgs_app, mock_iface):
+    """Test qgis_process can register the Processing provider without initGui"""
+    plugin = QgisPluginGeoParquet(mock_iface)
+    plugin.initProcessing()
+    try:
+        assert plugin.action is None
+        assert QgsApplication.processingRegistry().providerById("gpq_downloader") is plugin.provider
+        # initGui after initProcessing keeps the registered provider
+        provider = plugin.provider
+        plugin.initGui()
+        assert plugin.provider is provider
+    finally:
+        plugin.unload()
+    assert QgsApplication.processingRegistry().providerById("gpq_downloader") is None
+
 def test_plugin_unload(qgs_app, mock_iface):
     """Test plugin unload"""
     plugin = QgisPluginGeoParquet(mock_iface)
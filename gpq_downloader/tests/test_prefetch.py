@@ -0,0 +1,56 @@
+from unittest.mock import MagicMock, patch
+
+from gpq_downloader.engine import DownloadResult
+from gpq_downloader.prefetch import PrefetchTask, neighbour_bboxes, prefetch_job
+
+def test_neighbour_bboxes_follow_pan_direction():
+    """Test the tiles around the view come first in the direction of the last pan"""
+    tiles = neighbour_bboxes((0, 0, 1, 1), direction=(1.0, 0.0))
+    assert len(tiles) == 8
+    assert tiles[0] == (1, 0, 2, 1)
+    assert (0, 0, 1, 1) not in tiles
+    assert all(tile[0] < 1 for tile in tiles[-3:])
+
+def test_neighbour_bboxes_clamped():
+    """Test tiles beyond the edge of the world are cut or dropped"""
+    tiles = neighbour_bboxes((170, 80, 180, 90))
+    assert all(tile[2] <= 180 and tile[3] <= 90 for tile in tiles)
+    assert len(tiles) == 3
+
+def test_prefetch_job(qgs_app, tmp_path):
+    """Test prefetch jobs read at low concurrency into the range cache without writing"""
+    job = prefetch_job(
+        "s3://bucket/data/*", (0, 0, 1, 1), {"bbox_column": "bbox"}, str(tmp_path), 512
+    )
+    assert job.range_cache == str(tmp_path)
+    assert job.max_threads == 1
+    assert job.retries == 0
+    assert job.bbox_column == "bbox"
+    assert job.warm_only
+
+@patch("gpq_downloader.prefetch.range_cache_size")
+@patch("gpq_downloader.prefetch.DownloadEngine")
+def test_prefetch_task_stops_at_budget(mock_engine, mock_cache_size, qgs_app, tmp_path):
+    """Test the task reads tiles in order and stops once the byte budget is spent"""
+    mock_engine.return_value.run.return_value = DownloadResult(status="warmed")
+    mb = 1024 * 1024
+    mock_cache_size.side_effect = [0, 10 * mb, 300 * mb, 400 * mb]
+    jobs = [
+        (("url", index), MagicMock(range_cache=str(tmp_path)))
+        for index in range(3)
+    ]
+
+    task = PrefetchTask(jobs, max_mb=256)
+    assert task.run()
+    assert task.completed == [("url", 0), ("url", 1)]
+    assert mock_engine.call_count == 2
+
+def test_prefetch_task_cancel_interrupts_query(qgs_app, tmp_path):
+    """Test cancelling the task aborts the tile read that is running"""
+    task = PrefetchTask([(("url", 0), MagicMock(range_cache=str(tmp_path)))], max_mb=256)
+    task.engine = MagicMock()
+
+    task.cancel()
+
+    assert task.cancel_event.is_set()
+    task.engine.interrupt.assert_called_once()
@@ -0,0 +1,83 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from qgis.core import (
+    NULL,
+    QgsApplication,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsProcessingContext,
+    QgsProcessingFeedback,
+    QgsProject,
+)
+from qgis.PyQt.QtCore import QVariant
+
+from gpq_downloader.engine import DownloadResult
+from gpq_downloader.processing_provider import (
+    DownloadGeoParquetAlgorithm,
+    GeoParquetProvider,
+    aoi_id,
+    preset_dataset_options,
+)
+
+def test_preset_dataset_options():
+    """Test every preset dataset and base subtype gets its own option"""
+    options = dict(preset_dataset_options())
+    assert any(url.endswith("theme=base/type=land/*") for url in options.values())
+    assert all("{" not in url for url in options.values())
+
+def test_provider_registers_algorithm(qgs_app):
+    """Test the provider loads the download algorithm"""
+    provider = GeoParquetProvider()
+    assert QgsApplication.processingRegistry().addProvider(provider)
+    try:
+        algorithm = QgsApplication.processingRegistry().algorithmById("gpq_downloader:download")
+        assert algorithm is not None
+        assert algorithm.parameterDefinition("OUTPUT") is not None
+    finally:
+        QgsApplication.processingRegistry().removeProvider(provider)
+
+@patch("gpq_downloader.engine.run_download")
+def test_algorithm_runs_engine_job(mock_run_download, qgs_app, tmp_path):
+    """Test the algorithm turns its parameters into an engine job"""
+    mock_run_download.return_value = DownloadResult(
+        status="written", output=str(tmp_path / "out.parquet"), row_count=42
+    )
+    algorithm = DownloadGeoParquetAlgorithm()
+    algorithm.initAlgorithm()
+    context = QgsProcessingContext()
+    context.setProject(QgsProject.instance())
+
+    results = algorithm.processAlgorithm(
+        {
+            "DATASET": len(algorithm.dataset_options),
+            "URL": "https://example.com/test.parquet",
+            "EXTENT": "1,3,2,4 [EPSG:4326]",
+            "COLUMNS": "id, name",
+            "FILTER": "height > 10",
+            "OUTPUT": str(tmp_path / "out.parquet"),
+        },
+        context,
+        QgsProcessingFeedback(),
+    )
+
+    job = mock_run_download.call_args[0][0]
+    assert job.dataset_url == "https://example.com/test.parquet"
+    assert job.bbox == (1, 2, 3, 4)
+    assert job.columns == ["id", "name"]
+    assert job.filters == ["height > 10"]
+    assert results["ROW_COUNT"] == 42
+
+def test_aoi_id_falls_back_to_feature_id(qgs_app):
+    """Test areas with a NULL or empty id are named after their feature id"""
+    fields = QgsFields()
+    fields.append(QgsField("name", QVariant.String))
+    feature = QgsFeature(fields, 7)
+    feature.setAttributes(["north"])
+    assert aoi_id(feature, ["name"]) == "north"
+    assert aoi_id(feature, []) == "7"
+
+    feature.setAttributes([NULL])
+    assert aoi_id(feature, ["name"]) == "7"
+    feature.setAttributes([""])
+    assert aoi_id(feature, ["name"]) == "7"
@@ -0,0 +1,54 @@
+import os
+import pytest
+from unittest.mock import MagicMock
+
+from gpq_downloader.extensions import reset_extension_cache
+from gpq_downloader.range_cache import (
+    clear_range_cache,
+    enable_range_cache,
+    prune_range_cache,
+    range_cache_size,
+)
+
+@pytest.fixture(autouse=True)
+def fresh_extension_cache():
+    reset_extension_cache()
+    yield
+    reset_extension_cache()
+
+def write_block(path, size, last_used):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (last_used, last_used))
+
+def test_enable_range_cache(tmp_path):
+    """Test the cache extension is loaded and pointed at the cache folder"""
+    conn = MagicMock()
+    conn.execute.return_value.fetchall.return_value = [("cache_httpfs", True)]
+
+    assert enable_range_cache(conn, str(tmp_path / "cache"))
+    queries = [c.args[0] for c in conn.execute.call_args_list]
+    assert "LOAD cache_httpfs;" in queries
+    assert "SET cache_httpfs_type='on_disk';" in queries
+    assert f"SET cache_httpfs_cache_directory='{tmp_path / 'cache'}';" in queries
+
+def test_enable_range_cache_without_extension(tmp_path):
+    """Test downloads carry on from the network when the extension can't be installed"""
+    conn = MagicMock()
+    conn.execute.side_effect = Exception("Failed to download extension")
+    assert not enable_range_cache(conn, str(tmp_path / "cache"))
+
+def test_prune_range_cache_drops_least_recently_used(tmp_path):
+    """Test pruning removes the oldest blocks until the cache fits"""
+    mb = 1024 * 1024
+    write_block(tmp_path / "a" / "old", mb, 1000)
+    write_block(tmp_path / "b" / "recent", mb, 3000)
+    write_block(tmp_path / "a" / "middle", mb, 2000)
+
+    assert prune_range_cache(str(tmp_path), 2) == mb
+    assert not (tmp_path / "a" / "old").exists()
+    assert (tmp_path / "a" / "middle").exists()
+    assert range_cache_size(str(tmp_path)) == 2 * mb
+
+    clear_range_cache(str(tmp_path))
+    assert range_cache_size(str(tmp_path)) == 0
@@ -0,0 +1,40 @@
+import pytest
+
+from gpq_downloader import registry
+from gpq_downloader.registry import (
+    get_formats,
+    get_presets,
+    validate_formats,
+    validate_presets,
+)
+
+def test_presets_loaded_once():
+    """Test presets.json is parsed once and shared"""
+    registry.clear_cache()
+    presets = get_presets()
+    assert get_presets() is presets
+    assert "overture" in presets
+
+def test_formats_loaded_once():
+    """Test formats.json is parsed once and shared"""
+    registry.clear_cache()
+    formats = get_formats()
+    assert get_formats() is formats
+    assert formats["GeoParquet (*.parquet)"]["extension"] == ".parquet"
+
+def test_validate_presets_rejects_missing_url():
+    """Test preset validation catches datasets without a URL"""
+    with pytest.raises(ValueError):
+        validate_presets({"custom": {"broken": {"display_name": "No URL"}}})
+
+def test_validate_formats_rejects_bad_default_profile():
+    """Test format validation catches an unknown default compression profile"""
+    with pytest.raises(ValueError):
+        validate_formats({
+            "GeoParquet (*.parquet)": {
+                "extension": ".parquet",
+                "format_options": "(FORMAT 'parquet')",
+                "compression_profiles": {"fast": {}},
+                "default_compression_profile": "missing",
+            }
+        })
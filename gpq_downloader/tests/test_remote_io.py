@@ -0,0 +1,104 @@
+import json
+from unittest.mock import MagicMock
+
+from gpq_downloader.remote_io import (
+    MAX_THREADS,
+    MIN_THREADS,
+    THREADS_STEP,
+    RemoteTuning,
+    host_key,
+    infer_s3_region,
+    is_http_error,
+    percentile,
+)
+
+URL = "s3://overturemaps-us-west-2/release/2025-04-23.0/theme=buildings/type=building/*"
+
+def test_host_key():
+    """Test remote URLs are keyed by scheme and host, local paths are not tuned"""
+    assert host_key(URL) == "s3://overturemaps-us-west-2"
+    assert host_key("https://data.source.coop/a/b.parquet") == "https://data.source.coop"
+    assert host_key("/tmp/data.parquet") is None
+
+def test_infer_s3_region():
+    """Test regions are read from bucket and host names"""
+    assert infer_s3_region(URL) == "us-west-2"
+    assert infer_s3_region("https://us-west-2.opendata.source.coop/x.parquet") == "us-west-2"
+    assert infer_s3_region("s3://my-bucket/x.parquet") is None
+
+def test_is_http_error():
+    """Test request failures are told apart from other errors"""
+    assert is_http_error(Exception("HTTP Error: HTTP GET error on 'x' (HTTP 503)"))
+    assert is_http_error(Exception("HTTP Error: HTTP GET error on 'x' (HTTP 429)"))
+    assert is_http_error(Exception("IO Error: SlowDown: Please reduce your request rate"))
+    assert is_http_error(Exception("IO Error: Connection reset by peer"))
+    assert is_http_error(Exception("HTTP Error: Request timed out"))
+    assert not is_http_error(Exception("HTTP Error: HTTP GET error on 'x' (HTTP 404)"))
+    assert not is_http_error(Exception("HTTP Error: HTTP GET error on 'x' (HTTP 403)"))
+    assert not is_http_error(Exception("Binder Error: column not found"))
+
+def test_configure_sets_httpfs_options(tmp_path):
+    """Test a remote connection gets the httpfs settings, region and thread count"""
+    conn = MagicMock()
+    threads = RemoteTuning(str(tmp_path / "tuning.json")).configure(conn, URL)
+    queries = [c.args[0] for c in conn.execute.call_args_list]
+    assert "SET http_keep_alive=true;" in queries
+    assert "SET s3_region='us-west-2';" in queries
+    assert f"SET threads={threads};" in queries
+
+    conn = MagicMock()
+    assert RemoteTuning(str(tmp_path / "tuning.json")).configure(conn, "/tmp/a.parquet") is None
+    conn.execute.assert_not_called()
+
+def test_aimd_controller(tmp_path):
+    """Test threads grow while throughput holds and are halved on request errors"""
+    path = tmp_path / "tuning.json"
+    tuning = RemoteTuning(str(path))
+    start = tuning.host_state(URL)["threads"]
+
+    tuning.record(URL, seconds=1.0, byte_count=64 * 1024 * 1024)
+    state = json.loads(path.read_text())["s3://overturemaps-us-west-2"]
+    assert state["threads"] == min(MAX_THREADS, start + THREADS_STEP)
+    assert state["best_threads"] == start
+
+    # A much slower run goes back to the best thread count found so far
+    tuning.record(URL, seconds=10.0, byte_count=64 * 1024 * 1024)
+    assert tuning.host_state(URL)["threads"] == start
+
+    tuning.record(URL, error=True)
+    state = tuning.host_state(URL)
+    assert state["threads"] == max(MIN_THREADS, start // 2)
+    assert state["errors"] == 1
+    assert state["runs"] == 3
+
+    # Runs of unknown size don't move the controller
+    tuning.record(URL, seconds=1.0, byte_count=0)
+    assert tuning.host_state(URL)["runs"] == 3
+
+def test_threads_capped_per_host(tmp_path):
+    """Test thread counts tuned under an older, higher cap are clamped"""
+    path = tmp_path / "tuning.json"
+    state = dict(RemoteTuning(str(path)).host_state(URL), threads=64, best_threads=64)
+    path.write_text(json.dumps({"s3://overturemaps-us-west-2": state}))
+
+    conn = MagicMock()
+    assert RemoteTuning(str(path)).configure(conn, URL) == MAX_THREADS
+    assert MAX_THREADS <= 16
+
+def test_http_timeout_follows_latency_p95(tmp_path):
+    """Test the request timeout is derived from recent metadata read times"""
+    tuning = RemoteTuning(str(tmp_path / "tuning.json"))
+    conn = MagicMock()
+    tuning.configure(conn, URL)
+    assert not any("http_timeout" in c.args[0] for c in conn.execute.call_args_list)
+
+    for seconds in (1.0, 1.5, 2.0, 2.5, 5.0):
+        tuning.record_latency(URL, seconds)
+    assert percentile([1.0, 1.5, 2.0, 2.5, 5.0], 0.95) == 5.0
+
+    conn = MagicMock()
+    tuning.configure(conn, URL)
+    assert "SET http_timeout=20;" in [c.args[0] for c in conn.execute.call_args_list]
+    stats = tuning.statistics(URL)
+    assert stats["p50"] == 2.0
+    assert "95th percentile" in tuning.describe(URL)
@@ -0,0 +1,63 @@
+import duckdb
+
+from gpq_downloader.spill import (
+    SPILL_SETTINGS,
+    detach_spill,
+    enable_spill,
+    estimate_area_mb,
+    is_out_of_memory,
+    remove_spill,
+)
+
+def write_parquet(conn, path, offset):
+    conn.execute(f"""
+        COPY (
+            SELECT i AS id, 'name ' || i AS name,
+                struct_pack(xmin := i + {offset}, ymin := 0, xmax := i + {offset} + 1, ymax := 1) AS bbox
+            FROM range(1000) t(i)
+        ) TO '{path}' (FORMAT PARQUET)
+    """)
+
+def test_estimate_area_mb(tmp_path):
+    """Test the estimate sums the row groups overlapping the area"""
+    conn = duckdb.connect()
+    for part in range(2):
+        write_parquet(conn, str(tmp_path / f"part_{part}.parquet").replace("\\", "/"), part * 1000)
+    url = str(tmp_path / "*.parquet").replace("\\", "/")
+
+    everything = estimate_area_mb(conn, url, (0, 0, 3000, 1), "bbox")
+    # Only the first file's row group overlaps
+    assert estimate_area_mb(conn, url, (0, 0, 10, 1), "bbox") == everything / 2
+    assert estimate_area_mb(conn, url, (0, 0, 10, 1), None) is None
+    assert estimate_area_mb(conn, str(tmp_path / "missing.parquet"), (0, 0, 10, 1), "bbox") is None
+    conn.close()
+
+def test_enable_spill(tmp_path):
+    """Test new tables go to an on-disk database that is removed afterwards"""
+    conn = duckdb.connect()
+    other = conn.cursor()
+    before = {
+        name: conn.execute(f"SELECT current_setting('{name}')").fetchone()[0]
+        for name in SPILL_SETTINGS
+    }
+
+    spill = enable_spill(conn, str(tmp_path))
+    conn.execute("CREATE TABLE download_data AS SELECT 1 AS id")
+    assert conn.execute("SELECT current_database()").fetchone()[0] == spill.alias
+    assert (tmp_path / spill.alias / "spill.duckdb").exists()
+    assert other.execute("SELECT current_setting('preserve_insertion_order')").fetchone()[0] is False
+
+    detach_spill(conn, spill)
+    assert conn.execute("SELECT current_database()").fetchone()[0] == "memory"
+    # The settings apply to the whole database, so other cursors get them back too
+    for name, value in before.items():
+        assert other.execute(f"SELECT current_setting('{name}')").fetchone()[0] == value
+
+    conn.close()
+    remove_spill(spill)
+    assert list(tmp_path.iterdir()) == []
+
+def test_is_out_of_memory():
+    """Test memory limit errors are told apart from other errors"""
+    assert is_out_of_memory(Exception("Out of Memory Error: failed to allocate data"))
+    assert not is_out_of_memory(Exception("HTTP Error: HTTP GET error (HTTP 503)"))
@@ -0,0 +1,51 @@
+import sys
+import threading
+
+import pytest
+
+from gpq_downloader.engine import DownloadJob, DownloadResult
+from gpq_downloader.subprocess_runner import (
+    job_from_json,
+    job_to_json,
+    result_from_json,
+    result_to_json,
+    run_in_subprocess,
+)
+
+def make_job(tmp_path, **kwargs):
+    return DownloadJob(
+        dataset_url=str(tmp_path / "missing.parquet"),
+        bbox=(1, 2, 3, 4),
+        output_file=str(tmp_path / "output.gpkg"),
+        **kwargs,
+    )
+
+def test_job_json_roundtrip(tmp_path):
+    """Test jobs survive the trip to the child process"""
+    job = make_job(tmp_path, aoi_wkb=b"\x01\x03", aois=[("a", "POINT(0 0)")], columns=["id"])
+    assert job_from_json(job_to_json(job)) == job
+
+def test_result_json_roundtrip():
+    """Test results come back from the child process without their layer"""
+    result = DownloadResult(
+        status="written", output="/tmp/out.gpkg", row_count=3,
+        schema=[("id", "INTEGER", "YES", None, None, None)], layer=object(),
+    )
+    decoded = result_from_json(result_to_json(result))
+    assert decoded.layer is None
+    assert decoded.schema == result.schema
+    assert decoded.row_count == 3
+
+def test_run_in_subprocess_reports_errors(tmp_path):
+    """Test errors in the child process are raised in the parent"""
+    messages = []
+    with pytest.raises(RuntimeError):
+        run_in_subprocess(make_job(tmp_path, retries=0), progress=messages.append, python=sys.executable)
+    assert messages
+
+def test_run_in_subprocess_cancelled(tmp_path):
+    """Test cancelling kills the child process"""
+    cancel_event = threading.Event()
+    cancel_event.set()
+    result = run_in_subprocess(make_job(tmp_path), cancel_event=cancel_event, python=sys.executable)
+    assert result.status == "cancelled"
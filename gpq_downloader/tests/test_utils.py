@@ -1,13 +1,16 @@
 import pytest
 from unittest.mock import MagicMock, patch
 import os
-from qgis.core import QgsRectangle, QgsCoordinateReferenceSystem
+from qgis.core import QgsRectangle, QgsCoordinateReferenceSystem, QgsFeature, QgsGeometry, QgsVectorLayer, QgsVectorSimplifyMethod
 from pathlib import Path
 
 from gpq_downloader.utils import (
     transform_bbox_to_4326, 
     Worker, 
-    ValidationWorker
+    ValidationWorker,
+    memory_layer_geometry_type,
+    optimize_loaded_layer,
+    selected_features_aoi,
 )
 
 # Add new test for file size estimation
@@ -220,4 +223,55 @@ def test_worker_error_handling(mock_connect, mock_iface, sample_bbox, tmp_path):
     worker.run()
     
     assert error_message is not None
-    assert "Test error" in error_message 
\ No newline at end of file
+    assert "Test error" in error_message
+
+def test_memory_layer_geometry_type():
+    """Test picking a memory layer geometry type from DuckDB geometry types"""
+    assert memory_layer_geometry_type(["POINT"]) == "Point"
+    assert memory_layer_geometry_type(["POLYGON", "MULTIPOLYGON"]) == "MultiPolygon"
+    assert memory_layer_geometry_type(["LINESTRING"], has_z=True) == "LineStringZ"
+
+    # Mixed base types can't share a memory layer
+    assert memory_layer_geometry_type(["POINT", "POLYGON"]) is None
+    assert memory_layer_geometry_type([]) is None
+    assert memory_layer_geometry_type(["GEOMETRYCOLLECTION"]) is None
+
+def test_selected_features_aoi(qgs_app):
+    """Test selected polygons become a single area of interest in EPSG:4326"""
+    layer = QgsVectorLayer("Polygon?crs=EPSG:4326", "aoi", "memory")
+    features = []
+    for wkt in ("POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))", "POLYGON((5 5, 6 5, 6 6, 5 6, 5 5))"):
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(wkt))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+
+    assert selected_features_aoi(layer) is None
+
+    layer.selectAll()
+    aoi = selected_features_aoi(layer)
+    assert aoi.isMultipart()
+    assert aoi.boundingBox() == QgsRectangle(0, 0, 6, 6)
+
+    assert selected_features_aoi(QgsVectorLayer("Point?crs=EPSG:4326", "points", "memory")) is None
+
+def test_optimize_loaded_layer(qgs_app):
+    """Test loaded layers get a spatial index, render simplification and a scale limit"""
+    layer = QgsVectorLayer("LineString?crs=EPSG:4326", "lines", "memory")
+    features = []
+    for i in range(3):
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromWkt(f"LINESTRING({i} 0, {i} 1)"))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+
+    with patch("gpq_downloader.utils.LARGE_LAYER_SCALE_LIMITS", ((2, 50000),)):
+        optimize_loaded_layer(layer)
+
+    assert layer.simplifyMethod().simplifyHints() & QgsVectorSimplifyMethod.GeometrySimplification
+    assert layer.hasScaleBasedVisibility()
+    assert layer.minimumScale() == 50000
+
+    small_layer = QgsVectorLayer("Point?crs=EPSG:4326", "points", "memory")
+    optimize_loaded_layer(small_layer)
+    assert not small_layer.hasScaleBasedVisibility()
@@ -116,4 +116,84 @@ def test_worker_run_without_bbox(mock_connect, mock_iface, sample_bbox, tmp_path
             st_intersects_found = True
     
     assert st_intersects_found, "Should use ST_Intersects in the query when no bbox column"
-    assert any("Downloading" in msg for msg in progress_messages) 
\ No newline at end of file
+    assert any("Downloading" in msg for msg in progress_messages) 
+
+@patch("duckdb.connect")
+def test_worker_parquet_compression_profile(mock_connect, mock_iface, sample_bbox, tmp_path, sample_validation_results, schema_with_bbox):
+    """Test that the selected compression profile from formats.json is used for Parquet output"""
+    mock_conn = MockConnection(schema_data=schema_with_bbox)
+    mock_connect.return_value = mock_conn
+
+    worker = Worker(
+        "https://example.com/test.parquet",
+        sample_bbox,
+        os.path.join(tmp_path, "output.parquet"),
+        mock_iface,
+        sample_validation_results
+    )
+    worker.direct_to_layer = False
+    worker.compression_profile = "fast"
+
+    worker.run()
+
+    copy_queries = [query for query in mock_conn.executed_queries if "COPY" in query]
+    assert copy_queries, "Should write the output with COPY"
+    assert "COMPRESSION 'ZSTD', COMPRESSION_LEVEL 1)" in copy_queries[-1]
+
+class PartitionStatsConnection(MockConnection):
+    def execute(self, query):
+        if "GROUP BY" in query:
+            self.executed_queries.append(query)
+            return MockResult([(1, 0.0, 0.0, 1.0, 1.0, self.count_result)])
+        return super().execute(query)
+
+@patch("duckdb.connect")
+def test_worker_partitioned_parquet(mock_connect, mock_iface, sample_bbox, tmp_path, sample_validation_results, schema_with_bbox):
+    """Test that partitioned output writes a folder with PARTITION_BY and an index file"""
+    mock_conn = PartitionStatsConnection(schema_data=schema_with_bbox)
+    mock_connect.return_value = mock_conn
+    os.makedirs(tmp_path / "output")
+
+    info_messages = []
+    worker = Worker(
+        "https://example.com/test.parquet",
+        sample_bbox,
+        os.path.join(tmp_path, "output.parquet"),
+        mock_iface,
+        sample_validation_results
+    )
+    worker.direct_to_layer = False
+    worker.partitioning = "hilbert"
+    worker.info.connect(lambda msg: info_messages.append(msg))
+
+    worker.run()
+
+    assert any("PARTITION_BY (hilbert_range)" in query for query in mock_conn.executed_queries)
+    assert any("ntile(1)" in query for query in mock_conn.executed_queries)
+    assert os.path.exists(tmp_path / "output" / "_partitions.json")
+    assert any("_partitions.json" in msg for msg in info_messages)
+
+@patch("duckdb.connect")
+def test_worker_duckdb_workspace(mock_connect, mock_iface, sample_bbox, tmp_path, sample_validation_results, schema_with_bbox):
+    """Test DuckDB output is appended to a per-dataset table with an R-tree index"""
+    # The COUNT(*) returning 1 also reports the workspace table as existing
+    mock_conn = MockConnection(schema_data=schema_with_bbox)
+    mock_connect.return_value = mock_conn
+
+    worker = Worker(
+        "https://example.com/fields.parquet",
+        sample_bbox,
+        os.path.join(tmp_path, "workspace.duckdb"),
+        mock_iface,
+        sample_validation_results
+    )
+    worker.direct_to_layer = False
+    worker.duckdb_append = True
+    worker.duckdb_rtree = True
+
+    worker.run()
+
+    assert any("CREATE TEMP TABLE download_data" in query for query in mock_conn.executed_queries)
+    assert any('DELETE FROM "fields"' in query for query in mock_conn.executed_queries)
+    assert any('INSERT INTO "fields" BY NAME' in query for query in mock_conn.executed_queries)
+    assert any("USING RTREE" in query for query in mock_conn.executed_queries)
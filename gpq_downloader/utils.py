@@ -1,11 +1,75 @@
-import json
-
-from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject
-from qgis.PyQt.QtCore import pyqtSignal, QObject
 import os
-import duckdb
+import threading
+from dataclasses import replace
+
+from qgis.core import (
+    QgsApplication,
+    QgsCoordinateReferenceSystem,
+    QgsCoordinateTransform,
+    QgsFeature,
+    QgsFeatureSource,
+    QgsField,
+    QgsGeometry,
+    QgsProject,
+    QgsSettings,
+    QgsVectorDataProvider,
+    QgsVectorLayer,
+    QgsVectorSimplifyMethod,
+    QgsWkbTypes,
+)
+from qgis.PyQt.QtCore import pyqtSignal, QCoreApplication, QObject, QVariant
+from pathlib import Path
 
 from . import logger
+from .engine import (
+    GEOJSON_SIZE_WARNING_MB,
+    DownloadEngine,
+    DownloadJob,
+    estimate_file_size,
+    meters_to_degrees,
+    output_stays_in_4326,
+    process_schema_columns,
+)
+from .extensions import load_extensions
+from .planner import PLAN_CACHE_FILE
+from .range_cache import DEFAULT_RANGE_CACHE_MB, RANGE_CACHE_DIR, enable_range_cache
+from .remote_io import REMOTE_TUNING_FILE, RemoteTuning
+from .registry import get_presets
+from .daemon import run_in_daemon
+from .subprocess_runner import run_in_subprocess
+
+# Results with fewer rows than this are loaded straight into a memory layer
+# when "direct to layer" mode is enabled
+MEMORY_LAYER_MAX_ROWS = 100000
+# Number of rows pulled from DuckDB per batch while filling a memory layer
+MEMORY_LAYER_BATCH_SIZE = 10000
+SIMPLIFY_MODES = ("none", "scale", "custom")
+# (feature count, scale) pairs: loaded layers with more features than the count
+# are hidden when zoomed out beyond 1:scale, so QGIS doesn't draw them all
+LARGE_LAYER_SCALE_LIMITS = ((5000000, 25000), (1000000, 100000), (250000, 500000))
+# Vertices closer than this many pixels are merged while rendering
+RENDER_SIMPLIFY_THRESHOLD = 1.0
+
+
+def plan_cache_path():
+    """Location of the filter plan cache in the QGIS user profile"""
+    return os.path.join(
+        QgsApplication.qgisSettingsDirPath(), "gpq_downloader", PLAN_CACHE_FILE
+    )
+
+
+def remote_tuning_path():
+    """Location of the per-host remote I/O tuning in the QGIS user profile"""
+    return os.path.join(
+        QgsApplication.qgisSettingsDirPath(), "gpq_downloader", REMOTE_TUNING_FILE
+    )
+
+
+def range_cache_path():
+    """Folder of the remote byte range cache in the QGIS user profile"""
+    return os.path.join(
+        QgsApplication.qgisSettingsDirPath(), "gpq_downloader", RANGE_CACHE_DIR
+    )
 
 
 def transform_bbox_to_4326(extent, source_crs):
@@ -21,27 +85,173 @@ def transform_bbox_to_4326(extent, source_crs):
     """
     if extent is None or source_crs is None:
         return None
-        
+
     dest_crs = QgsCoordinateReferenceSystem("EPSG:4326")
 
     if source_crs != dest_crs:
         transform = QgsCoordinateTransform(source_crs, dest_crs, QgsProject.instance())
         extent = transform.transformBoundingBox(extent)
-    
+
     return extent
 
 
+def selected_features_aoi(layer):
+    """
+    Merge the selected features of a polygon layer into an area of interest
+
+    Args:
+        layer (QgsMapLayer): The layer holding the selection, e.g. the active layer
+
+    Returns:
+        QgsGeometry: The union of the selected polygons in EPSG:4326, or None if
+        the layer isn't a polygon layer or has no selected geometries
+    """
+    if (
+        not isinstance(layer, QgsVectorLayer)
+        or layer.geometryType() != QgsWkbTypes.PolygonGeometry
+    ):
+        return None
+
+    geometries = [f.geometry() for f in layer.selectedFeatures() if f.hasGeometry()]
+    if not geometries:
+        return None
+
+    aoi = QgsGeometry.unaryUnion(geometries)
+    dest_crs = QgsCoordinateReferenceSystem("EPSG:4326")
+    if layer.crs() != dest_crs:
+        aoi.transform(QgsCoordinateTransform(layer.crs(), dest_crs, QgsProject.instance()))
+    return aoi
+
+
+def optimize_loaded_layer(layer):
+    """
+    Prepare a layer opened from a downloaded file for fast rendering
+
+    Builds a spatial index when the format has none and the provider can make
+    one, simplifies lines and polygons while rendering, and hides layers with
+    many features at small scales.
+
+    Args:
+        layer (QgsVectorLayer): The opened layer, before it's added to the project
+    """
+    provider = layer.dataProvider()
+    if (
+        provider.capabilities() & QgsVectorDataProvider.CreateSpatialIndex
+        and provider.hasSpatialIndex() != QgsFeatureSource.SpatialIndexPresent
+    ):
+        provider.createSpatialIndex()
+
+    if layer.geometryType() in (QgsWkbTypes.LineGeometry, QgsWkbTypes.PolygonGeometry):
+        simplify_method = QgsVectorSimplifyMethod()
+        simplify_method.setSimplifyHints(QgsVectorSimplifyMethod.GeometrySimplification)
+        simplify_method.setSimplifyAlgorithm(QgsVectorSimplifyMethod.Distance)
+        simplify_method.setThreshold(RENDER_SIMPLIFY_THRESHOLD)
+        # Let providers that can simplify on their side do so
+        simplify_method.setForceLocalOptimization(False)
+        layer.setSimplifyMethod(simplify_method)
+
+    feature_count = layer.featureCount()
+    for min_features, scale in LARGE_LAYER_SCALE_LIMITS:
+        if feature_count > min_features:
+            layer.setScaleBasedVisibility(True)
+            layer.setMinimumScale(scale)
+            break
+
+
+def memory_layer_geometry_type(geometry_types, has_z=False):
+    """
+    Pick the memory layer geometry type that can hold all the given geometry types
+
+    Args:
+        geometry_types (list): Geometry type names as returned by ST_GeometryType
+        has_z (bool): Whether any of the geometries have Z values
+
+    Returns:
+        str: A memory provider geometry type such as "MultiPolygon", or None if
+        the types can't share a single layer
+    """
+    names = {str(t).upper() for t in geometry_types if t}
+    if not names:
+        return None
+
+    base_types = {name.replace("MULTI", "") for name in names}
+    if len(base_types) != 1:
+        return None
+
+    display_names = {
+        "POINT": "Point",
+        "LINESTRING": "LineString",
+        "POLYGON": "Polygon",
+    }
+    base_type = display_names.get(base_types.pop())
+    if base_type is None:
+        return None
+
+    if any(name.startswith("MULTI") for name in names):
+        base_type = f"Multi{base_type}"
+    if has_z:
+        base_type = f"{base_type}Z"
+    return base_type
+
+
+def fetch_row_batches(cursor, batch_size):
+    """
+    Read a query result in batches of row tuples
+
+    With pyarrow installed DuckDB hands over Arrow record batches, which are
+    converted a column at a time; otherwise rows are fetched as tuples.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            yield rows
+            rows = cursor.fetchmany(batch_size)
+        return
+    for batch in cursor.fetch_record_batch(batch_size):
+        yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def memory_field_type(duckdb_type):
+    """
+    Map a DuckDB column type to a QVariant field type for a memory layer
+
+    Args:
+        duckdb_type (str): The DuckDB type name, e.g. "BIGINT"
+
+    Returns:
+        tuple: (QVariant type, SQL type to cast the column to or None)
+    """
+    type_name = duckdb_type.upper()
+    if type_name in ("TINYINT", "SMALLINT", "INTEGER", "UTINYINT", "USMALLINT"):
+        return QVariant.Int, "INTEGER"
+    if type_name in ("BIGINT", "UINTEGER", "HUGEINT", "UBIGINT"):
+        return QVariant.LongLong, "BIGINT"
+    if type_name in ("FLOAT", "DOUBLE") or type_name.startswith("DECIMAL"):
+        return QVariant.Double, "DOUBLE"
+    if type_name == "BOOLEAN":
+        return QVariant.Bool, None
+    if type_name == "DATE":
+        return QVariant.Date, None
+    if type_name.startswith("TIMESTAMP"):
+        return QVariant.DateTime, "TIMESTAMP"
+    return QVariant.String, "VARCHAR"
+
+
 class Worker(QObject):
     finished = pyqtSignal()
     error = pyqtSignal(str)
     load_layer = pyqtSignal(str)
+    load_memory_layer = pyqtSignal(object, str)
     info = pyqtSignal(str)
     progress = pyqtSignal(str)
     percent = pyqtSignal(int)
     file_size_warning = pyqtSignal(float)  # Signal for file size warnings (in MB)
 
-    def __init__(self, dataset_url, extent, output_file, iface, validation_results, layer_name=None):
+    def __init__(self, dataset_url, extent, output_file, iface, validation_results, layer_name=None, aoi_geometry=None):
         super().__init__()
+        logger.install_log_handler()
         self.dataset_url = dataset_url
         self.extent = extent
         self.output_file = output_file
@@ -49,381 +259,334 @@ class Worker(QObject):
         #logger.log(f"Worker __init__ received validation_results: {validation_results}")
         self.validation_results = validation_results
         self.killed = False
+        self.cancel_event = threading.Event()
         self.layer_name = layer_name  # Ensure this is included if needed
+        # Polygon in EPSG:4326 to download instead of the extent
+        self.aoi_geometry = aoi_geometry
         self.size_warning_accepted = False  # Ensure this is False on initialization
-
-    def get_bbox_info_from_metadata(self, conn):
-        """Read GeoParquet metadata to find bbox column info"""
-        self.progress.emit("Checking for bbox metadata...")
-        metadata_query = (
-            f"SELECT key, value FROM parquet_kv_metadata('{self.dataset_url}')"
+        self.direct_to_layer = QgsSettings().value(
+            "gpq_downloader/direct_to_layer",
+            True,
+            type=bool,
+            section=QgsSettings.Plugins,
         )
-        metadata_results = conn.execute(metadata_query).fetchall()
-
-        for key, value in metadata_results:
-            if key == b"geo":
-                try:
-                    decoded_value = value.decode()
-                    #logger.log("\nRaw metadata value:")
-                    #logger.log(decoded_value)
-
-                    # Parse JSON using DuckDB's JSON functions
-                    json_query = (
-                        f"SELECT json_parse('{decoded_value}'::VARCHAR) as json"
-                    )
-                    #logger.log("\nExecuting JSON query:")
-                    #logger.log(json_query)
-
-                    geo_metadata = conn.execute(json_query).fetchone()[0]
-                    #logger.log("\nParsed metadata:")
-                    #logger.log(geo_metadata)
-
-                    if geo_metadata and "covering" in geo_metadata:
-                        #logger.log("\nFound covering:")
-                        #logger.log(geo_metadata["covering"])
-                        if "bbox" in geo_metadata["covering"]:
-                            bbox_info = geo_metadata["covering"]["bbox"]
-                            #logger.log("\nExtracted bbox info:")
-                            #logger.log(bbox_info)
-                            return bbox_info
-                except Exception as e:
-                    logger.log(f"\nError parsing geo metadata: {str(e)}", 2)
-                    logger.log(f"Exception type: {type(e)}", 2)
-                    import traceback
-
-                    logger.log(traceback.format_exc(), 2)
-                    continue
+        self.direct_to_layer_max_rows = QgsSettings().value(
+            "gpq_downloader/direct_to_layer_max_rows",
+            MEMORY_LAYER_MAX_ROWS,
+            type=int,
+            section=QgsSettings.Plugins,
+        )
+        self.compression_profile = QgsSettings().value(
+            "gpq_downloader/parquet_compression_profile",
+            "",
+            type=str,
+            section=QgsSettings.Plugins,
+        )
+        self.partitioning = QgsSettings().value(
+            "gpq_downloader/parquet_partitioning",
+            "none",
+            type=str,
+            section=QgsSettings.Plugins,
+        )
+        self.optimize_for_requery = QgsSettings().value(
+            "gpq_downloader/optimize_for_requery",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.duckdb_append = QgsSettings().value(
+            "gpq_downloader/duckdb_append",
+            True,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.duckdb_rtree = QgsSettings().value(
+            "gpq_downloader/duckdb_rtree",
+            True,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.extension_repository = QgsSettings().value(
+            "gpq_downloader/extension_repository",
+            "",
+            type=str,
+            section=QgsSettings.Plugins,
+        )
+        self.clip_to_area = QgsSettings().value(
+            "gpq_downloader/clip_to_area",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.clip_keep_original_id = QgsSettings().value(
+            "gpq_downloader/clip_keep_original_id",
+            True,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.simplify_mode = QgsSettings().value(
+            "gpq_downloader/simplify_mode",
+            "none",
+            type=str,
+            section=QgsSettings.Plugins,
+        )
+        self.simplify_tolerance_m = QgsSettings().value(
+            "gpq_downloader/simplify_tolerance_m",
+            10.0,
+            type=float,
+            section=QgsSettings.Plugins,
+        )
+        self.quantize = QgsSettings().value(
+            "gpq_downloader/quantize",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.quantize_decimals = QgsSettings().value(
+            "gpq_downloader/quantize_decimals",
+            6,
+            type=int,
+            section=QgsSettings.Plugins,
+        )
+        self.reproject_to_project = QgsSettings().value(
+            "gpq_downloader/reproject_to_project",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.range_cache = QgsSettings().value(
+            "gpq_downloader/range_cache",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.range_cache_max_mb = QgsSettings().value(
+            "gpq_downloader/range_cache_max_mb",
+            DEFAULT_RANGE_CACHE_MB,
+            type=int,
+            section=QgsSettings.Plugins,
+        )
+        self.run_in_subprocess = QgsSettings().value(
+            "gpq_downloader/run_in_subprocess",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        self.use_daemon = QgsSettings().value(
+            "gpq_downloader/use_daemon",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
+        # CRS the output is written in, set from the map canvas when the download runs
+        self.target_crs = QgsCoordinateReferenceSystem("EPSG:4326")
+
+    def simplify_tolerance(self, bbox):
+        """
+        Simplification tolerance in degrees for the chosen simplify mode
+
+        "scale" uses the size of one screen pixel at the current map scale, so
+        the simplified data looks the same as the original at that scale.
+        """
+        if self.simplify_mode == "scale":
+            width = self.iface.mapCanvas().mapSettings().outputSize().width()
+            return bbox.width() / max(width, 1)
+        if self.simplify_mode == "custom" and self.simplify_tolerance_m > 0:
+            return meters_to_degrees(self.simplify_tolerance_m)
         return None
 
-    def support_s3_style_urls(self, conn):
-        if "minio://" in self.dataset_url:
-            url = self.dataset_url[len("minio://"):]
-            first_slash = url.find("/")
-            if first_slash == -1:
-                return
-            
-            host = url[:first_slash]
-            path = "s3://" + url[first_slash+1:]
-            
-            conn.execute("SET s3_url_style='path';")
-            conn.execute(f"SET s3_endpoint='{host}';")
-            return path
-        return self.dataset_url
+    def build_job(self, bbox):
+        """
+        Describe this download as an engine job
+
+        Args:
+            bbox (QgsRectangle): The area to download in EPSG:4326, replaced by the
+                bounding box of the area of interest polygon when there is one
+
+        Returns:
+            DownloadJob: The job for the download engine
+        """
+        # Scale based simplification follows the map view, not the area of interest
+        simplify_tolerance = self.simplify_tolerance(bbox)
+        aoi_wkb = None
+        if self.aoi_geometry is not None:
+            bbox = self.aoi_geometry.boundingBox()
+            aoi_wkb = bytes(self.aoi_geometry.asWkb())
+        return DownloadJob(
+            dataset_url=self.dataset_url,
+            bbox=(bbox.xMinimum(), bbox.yMinimum(), bbox.xMaximum(), bbox.yMaximum()),
+            output_file=self.output_file,
+            layer_name=self.layer_name,
+            bbox_column=self.validation_results.get('bbox_column'),
+            geometry_column=self.validation_results.get('geometry_column'),
+            compression_profile=self.compression_profile,
+            partitioning=self.partitioning,
+            optimize_for_requery=self.optimize_for_requery,
+            duckdb_append=self.duckdb_append,
+            duckdb_rtree=self.duckdb_rtree,
+            extension_repository=self.extension_repository,
+            geojson_size_limit_mb=None if self.size_warning_accepted else GEOJSON_SIZE_WARNING_MB,
+            memory_layer_max_rows=self.direct_to_layer_max_rows if self.direct_to_layer else 0,
+            aoi_wkb=aoi_wkb,
+            clip=self.clip_to_area,
+            keep_original_id=self.clip_keep_original_id,
+            simplify_tolerance=simplify_tolerance,
+            precision_decimals=self.quantize_decimals if self.quantize else None,
+            target_crs=self.target_crs.authid() or self.target_crs.toWkt(),
+            plan_cache=plan_cache_path(),
+            remote_tuning=remote_tuning_path(),
+            range_cache=range_cache_path() if self.range_cache else None,
+            range_cache_max_mb=self.range_cache_max_mb,
+        )
 
     def run(self):
+        layer_info = f" for {self.layer_name}" if self.layer_name else ""
         try:
-            layer_info = f" for {self.layer_name}" if self.layer_name else ""
-            self.progress.emit(f"Connecting to database{layer_info}...")
             source_crs = self.iface.mapCanvas().mapSettings().destinationCrs()
             bbox = transform_bbox_to_4326(self.extent, source_crs)
-
-            # Log validation results dictionary at the beginning of run
-            #logger.log(f"Full validation_results at start of run: {self.validation_results}")
-
-            conn = duckdb.connect()
-            try:
-                # Install and load the spatial extension
-                self.progress.emit(f"Loading spatial extension{layer_info}...")
-
-                if self.output_file.lower().endswith('.duckdb'):
-                    conn = duckdb.connect(self.output_file)  # Connect directly to output file
-                else:
-                    conn = duckdb.connect() 
-
-                conn.execute("INSTALL httpfs;")
-                conn.execute("INSTALL spatial;")
-                conn.execute("LOAD httpfs;")
-                conn.execute("LOAD spatial;")
-
-                url = self.support_s3_style_urls(conn)
-
-                # Get schema early as we need it for both column names and bbox check
-                schema_query = f"DESCRIBE SELECT * FROM read_parquet('{url}')"
-                schema_result = conn.execute(schema_query).fetchall()
-                self.validation_results['schema'] = schema_result
-                
-                # Log the schema for debugging
-                #logger.log("Schema in Worker:")
-                #for row in schema_result:
-                    #logger.log(f"Column: {row[0]}, Type: {row[1]}")
-
-                # If geometry_column is not in validation_results, detect it now
-                if 'geometry_column' not in self.validation_results:
-                    #logger.log("No geometry_column in validation_results, detecting now")
-                    self.validation_results['geometry_column'] = 'geometry'  # Default
-                    geometry_found = False
-                    
-                    for row in schema_result:
-                        col_name = row[0]
-                        col_type = row[1].upper()
-                        #logger.log(f"Checking column {col_name} with type {col_type} for geometry")
-                        if 'GEOMETRY' in col_type or 'GEOGRAPHY' in col_type:
-                            self.validation_results['geometry_column'] = col_name
-                            logger.log(f"Found geometry column by type: {col_name}")
-                            geometry_found = True
-                            break
-                    
-                    if not geometry_found:
-                        # Try a different approach - look for columns
-                        #logger.log("No standard geometry column found, trying alternative detection")
-                        for row in schema_result:
-                            col_name = row[0].lower()
-                            if col_name == 'geom' or col_name == 'the_geom' or col_name == 'wkb_geometry':
-                                self.validation_results['geometry_column'] = row[0]  # Use original case
-                                #logger.log(f"Found likely geometry column by name: {row[0]}")
-                                geometry_found = True
-                                break
-                
-               #logger.log(f"Final geometry column detection result: {self.validation_results['geometry_column']}")
-
-                table_name = "download_data"
-
-                self.progress.emit(f"Preparing query{layer_info}...")
-                select_query = "SELECT *"
-                if not self.output_file.endswith(".parquet"):
-                    # Construct the SELECT clause with array conversion to strings
-                    columns = []
-                    for row in schema_result:
-                        col_name = row[0]
-                        col_type = row[1]
-                        
-                        # Quote the column name to handle special characters
-                        quoted_col_name = f'"{col_name}"'
-                        
-                        if 'STRUCT' in col_type.upper() or 'MAP' in col_type.upper():
-                            columns.append(f"TO_JSON({quoted_col_name}) AS {quoted_col_name}")
-                        elif '[]' in col_type:  # Check for array types like VARCHAR[]
-                            columns.append(f"array_to_string({quoted_col_name}, ', ') AS {quoted_col_name}")
-                        elif col_type.upper() == 'UTINYINT':
-                            columns.append(f"CAST({quoted_col_name} AS INTEGER) AS {quoted_col_name}")
-                        else:
-                            columns.append(quoted_col_name)
-
-                    # Check if this is Overture data and has a names column
-                    has_names_column = any('names' in row[0] for row in schema_result)
-                    if 'overture' in self.dataset_url and has_names_column:
-                        select_query = f'SELECT "names"."primary" as name,{", ".join(columns)}'
-                    else:
-                        select_query = f'SELECT {", ".join(columns)}'
-
-                # First check: Does the schema actually have a bbox column?
-                has_bbox_in_schema = False
-                if 'schema' in self.validation_results and self.validation_results['schema']:
-                    for row in self.validation_results['schema']:
-                        if row[0].lower() == 'bbox' and 'struct' in row[1].lower():
-                            has_bbox_in_schema = True
-                            #logger.log("Found actual bbox column in schema")
-                            break
-                    
-                    if not has_bbox_in_schema:
-                        #logger.log("No bbox column found in schema, overriding validation_results")
-                        # Force override incorrect bbox settings if schema doesn't have bbox
-                        self.validation_results['has_bbox'] = False
-                        self.validation_results['bbox_column'] = None
-
-                # Now use the corrected validation_results
-                bbox_column = self.validation_results.get('bbox_column')
-                geometry_column = self.validation_results.get('geometry_column', 'geometry')
-                #logger.log(f"Final bbox_column value: {bbox_column}")
-                #logger.log(f"Using geometry column: {geometry_column}")
-
-                if bbox_column is not None:
-                    #logger.log(f"Using bbox column for query: {bbox_column}")
-                    where_clause = f"""
-                    WHERE "{bbox_column}".xmin BETWEEN {bbox.xMinimum()} AND {bbox.xMaximum()}
-                    AND "{bbox_column}".ymin BETWEEN {bbox.yMinimum()} AND {bbox.yMaximum()}
-                    """
-                else:
-                    #logger.log("Using spatial filter instead of bbox")
-                    where_clause = f"""
-                    WHERE ST_Intersects(
-                        "{geometry_column}",
-                        ST_GeomFromText('POLYGON(({bbox.xMinimum()} {bbox.yMinimum()},
-                                            {bbox.xMaximum()} {bbox.yMinimum()},
-                                            {bbox.xMaximum()} {bbox.yMaximum()},
-                                            {bbox.xMinimum()} {bbox.yMaximum()},
-                                            {bbox.xMinimum()} {bbox.yMinimum()}))')
-                    )
-                    """
-
-                url = self.support_s3_style_urls(conn)
-                
-                # Base query
-                base_query = f"""
-                CREATE TABLE {table_name} AS (
-                    {select_query} FROM read_parquet('{url}')
-                    {where_clause}
-                ) 
-                """
-                self.progress.emit(f"Downloading{layer_info} data...")
-                logger.log("Executing SQL query:")
-                logger.log(base_query)
-                conn.execute(base_query)
-                
-                # Add check for empty results
-                row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-                if row_count == 0:
-                    self.info.emit(f"No data found{layer_info} in the requested area. Check that your map extent overlaps with the data and/or expand your map extent. Skipping to next dataset if available.")
-                    self.finished.emit()  # Ensure finished signal is emitted
-                    return
-
-                self.progress.emit(f"Processing{layer_info} data to requested format...")
-
-                file_extension = self.output_file.lower().split('.')[-1]
-
-                if file_extension == 'duckdb':
-                    # Commit the transaction to ensure the data is saved
-                    conn.commit()
-                    if not self.killed:
-                        self.info.emit(
-                            "Data has been successfully saved to DuckDB database.\n\n"
-                            "Note: QGIS does not currently support loading DuckDB files directly."
-                        )
-                else:
-                    # Check size if exporting to GeoJSON
-                    if self.output_file.lower().endswith('.geojson'):
-                        estimated_size = self.estimate_file_size(conn, table_name)
-                        if estimated_size > 4096 and not self.size_warning_accepted:  # 4GB warning threshold
-                            self.file_size_warning.emit(estimated_size)
-                            return
-
-                    # Use the geometry column from validation results for the Hilbert sorting
-                    copy_query = f"""
-                    COPY (
-                        SELECT * FROM {table_name}
-                        ORDER BY ST_Hilbert(
-                            "{geometry_column}",
-                            (SELECT ST_Extent(ST_Extent_Agg("{geometry_column}"))::BOX_2D FROM {table_name})
-                        )
-                    ) TO '{self.output_file}'"""
-
-                    if file_extension == "parquet":
-                        format_options = "(FORMAT 'parquet', COMPRESSION 'ZSTD', COMPRESSION_LEVEL 22);"
-                    elif self.output_file.endswith(".gpkg"):
-                        format_options = "(FORMAT GDAL, DRIVER 'GPKG');"
-                    elif self.output_file.endswith(".fgb"):
-                        format_options = "(FORMAT GDAL, DRIVER 'FlatGeobuf', SRS 'EPSG:4326');"
-                    elif self.output_file.endswith(".geojson"):
-                        format_options = "(FORMAT GDAL, DRIVER 'GeoJSON', SRS 'EPSG:4326');"
-                    else:
-                        self.error.emit("Unsupported file format.")
-                    
-                    logger.log("Executing SQL query:")
-                    logger.log(copy_query + format_options)
-                    conn.execute(copy_query + format_options)
-
-                
-                if self.killed:
-                    return
-
-                if not self.killed:
-                    if self.output_file.lower().endswith('.duckdb'):
-                        self.info.emit(
-                            "Data has been successfully saved to DuckDB database.\n\n"
-                            "Note: QGIS does not currently support loading DuckDB files directly."
-                        )
-                    else:
-                        self.load_layer.emit(self.output_file)
-                    self.finished.emit()
-
-            except Exception as e:
-                if not self.killed:
-                    # Change error to info if it's a "no data" error
-                    error_str = str(e)
-                    if "No data found" in error_str:
-                        self.info.emit(f"No data found{layer_info} in the requested area for {self.dataset_url}. Skipping to next dataset if available.")
-                        self.finished.emit()  # Ensure finished signal is emitted
-                    else:
-                        self.error.emit(error_str)
-            finally:
-                if not self.output_file.lower().endswith('.duckdb'): # Clean up temporary table
-                    try:
-                        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
-                    except:
-                        pass
-                conn.close()
-
+            if (
+                self.reproject_to_project
+                and source_crs.isValid()
+                and not output_stays_in_4326(self.output_file)
+            ):
+                self.target_crs = source_crs
+
+            job = self.build_job(bbox)
+            # Features can't be handed over from another process, so the
+            # output file is always written by the daemon and the subprocess
+            if self.use_daemon:
+                result = run_in_daemon(
+                    replace(job, memory_layer_max_rows=0),
+                    progress=self.progress.emit,
+                    cancel_event=self.cancel_event,
+                )
+            elif self.run_in_subprocess:
+                result = run_in_subprocess(
+                    replace(job, memory_layer_max_rows=0),
+                    progress=self.progress.emit,
+                    cancel_event=self.cancel_event,
+                )
+            else:
+                engine = DownloadEngine(
+                    job,
+                    progress=self.progress.emit,
+                    cancel_event=self.cancel_event,
+                    row_consumer=self.build_memory_layer if self.direct_to_layer else None,
+                )
+                result = engine.run()
         except Exception as e:
             if not self.killed:
-                self.error.emit(str(e))
+                # Change error to info if it's a "no data" error
+                error_str = str(e)
+                if "No data found" in error_str:
+                    self.info.emit(f"No data found{layer_info} in the requested area for {self.dataset_url}. Skipping to next dataset if available.")
+                    self.finished.emit()  # Ensure finished signal is emitted
+                else:
+                    self.error.emit(error_str)
+            return
+
+        # Later datasets in the queue reuse what was learned about this one
+        if result.schema is not None:
+            self.validation_results['schema'] = result.schema
+            self.validation_results['geometry_column'] = result.geometry_column
+            if result.bbox_column is None:
+                self.validation_results['has_bbox'] = False
+                self.validation_results['bbox_column'] = None
+
+        if self.killed or result.status == "cancelled":
+            return
+        if result.status == "size_warning":
+            self.file_size_warning.emit(result.estimated_size_mb)
+            return
+
+        if result.status == "memory":
+            self.load_memory_layer.emit(result.layer, result.message)
+        elif result.status == "written":
+            self.load_layer.emit(result.output)
+        elif result.status == "duckdb":
+            self.info.emit(
+                f"{result.message}\n\n"
+                "Note: QGIS does not currently support loading DuckDB files directly."
+            )
+        else:
+            self.info.emit(result.message)
+        self.finished.emit()
 
     def kill(self):
         self.killed = True
+        self.cancel_event.set()
+
+    def build_memory_layer(self, conn, table_name, geometry_column):
+        """Stream the downloaded rows into a QGIS memory layer, skipping any file output"""
+        type_rows = conn.execute(
+            f'SELECT DISTINCT ST_GeometryType("{geometry_column}") FROM {table_name}'
+        ).fetchall()
+        if memory_layer_geometry_type([row[0] for row in type_rows]) is None:
+            return None
+        has_z = conn.execute(
+            f'SELECT COALESCE(bool_or(ST_HasZ("{geometry_column}")), false) FROM {table_name}'
+        ).fetchone()[0]
+        geometry_type = memory_layer_geometry_type([row[0] for row in type_rows], has_z)
+        if geometry_type is None:
+            return None
+
+        layer_name = self.layer_name or Path(self.output_file).stem
+        layer = QgsVectorLayer(geometry_type, layer_name, "memory")
+        layer.setCrs(self.target_crs)
+        provider = layer.dataProvider()
+
+        fields = []
+        select_columns = []
+        for row in conn.execute(f"DESCRIBE {table_name}").fetchall():
+            col_name, col_type = row[0], row[1]
+            if col_name == geometry_column:
+                continue
+            field_type, cast_type = memory_field_type(col_type)
+            fields.append(QgsField(col_name, field_type))
+            if cast_type is None:
+                select_columns.append(f'"{col_name}"')
+            elif 'STRUCT' in col_type.upper() or 'MAP' in col_type.upper() or '[]' in col_type:
+                select_columns.append(f'CAST(TO_JSON("{col_name}") AS VARCHAR)')
+            else:
+                select_columns.append(f'CAST("{col_name}" AS {cast_type})')
+        provider.addAttributes(fields)
+        layer.updateFields()
+
+        # Creating the index before adding features keeps it updated during ingest
+        provider.createSpatialIndex()
+
+        select_columns.append(f'ST_AsWKB("{geometry_column}")')
+        cursor = conn.execute(f"SELECT {', '.join(select_columns)} FROM {table_name}")
+        layer_fields = layer.fields()
+        make_multi = geometry_type.startswith("Multi")
+        for rows in fetch_row_batches(cursor, MEMORY_LAYER_BATCH_SIZE):
+            if self.killed:
+                break
+            features = []
+            for row in rows:
+                feature = QgsFeature(layer_fields)
+                feature.setAttributes(list(row[:-1]))
+                if row[-1] is not None:
+                    geometry = QgsGeometry()
+                    geometry.fromWkb(bytes(row[-1]))
+                    if make_multi:
+                        geometry.convertToMultiType()
+                    feature.setGeometry(geometry)
+                features.append(feature)
+            provider.addFeatures(features)
+
+        layer.updateExtents()
+        # Layers must live in the main thread before they are added to the project
+        layer.moveToThread(QCoreApplication.instance().thread())
+        return layer
 
     def estimate_file_size(self, conn, table_name):
         """Estimate the output file size in MB using GeoJSON feature collection structure"""
-        try:
-            # Get total row count
-            row_count = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
-
-            # Use a smaller sample size for large datasets
-            sample_size = min(100, row_count)
-
-            if sample_size > 0:
-                # Create a proper GeoJSON FeatureCollection sample with all properties
-                sample_query = f"""
-                    WITH sample AS (
-                        SELECT * FROM {table_name} LIMIT {sample_size}
-                    )
-                    SELECT AVG(LENGTH(
-                        json_object(
-                            'type', 'Feature',
-                            'geometry', ST_AsGeoJSON(geometry),
-                            'properties', json_object(
-                                {', '.join([
-                    f"'{col[0]}', COALESCE(CAST({col[0]} AS VARCHAR), 'null')"
-                    for col in conn.execute(f"DESCRIBE {table_name}").fetchall()
-                    if col[0] != 'geometry'
-                ])}
-                            )
-                        )::VARCHAR
-                    )) as avg_feature_size
-                    FROM sample;
-                """
-
-                # Get average feature size
-                avg_feature_size = conn.execute(sample_query).fetchone()[0]
-
-                if avg_feature_size:
-                    # Account for GeoJSON overhead
-                    collection_overhead = (
-                        50  # {"type":"FeatureCollection","features":[]}
-                    )
-                    comma_overhead = row_count - 1  # Commas between features
-
-                    total_estimated_bytes = (
-                        (row_count * avg_feature_size)
-                        + collection_overhead
-                        + comma_overhead
-                    )
-                    return total_estimated_bytes / (1024 * 1024)  # Convert to MB
-            return 0
-
-        except Exception as e:
-            logger.log(f"Error estimating file size: {str(e)}", 2)
-            return 0
+        return estimate_file_size(conn, table_name)
 
     def process_schema_columns(self, schema_result):
         """Process schema columns and return formatted SELECT clause"""
-        columns = []
-        for row in schema_result:
-            col_name = row[0]
-            col_type = row[1]
-            quoted_col_name = f'"{col_name}"'
-
-            if "STRUCT" in col_type.upper() or "MAP" in col_type.upper():
-                columns.append(f"TO_JSON({quoted_col_name}) AS {quoted_col_name}")
-            elif "[]" in col_type:
-                columns.append(
-                    f"array_to_string({quoted_col_name}, ', ') AS {quoted_col_name}"
-                )
-            elif col_type.upper() == "UTINYINT":
-                columns.append(
-                    f"CAST({quoted_col_name} AS INTEGER) AS {quoted_col_name}"
-                )
-            else:
-                columns.append(quoted_col_name)
-        return columns
+        return process_schema_columns(schema_result)
 
 
 class ValidationWorker(QObject):
@@ -437,11 +600,19 @@ class ValidationWorker(QObject):
         self.iface = iface
         self.extent = extent
         self.killed = False
-
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        presets_path = os.path.join(base_path, "data", "presets.json")
-        with open(presets_path, "r") as f:
-            self.PRESET_DATASETS = json.load(f)
+        self.PRESET_DATASETS = get_presets()
+        self.extension_repository = QgsSettings().value(
+            "gpq_downloader/extension_repository",
+            "",
+            type=str,
+            section=QgsSettings.Plugins,
+        )
+        self.range_cache = QgsSettings().value(
+            "gpq_downloader/range_cache",
+            False,
+            type=bool,
+            section=QgsSettings.Plugins,
+        )
 
     def check_bbox_metadata(self, conn):
         """Check for bbox information in GeoParquet metadata"""
@@ -458,8 +629,7 @@ class ValidationWorker(QObject):
                     #logger.log(decoded_value)
 
                     # Install and load JSON extension
-                    conn.execute("INSTALL json;")
-                    conn.execute("LOAD json;")
+                    load_extensions(conn, ("json",), self.extension_repository)
 
                     # Create a table with the JSON string
                     conn.execute(
@@ -516,13 +686,16 @@ class ValidationWorker(QObject):
             "geometry_column": "geometry"  # Default fallback
         }
         
+        conn = None
         try:
+            import duckdb
+
             self.progress.emit("Connecting to data source...")
             conn = duckdb.connect()
-            conn.execute("INSTALL spatial;")
-            conn.execute("LOAD spatial;")
-            conn.execute("INSTALL httpfs;")
-            conn.execute("LOAD httpfs;")
+            load_extensions(conn, repository=self.extension_repository)
+            if self.range_cache:
+                # The footer read here is then served from disk to the download
+                enable_range_cache(conn, range_cache_path(), self.extension_repository)
 
             if not self.needs_validation():
                 validation_results.update({
@@ -534,6 +707,7 @@ class ValidationWorker(QObject):
 
             self.progress.emit("Checking data format...")
             url = self.support_s3_style_urls(conn)
+            RemoteTuning(remote_tuning_path()).configure(conn, url)
 
             schema_query = f"DESCRIBE SELECT * FROM read_parquet('{url}')"
             schema_result = conn.execute(schema_query).fetchall()
@@ -572,7 +746,8 @@ class ValidationWorker(QObject):
             # Still emit validation results with default values in case of error
             self.finished.emit(False, f"Error validating source: {str(e)}", validation_results)
         finally:
-            conn.close()
+            if conn is not None:
+                conn.close()
 
     def needs_validation(self):
         """Determine if the dataset needs any validation"""